@@ -0,0 +1,91 @@
+"""
+The compute stage of the toy pipeline: square the number in each input file
+and write it to the output file.
+
+square_file() does one file, as one Ruffus job per file would. square_files()
+does many at once: it reads all inputs with raw os-level I/O, squares them in
+a single vectorized NumPy operation (a list comprehension without NumPy), and
+writes the outputs the same way, so the per-file cost is three system calls
+for each file rather than a Python job, buffered file objects and parsing.
+
+    square_files(["/tmp/toy/file_1_in", ...], ["/tmp/toy/file_1_out1", ...])
+
+Outputs are identical to square_file's, one file per input. NumPy squares in
+64-bit integers: inputs beyond +/-3037000499, including those too large for
+64 bits, fall back to Python integers.
+"""
+
+import os
+
+try:
+    import numpy
+
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
+
+# Largest absolute value whose square fits in an int64
+MAX_INT64_ROOT = 3037000499
+
+_READ_SIZE = 4096
+
+
+def square_file(inputf, outputf):
+    """
+    Square the value read from inputf and save in outputf
+    :param inputf: file to read number from
+    :param outputf: file to save square to
+    :return: void
+    """
+    with open(inputf, 'r') as f:
+        value = int(f.readline().strip())
+    with open(outputf, 'w') as f:
+        f.write(str(value**2))
+
+
+def _read_first_line(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, _READ_SIZE).split(b"\n", 1)[0]
+    finally:
+        os.close(fd)
+
+
+def _write(path, data):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def square_values(values):
+    """
+    Returns the squares of values (a list of bytes holding integers) as
+        a list of bytes
+    """
+    if HAVE_NUMPY and values:
+        try:
+            array = numpy.array(values).astype(numpy.int64)
+        except (OverflowError, ValueError):
+            # a value does not fit in an int64 at all
+            array = None
+        # not numpy.abs: the absolute value of -2**63 is itself
+        if array is not None and -MAX_INT64_ROOT <= array.min() and array.max() <= MAX_INT64_ROOT:
+            return (array * array).astype(bytes).tolist()
+    return [str(int(value) ** 2).encode() for value in values]
+
+
+def square_files(input_paths, output_paths):
+    """
+    Square the value read from each of input_paths and save in the output
+        path at the same position
+    :param input_paths: files to read numbers from
+    :param output_paths: files to save squares to
+    :return: void
+    """
+    if len(input_paths) != len(output_paths):
+        raise ValueError("%d input files but %d output files" % (len(input_paths), len(output_paths)))
+    values = [_read_first_line(path).strip() for path in input_paths]
+    for path, square in zip(output_paths, square_values(values)):
+        _write(path, square)
@@ -0,0 +1,111 @@
+"""
+Benchmarks the compute stage of the toy pipeline: squaring the number in each
+input file one file at a time (batch_compute.square_file, as the per-file
+Ruffus task did) against all files at once (batch_compute.square_files).
+
+For each number of inputs, the input files are created in a temporary
+directory and read once (so both runs find them in the page cache), then each
+version writes its own outputs, which are checked to be identical. Reports:
+
+    per_file_seconds    seconds to square all inputs one file at a time
+    batch_seconds       seconds to square all inputs with square_files
+    speedup             per_file_seconds / batch_seconds
+
+Example:
+
+    python benchmarks/bench_batch_compute.py --inputs 10000,1000000 --json results.json
+
+Results are printed as a table and optionally written as JSON, with the git
+commit, so runs can be compared across commits.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+
+from bench_run_job import git_commit  # noqa: E402
+
+
+def make_inputs(directory, count):
+    import batch_compute
+    input_paths = [os.path.join(directory, "file_%d_in" % i) for i in range(1, count + 1)]
+    for i, path in enumerate(input_paths, 1):
+        batch_compute._write(path, b"%d\n" % i)
+    return input_paths
+
+
+def read_all(paths):
+    import batch_compute
+    return [batch_compute._read_first_line(path) for path in paths]
+
+
+def run_scenario(count, directory):
+    import batch_compute
+
+    input_paths = make_inputs(directory, count)
+    read_all(input_paths)
+    per_file_outputs = [path[:-len("_in")] + "_out_per_file" for path in input_paths]
+    batch_outputs = [path[:-len("_in")] + "_out_batch" for path in input_paths]
+
+    start = time.time()
+    for inputf, outputf in zip(input_paths, per_file_outputs):
+        batch_compute.square_file(inputf, outputf)
+    per_file_seconds = time.time() - start
+
+    start = time.time()
+    batch_compute.square_files(input_paths, batch_outputs)
+    batch_seconds = time.time() - start
+
+    if read_all(per_file_outputs) != read_all(batch_outputs):
+        raise AssertionError("square_files and square_file outputs differ")
+
+    return {"inputs": count,
+            "numpy": batch_compute.HAVE_NUMPY,
+            "per_file_seconds": per_file_seconds,
+            "batch_seconds": batch_seconds,
+            "speedup": per_file_seconds / batch_seconds if batch_seconds else None}
+
+
+COLUMNS = ("inputs", "numpy", "per_file_seconds", "batch_seconds", "speedup")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--inputs", default="10000,1000000",
+                        help="Comma separated numbers of input files per scenario")
+    parser.add_argument("--directory", default=None,
+                        help="Directory in which to create the files (default: a temporary one)")
+    parser.add_argument("--json", dest="json_path",
+                        help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    print("".join("%-18s" % column for column in COLUMNS))
+    for count in [int(count) for count in args.inputs.split(",")]:
+        directory = tempfile.mkdtemp(prefix="bench_batch_compute_", dir=args.directory)
+        try:
+            results.append(run_scenario(count, directory))
+        finally:
+            shutil.rmtree(directory)
+        print("".join("%-18.3f" % value if isinstance(value, float) else "%-18s" % value
+                      for value in (results[-1][column] for column in COLUMNS)))
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"commit": git_commit(),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
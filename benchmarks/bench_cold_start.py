@@ -0,0 +1,170 @@
+"""
+Benchmarks the cold start of the toy pipeline: how long a fresh interpreter
+takes to import mnm_drmaa_wrapper, and how long main.py takes from being
+started to submitting its first drmaa job (to the local scheduler), for each
+number of inputs. Each is measured in new processes, --repeat times; the
+median is reported:
+
+    python_seconds          starting an interpreter that does nothing
+    import_seconds          starting one that imports mnm_drmaa_wrapper
+    main_import_seconds     starting main.py --help: importing main.py and
+                            everything it imports, then parsing the command line
+    first_submit_seconds    starting main.py until its first runJob call
+
+first_submit_seconds covers importing, planning the pipeline, creating the
+input files and preparing the first job. The process exits at the first
+runJob call, so no job is run.
+
+Example:
+
+    python benchmarks/bench_cold_start.py --counts 1000,100000 --json results.json
+
+Results are printed as a table and optionally written as JSON, with the git
+commit, so runs can be compared across commits. The exit status is 1 if a
+median exceeds its budget (--import_budget, --main_import_budget,
+--first_submit_budget), so the benchmark can guard against startup
+regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+
+from bench_run_job import git_commit  # noqa: E402
+
+# Budgets (seconds) for the medians, set for the default scenario (1000 inputs)
+IMPORT_BUDGET = 0.5
+MAIN_IMPORT_BUDGET = 0.5
+FIRST_SUBMIT_BUDGET = 2.5
+
+# Runs main.py (argv[1:]) and prints when its first job is submitted
+FIRST_SUBMIT_PROBE = """
+import runpy, sys, threading, time
+import local_drmaa
+
+def run_job(self, job_template):
+    sys.stdout.write("first submit %r\\n" % time.time())
+    sys.stdout.flush()
+    threading.Event().wait()
+
+local_drmaa.Session.runJob = run_job
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def run_process(args):
+    """
+    Returns the seconds taken by a new python process running args, and its output
+    """
+    start = time.time()
+    process = subprocess.run([sys.executable] + args, cwd=REPO_DIRECTORY,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    seconds = time.time() - start
+    if process.returncode != 0:
+        raise RuntimeError("%s failed:\n%s" % (args, process.stdout.decode(errors="replace")))
+    return seconds, process.stdout.decode(errors="replace")
+
+
+def first_submit_seconds(count, directory):
+    input_path = os.path.join(directory, "toy")
+    start = time.time()
+    # in a process group of its own, as Ruffus' logging manager process outlives it
+    process = subprocess.Popen([sys.executable, "-c", FIRST_SUBMIT_PROBE, "main.py",
+                                "--input_path", input_path, "--count", str(count),
+                                "--verbose", "0", "--target_tasks", "complete_run",
+                                "--drmaa_backend", "local", "--use_threads"],
+                               cwd=REPO_DIRECTORY, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               start_new_session=True)
+    output = []
+    try:
+        for line in process.stdout:
+            line = line.decode(errors="replace")
+            if line.startswith("first submit "):
+                return float(line.split()[-1]) - start
+            output.append(line)
+        raise RuntimeError("main.py did not submit a job:\n%s" % "".join(output))
+    finally:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        process.stdout.close()
+        shutil.rmtree(input_path, ignore_errors=True)
+
+
+def run_scenario(count, repeat, directory):
+    return {"inputs": count,
+            "python_seconds": statistics.median(run_process(["-c", "pass"])[0]
+                                                for _ in range(repeat)),
+            "import_seconds": statistics.median(run_process(["-c", "import mnm_drmaa_wrapper"])[0]
+                                                for _ in range(repeat)),
+            "main_import_seconds": statistics.median(run_process(["main.py", "--help"])[0]
+                                                     for _ in range(repeat)),
+            "first_submit_seconds": statistics.median(first_submit_seconds(count, directory)
+                                                      for _ in range(repeat))}
+
+
+COLUMNS = ("inputs", "python_seconds", "import_seconds", "main_import_seconds", "first_submit_seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--counts", default="1000",
+                        help="Comma separated numbers of input files per scenario")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Processes started per measurement")
+    parser.add_argument("--import_budget", type=float, default=IMPORT_BUDGET,
+                        help="Largest acceptable import_seconds")
+    parser.add_argument("--main_import_budget", type=float, default=MAIN_IMPORT_BUDGET,
+                        help="Largest acceptable main_import_seconds")
+    parser.add_argument("--first_submit_budget", type=float, default=FIRST_SUBMIT_BUDGET,
+                        help="Largest acceptable first_submit_seconds")
+    parser.add_argument("--directory", default=None,
+                        help="Directory in which main.py creates its files (default: a temporary one)")
+    parser.add_argument("--json", dest="json_path",
+                        help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    budgets = {"import_seconds": args.import_budget,
+               "main_import_seconds": args.main_import_budget,
+               "first_submit_seconds": args.first_submit_budget}
+    results = []
+    over_budget = []
+    print("".join("%-22s" % column for column in COLUMNS))
+    for count in [int(count) for count in args.counts.split(",")]:
+        directory = tempfile.mkdtemp(prefix="bench_cold_start_", dir=args.directory)
+        try:
+            results.append(run_scenario(count, args.repeat, directory))
+        finally:
+            shutil.rmtree(directory)
+        print("".join("%-22.3f" % value if isinstance(value, float) else "%-22s" % value
+                      for value in (results[-1][column] for column in COLUMNS)))
+        over_budget += ["%s with %d inputs: %.3f s, budget %.3f s" % (column, count, results[-1][column], budget)
+                        for column, budget in budgets.items() if results[-1][column] > budget]
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"commit": git_commit(),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "budgets": budgets,
+                       "results": results}, f, indent=2)
+
+    if over_budget:
+        print("Over budget:\n    " + "\n    ".join(over_budget))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Benchmarks the overhead of mnm_drmaa_wrapper.run_job against the local
+stand-in scheduler (local_drmaa), so no cluster is needed.
+
+Each scenario (number of jobs x concurrency mode) runs in its own python
+process, so that peak RSS is measured per scenario, and reports:
+
+    submit_rate         jobs/sec submitted (first to last runJob)
+    notice_p50/p99      seconds from a job finishing to run_job returning
+    wall_time           seconds for the whole scenario
+    job_status_calls    drmaa jobStatus calls made
+    drmaa_calls         all drmaa calls made, by name
+    files_created       files created under the job script directory
+    peak_rss            peak resident set size of the driver, in bytes
+
+Example:
+
+    python benchmarks/bench_run_job.py --jobs 10,100,1000 --modes threads,gevent --json results.json
+
+Results are printed as a table and optionally written as JSON, with the git
+commit, so runs can be compared across commits.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+
+POLLING_POLICIES = ("fixed", "backoff", "jittered")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def polling_policy(name):
+    import mnm_drmaa_wrapper
+    if name == "backoff":
+        return mnm_drmaa_wrapper.ExponentialBackoffPollingPolicy()
+    if name == "jittered":
+        return mnm_drmaa_wrapper.JitteredPollingPolicy(mnm_drmaa_wrapper.ExponentialBackoffPollingPolicy())
+    return mnm_drmaa_wrapper.PollingPolicy()
+
+
+def run_scenario(jobs, mode, concurrency, slots, polling, job_launcher=False):
+    """
+    Runs jobs through run_job in this process and returns the measurements
+    """
+    if mode == "gevent":
+        import gevent.pool
+    from concurrent.futures import ThreadPoolExecutor
+    import local_drmaa
+    import mnm_drmaa_wrapper
+
+    session = local_drmaa.Session(slots=slots)
+    session.initialize()
+    job_script_directory = tempfile.mkdtemp(prefix="bench_run_job_")
+    try:
+        # count files opened for writing under the job script directory
+        created = set()
+        write_flags = os.O_WRONLY | os.O_RDWR | os.O_CREAT
+
+        def audit(event, args):
+            if event == "open" and isinstance(args[0], str) and args[0].startswith(job_script_directory):
+                mode_str, flags = args[1], args[2]
+                if (mode_str and ("w" in mode_str or "x" in mode_str)) or (flags & write_flags):
+                    created.add(args[0])
+        sys.addaudithook(audit)
+
+        submit_times = []
+        run_job_submission = session.runJob
+
+        def runJob(job_template):
+            jobid = run_job_submission(job_template)
+            submit_times.append(time.time())
+            return jobid
+        session.runJob = runJob
+
+        policy = polling_policy(polling)
+        notice_latencies = []
+        failures = []
+
+        def run_one(i):
+            try:
+                stdout, _ = mnm_drmaa_wrapper.run_job('echo "$SLURM_JOB_ID"',
+                                                      job_name="bench",
+                                                      job_script_directory=job_script_directory,
+                                                      drmaa_session=session,
+                                                      polling_policy=policy,
+                                                      job_launcher=job_launcher)
+                returned = time.time()
+                jobid = stdout[0].strip()
+                notice_latencies.append(returned - session._jobs[jobid].end_time)
+            except Exception as err:
+                failures.append(str(err))
+
+        start = time.time()
+        if mode == "gevent":
+            pool = gevent.pool.Pool(concurrency)
+            for i in range(jobs):
+                pool.spawn(run_one, i)
+            pool.join()
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(run_one, range(jobs)))
+        wall_time = time.time() - start
+
+        submit_span = (max(submit_times) - min(submit_times)) if len(submit_times) > 1 else 0
+        return {"jobs": jobs,
+                "mode": mode,
+                "concurrency": concurrency,
+                "slots": session.slots,
+                "polling": polling,
+                "job_launcher": job_launcher,
+                "failures": len(failures),
+                "wall_time": wall_time,
+                "submit_rate": (len(submit_times) / submit_span) if submit_span else None,
+                "notice_p50": percentile(notice_latencies, 0.5),
+                "notice_p99": percentile(notice_latencies, 0.99),
+                "job_status_calls": session.call_counts["jobStatus"],
+                "drmaa_calls": dict(session.call_counts),
+                "files_created": len(created),
+                # ru_maxrss is in kilobytes on linux, bytes on macOS
+                "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss *
+                            (1 if sys.platform == "darwin" else 1024)}
+    finally:
+        session.exit()
+        shutil.rmtree(job_script_directory, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIRECTORY,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+COLUMNS = ("jobs", "mode", "wall_time", "submit_rate", "notice_p50", "notice_p99",
+           "job_status_calls", "files_created", "peak_rss", "failures")
+
+
+def print_header():
+    print("".join("%-18s" % column for column in COLUMNS))
+
+
+def print_row(result):
+    cells = []
+    for column in COLUMNS:
+        value = result[column]
+        cells.append("%-18.3f" % value if isinstance(value, float) else "%-18s" % value)
+    print("".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--jobs", default="10,100,1000,10000",
+                        help="Comma separated numbers of jobs per scenario")
+    parser.add_argument("--modes", default="threads,gevent",
+                        help="Comma separated concurrency modes: threads, gevent")
+    parser.add_argument("--concurrency", type=int, default=2000,
+                        help="Maximum number of concurrent run_job calls, as with Ruffus -j")
+    parser.add_argument("--slots", type=int, default=None,
+                        help="Cpus used by the local scheduler (default: all)")
+    parser.add_argument("--polling", choices=POLLING_POLICIES, default="fixed",
+                        help="Polling policy passed to run_job")
+    parser.add_argument("--job_launcher", action="store_true",
+                        help="Run jobs through the shared JobLauncher script")
+    parser.add_argument("--json", dest="json_path",
+                        help="Write the results to this JSON file")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        # child process: run one scenario and print its results
+        jobs, mode = args.scenario.split(":")
+        jobs = int(jobs)
+        print(json.dumps(run_scenario(jobs, mode, min(jobs, args.concurrency),
+                                      args.slots, args.polling, args.job_launcher)))
+        return
+
+    results = []
+    print_header()
+    for jobs in [int(jobs) for jobs in args.jobs.split(",")]:
+        for mode in args.modes.split(","):
+            command = [sys.executable, os.path.abspath(__file__),
+                       "--scenario", "%d:%s" % (jobs, mode),
+                       "--concurrency", str(args.concurrency),
+                       "--polling", args.polling]
+            if args.slots:
+                command += ["--slots", str(args.slots)]
+            if args.job_launcher:
+                command.append("--job_launcher")
+            output = subprocess.check_output(command).decode()
+            results.append(json.loads(output.strip().split("\n")[-1]))
+            print_row(results[-1])
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"commit": git_commit(),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,560 @@
+"""
+A drmaa-compatible stand-in scheduler which runs job scripts on this machine.
+
+Anything with the methods of drmaa.Session (createJobTemplate,
+deleteJobTemplate, runJob, runBulkJobs, jobStatus, control, wait,
+synchronize) can be passed to mnm_drmaa_wrapper.run_job as drmaa_session.
+local_drmaa.Session is such a backend which needs no cluster and no libdrmaa:
+
+    import local_drmaa
+    session = local_drmaa.Session(slots=8, queue_delay=0.5)
+    session.initialize()
+    run_job("echo hello", drmaa_session=session, ...)
+
+Jobs really run, as child processes started in their own process group, at
+most `slots` cpus and `memory` MB at a time (--cpus-per-task, --mem and
+--mem-per-cpu in the native specification are the requests, as for SLURM).
+Waiting jobs are packed onto the free cpus and memory largest first, and one
+which has waited backfill_wait seconds is started before any other. Submitted
+jobs wait queue_delay seconds before they become eligible to run, and each
+drmaa call can be made to fail with DrmCommunicationException with probability
+comm_failure_rate, to exercise the wrapper's retry paths. Finished jobs report
+exit status, signal and resource usage through wait() the way SLURM does.
+
+The module also provides the drmaa names mnm_drmaa_wrapper uses (JobState,
+JobControlAction, JobTemplate, JobInfo, errors), taken from the drmaa package
+when it can be loaded, so exceptions raised here are caught by the wrapper.
+"""
+
+import itertools
+import os
+import random
+import re
+import signal
+import subprocess
+import threading
+import time
+import types
+from collections import Counter, namedtuple
+
+try:
+    import drmaa
+    from drmaa import JobState, JobControlAction, JobInfo
+    from drmaa.errors import (DrmaaException, DrmCommunicationException, ExitTimeoutException,
+                              InvalidJobException)
+    PARAMETRIC_INDEX = drmaa.JobTemplate.PARAMETRIC_INDEX
+    TIMEOUT_WAIT_FOREVER = drmaa.Session.TIMEOUT_WAIT_FOREVER
+    TIMEOUT_NO_WAIT = drmaa.Session.TIMEOUT_NO_WAIT
+    JOB_IDS_SESSION_ANY = drmaa.Session.JOB_IDS_SESSION_ANY
+    JOB_IDS_SESSION_ALL = drmaa.Session.JOB_IDS_SESSION_ALL
+except (ImportError, RuntimeError):
+    # no drmaa bindings, or no libdrmaa for them to load:
+    #   same values as drmaa.const
+    class JobState(object):
+        UNDETERMINED = 'undetermined'
+        QUEUED_ACTIVE = 'queued_active'
+        SYSTEM_ON_HOLD = 'system_on_hold'
+        USER_ON_HOLD = 'user_on_hold'
+        USER_SYSTEM_ON_HOLD = 'user_system_on_hold'
+        RUNNING = 'running'
+        SYSTEM_SUSPENDED = 'system_suspended'
+        USER_SUSPENDED = 'user_suspended'
+        USER_SYSTEM_SUSPENDED = 'user_system_suspended'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    class JobControlAction(object):
+        SUSPEND = 'suspend'
+        RESUME = 'resume'
+        HOLD = 'hold'
+        RELEASE = 'release'
+        TERMINATE = 'terminate'
+
+    JobInfo = namedtuple("JobInfo",
+                         """jobId hasExited hasSignal terminatedSignal hasCoreDump
+                            wasAborted exitStatus resourceUsage""")
+
+    class DrmaaException(Exception):
+        pass
+
+    class DrmCommunicationException(DrmaaException):
+        pass
+
+    class ExitTimeoutException(DrmaaException):
+        pass
+
+    class InvalidJobException(DrmaaException):
+        pass
+
+    PARAMETRIC_INDEX = '$drmaa_incr_ph$'
+    TIMEOUT_WAIT_FOREVER = -1
+    TIMEOUT_NO_WAIT = 0
+    JOB_IDS_SESSION_ANY = b"DRMAA_JOB_IDS_SESSION_ANY"
+    JOB_IDS_SESSION_ALL = b"DRMAA_JOB_IDS_SESSION_ALL"
+
+errors = types.SimpleNamespace(DrmaaException=DrmaaException,
+                               DrmCommunicationException=DrmCommunicationException,
+                               ExitTimeoutException=ExitTimeoutException,
+                               InvalidJobException=InvalidJobException)
+
+
+class JobTemplate(object):
+    """
+    The job attributes used by mnm_drmaa_wrapper
+    """
+    PARAMETRIC_INDEX = PARAMETRIC_INDEX
+
+    def __init__(self):
+        self.remoteCommand = None
+        self.args = []
+        self.jobName = None
+        self.workingDirectory = None
+        self.jobEnvironment = None
+        self.nativeSpecification = None
+        self.outputPath = None
+        self.errorPath = None
+        self.joinFiles = False
+
+
+class _Job(object):
+    """
+    A job submitted to the local scheduler
+    """
+
+    def __init__(self, jobid, command, working_directory, environment,
+                 stdout_path, stderr_path, join_files, cpus, memory, eligible_time):
+        self.jobid = jobid
+        self.command = command
+        self.working_directory = working_directory
+        self.environment = environment
+        self.stdout_path = stdout_path
+        self.stderr_path = stderr_path
+        self.join_files = join_files
+        self.cpus = cpus
+        self.memory = memory
+        self.state = JobState.QUEUED_ACTIVE
+        self.submission_time = time.time()
+        self.eligible_time = eligible_time
+        self.start_time = None
+        self.end_time = None
+        self.process = None
+        self.job_info = None
+        self.reaped = False
+
+
+def _drm_path(path):
+    """
+    Strips the [hostname]: prefix of drmaa paths
+    """
+    if path is None:
+        return None
+    return path.split(":", 1)[1] if ":" in path else path
+
+
+def _requested_cpus(native_specification):
+    match = re.search(r"--cpus-per-task[= ](\d+)", native_specification or "")
+    return int(match.group(1)) if match else 1
+
+
+_MEMORY_UNITS = {"K": 1.0 / 1024, "M": 1, "G": 1024, "T": 1024 ** 2}
+
+
+def _requested_memory(native_specification, cpus):
+    """
+    Memory requested with --mem (per job) or --mem-per-cpu, in MB (the
+        default unit of both), or 0
+    """
+    match = re.search(r"--mem(-per-cpu)?[= ](\d+)([KMGT]?)", native_specification or "")
+    if not match:
+        return 0
+    memory = int(match.group(2)) * _MEMORY_UNITS[match.group(3) or "M"]
+    return memory * cpus if match.group(1) else memory
+
+
+def _physical_memory():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024.0 ** 2
+    except (ValueError, OSError, AttributeError):
+        return float("inf")
+
+
+class Session(object):
+    """
+    Local stand-in for drmaa.Session.
+
+    slots               number of cpus jobs may use at the same time
+                            (default: all)
+    memory              MB of memory jobs may request at the same time
+                            (default: all)
+    backfill_wait       seconds after which a waiting job is no longer
+                            overtaken by smaller ones
+    queue_delay         seconds a job stays queued before it can start, or a
+                            function returning it for each job
+    comm_failure_rate   probability that a drmaa call raises
+                            DrmCommunicationException
+    comm_failure_calls  the calls subject to comm_failure_rate
+    seed                seed for the failure injection
+
+    call_counts counts the drmaa calls made, by name.
+    """
+
+    TIMEOUT_WAIT_FOREVER = TIMEOUT_WAIT_FOREVER
+    TIMEOUT_NO_WAIT = TIMEOUT_NO_WAIT
+    JOB_IDS_SESSION_ANY = JOB_IDS_SESSION_ANY
+    JOB_IDS_SESSION_ALL = JOB_IDS_SESSION_ALL
+
+    def __init__(self, slots=None, queue_delay=0, comm_failure_rate=0,
+                 comm_failure_calls=("runJob", "runBulkJobs", "jobStatus", "control"),
+                 seed=None, memory=None, backfill_wait=60):
+        self.slots = slots or os.cpu_count() or 1
+        self.memory = memory or _physical_memory()
+        self.backfill_wait = backfill_wait
+        self.queue_delay = queue_delay
+        self.comm_failure_rate = comm_failure_rate
+        self.comm_failure_calls = set(comm_failure_calls)
+        self.call_counts = Counter()
+        self._random = random.Random(seed)
+        self._condition = threading.Condition()
+        self._jobs = {}
+        self._queue = []
+        self._free_slots = self.slots
+        self._free_memory = self.memory
+        self._jobids = itertools.count(1)
+        self._scheduler = None
+        self._active = False
+
+    #
+    #   session lifetime
+    #
+    def initialize(self, contactString=None):
+        with self._condition:
+            self._active = True
+            self._scheduler = threading.Thread(target=self._schedule, name="local_drmaa_scheduler")
+            self._scheduler.daemon = True
+            self._scheduler.start()
+
+    def exit(self):
+        """
+        Terminates all unfinished jobs and stops the scheduler
+        """
+        with self._condition:
+            self._active = False
+            unfinished = [job for job in self._jobs.values()
+                          if job.state not in (JobState.DONE, JobState.FAILED)]
+            self._condition.notify_all()
+        for job in unfinished:
+            self._terminate(job)
+        if self._scheduler is not None:
+            self._scheduler.join()
+            self._scheduler = None
+
+    def __enter__(self):
+        self.initialize()
+        return self
+
+    def __exit__(self, *_):
+        self.exit()
+
+    def _call(self, name):
+        """
+        Counts a drmaa call and injects communication failures
+        """
+        with self._condition:
+            self.call_counts[name] += 1
+            fail = (name in self.comm_failure_calls and
+                    self._random.random() < self.comm_failure_rate)
+        if fail:
+            raise DrmCommunicationException(
+                "code 2: local_drmaa: injected communication failure in %s" % name)
+
+    #
+    #   job templates
+    #
+    def createJobTemplate(self):
+        self._call("createJobTemplate")
+        return JobTemplate()
+
+    def deleteJobTemplate(self, jobTemplate):
+        self._call("deleteJobTemplate")
+
+    #
+    #   submission
+    #
+    def _queue_delay(self):
+        if callable(self.queue_delay):
+            return self.queue_delay()
+        return self.queue_delay
+
+    def _submit(self, job_template, jobid, index=None):
+        def expand(value):
+            if value is None or index is None:
+                return value
+            return value.replace(PARAMETRIC_INDEX, str(index))
+
+        environment = dict(os.environ)
+        if job_template.jobEnvironment:
+            environment.update(job_template.jobEnvironment)
+        environment["SLURM_JOB_ID"] = jobid
+        if index is not None:
+            environment["SLURM_ARRAY_TASK_ID"] = str(index)
+
+        job = _Job(jobid,
+                   [job_template.remoteCommand] + list(job_template.args or []),
+                   expand(job_template.workingDirectory),
+                   environment,
+                   expand(_drm_path(job_template.outputPath)),
+                   expand(_drm_path(job_template.errorPath)),
+                   job_template.joinFiles,
+                   min(_requested_cpus(job_template.nativeSpecification), self.slots),
+                   min(_requested_memory(job_template.nativeSpecification,
+                                         _requested_cpus(job_template.nativeSpecification)),
+                       self.memory),
+                   time.time() + self._queue_delay())
+        with self._condition:
+            if not self._active:
+                raise DrmCommunicationException("code 2: local_drmaa: session is not active")
+            self._jobs[jobid] = job
+            self._queue.append(job)
+            self._condition.notify_all()
+        return jobid
+
+    def can_run(self, nativeSpecification):
+        """
+        Whether the cpus and memory requested in nativeSpecification fit
+            this session at all (larger requests are cut down to fit)
+        """
+        cpus = _requested_cpus(nativeSpecification)
+        return cpus <= self.slots and _requested_memory(nativeSpecification, cpus) <= self.memory
+
+    def runJob(self, jobTemplate):
+        self._call("runJob")
+        return self._submit(jobTemplate, str(next(self._jobids)))
+
+    def runBulkJobs(self, jobTemplate, beginIndex, endIndex, step):
+        self._call("runBulkJobs")
+        array_id = next(self._jobids)
+        return [self._submit(jobTemplate, "%d_%d" % (array_id, index), index)
+                for index in range(beginIndex, endIndex + 1, step)]
+
+    #
+    #   scheduling
+    #
+    def _fits(self, job):
+        return job.cpus <= self._free_slots and job.memory <= self._free_memory
+
+    def _schedule(self):
+        """
+        Packs eligible jobs onto the free cpus and memory, largest first
+            (first fit decreasing), unless the longest waiting job has
+            waited backfill_wait seconds: then nothing overtakes it.
+        """
+        with self._condition:
+            while self._active:
+                now = time.time()
+                next_eligible = None
+                eligible = []
+                for job in self._queue:
+                    if job.state != JobState.QUEUED_ACTIVE:
+                        continue
+                    if job.eligible_time > now:
+                        if next_eligible is None or job.eligible_time < next_eligible:
+                            next_eligible = job.eligible_time
+                        continue
+                    eligible.append(job)
+
+                if eligible and now - eligible[0].eligible_time >= self.backfill_wait:
+                    # reserve the cpus and memory freed for the starving job
+                    candidates = [eligible[0]]
+                else:
+                    candidates = sorted(eligible, key=lambda job: (-job.cpus, -job.memory))
+                    if eligible:
+                        deadline = eligible[0].eligible_time + self.backfill_wait
+                        next_eligible = deadline if next_eligible is None else min(next_eligible, deadline)
+                for job in candidates:
+                    if not self._fits(job):
+                        continue
+                    self._queue.remove(job)
+                    self._free_slots -= job.cpus
+                    self._free_memory -= job.memory
+                    self._start(job)
+                timeout = None if next_eligible is None else max(0, next_eligible - now)
+                self._condition.wait(timeout)
+
+    def _start(self, job):
+        """
+        Called with the condition held
+        """
+        job.state = JobState.RUNNING
+        job.start_time = time.time()
+        try:
+            stdout = open(job.stdout_path or os.devnull, "w")
+            stderr = subprocess.STDOUT if job.join_files else open(job.stderr_path or os.devnull, "w")
+            try:
+                job.process = subprocess.Popen(job.command, stdout=stdout, stderr=stderr,
+                                               cwd=job.working_directory, env=job.environment,
+                                               start_new_session=True)
+            finally:
+                stdout.close()
+                if stderr is not subprocess.STDOUT:
+                    stderr.close()
+        except (OSError, ValueError):
+            self._free_slots += job.cpus
+            self._free_memory += job.memory
+            self._finish(job, JobInfo(job.jobid, False, False, "", False, True, 1,
+                                      self._resource_usage(job, None)))
+            return
+        monitor = threading.Thread(target=self._monitor, args=(job,), name="local_drmaa_job")
+        monitor.daemon = True
+        monitor.start()
+
+    def _monitor(self, job):
+        _, status, rusage = os.wait4(job.process.pid, 0)
+        has_signal = os.WIFSIGNALED(status)
+        if has_signal:
+            signum = os.WTERMSIG(status)
+            job_info = JobInfo(job.jobid, False, True, signal.Signals(signum).name,
+                               os.WCOREDUMP(status), False, signum,
+                               self._resource_usage(job, rusage))
+        else:
+            job_info = JobInfo(job.jobid, True, False, "", False, False,
+                               os.WEXITSTATUS(status), self._resource_usage(job, rusage))
+        with self._condition:
+            self._free_slots += job.cpus
+            self._free_memory += job.memory
+            self._finish(job, job_info)
+
+    def _finish(self, job, job_info):
+        """
+        Called with the condition held
+        """
+        job.end_time = time.time()
+        job.job_info = job_info
+        job.process = None
+        failed = job_info.wasAborted or job_info.hasSignal or job_info.exitStatus
+        job.state = JobState.FAILED if failed else JobState.DONE
+        self._condition.notify_all()
+
+    @staticmethod
+    def _resource_usage(job, rusage):
+        """
+        Resource usage as reported by drmaa: a dictionary of strings
+        """
+        end_time = time.time()
+        usage = {"submission_time": "%.3f" % job.submission_time,
+                 "start_time": "%.3f" % (job.start_time or end_time),
+                 "end_time": "%.3f" % end_time,
+                 "ru_wallclock": "%.3f" % (end_time - (job.start_time or end_time))}
+        if rusage is not None:
+            usage["cpu"] = "%.3f" % (rusage.ru_utime + rusage.ru_stime)
+            usage["ru_utime"] = "%.3f" % rusage.ru_utime
+            usage["ru_stime"] = "%.3f" % rusage.ru_stime
+            # ru_maxrss is in kilobytes on linux
+            usage["maxvmem"] = "%d" % (rusage.ru_maxrss * 1024)
+        return usage
+
+    #
+    #   monitoring and control
+    #
+    def _job(self, jobId):
+        try:
+            return self._jobs[jobId]
+        except KeyError:
+            raise InvalidJobException("code 18: local_drmaa: unknown job %s" % jobId)
+
+    def jobStatus(self, jobId):
+        self._call("jobStatus")
+        with self._condition:
+            return self._job(jobId).state
+
+    def _terminate(self, job):
+        with self._condition:
+            if job.state in (JobState.QUEUED_ACTIVE, JobState.USER_ON_HOLD):
+                if job in self._queue:
+                    self._queue.remove(job)
+                self._finish(job, JobInfo(job.jobid, False, False, "", False, True, 0,
+                                          self._resource_usage(job, None)))
+                return
+            process = job.process
+        if process is not None:
+            try:
+                os.killpg(process.pid, signal.SIGCONT)
+                os.killpg(process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def control(self, jobId, operation):
+        self._call("control")
+        with self._condition:
+            if jobId == JOB_IDS_SESSION_ALL:
+                jobs = list(self._jobs.values())
+            else:
+                jobs = [self._job(jobId)]
+
+        for job in jobs:
+            if operation == JobControlAction.TERMINATE:
+                self._terminate(job)
+                continue
+            with self._condition:
+                if operation == JobControlAction.HOLD and job.state == JobState.QUEUED_ACTIVE:
+                    job.state = JobState.USER_ON_HOLD
+                elif operation == JobControlAction.RELEASE and job.state == JobState.USER_ON_HOLD:
+                    job.state = JobState.QUEUED_ACTIVE
+                    self._condition.notify_all()
+                elif operation == JobControlAction.SUSPEND and job.state == JobState.RUNNING:
+                    os.killpg(job.process.pid, signal.SIGSTOP)
+                    job.state = JobState.USER_SUSPENDED
+                elif operation == JobControlAction.RESUME and job.state == JobState.USER_SUSPENDED:
+                    os.killpg(job.process.pid, signal.SIGCONT)
+                    job.state = JobState.RUNNING
+
+    def _reapable(self, jobId):
+        """
+        Called with the condition held. Returns a finished, unreaped job or None
+        """
+        if jobId == JOB_IDS_SESSION_ANY:
+            for job in self._jobs.values():
+                if job.job_info is not None and not job.reaped:
+                    return job
+            if all(job.reaped for job in self._jobs.values()):
+                raise InvalidJobException("code 18: local_drmaa: no jobs left to wait for")
+            return None
+        job = self._job(jobId)
+        if job.reaped:
+            raise InvalidJobException("code 18: local_drmaa: job %s has already been waited for" % jobId)
+        return job if job.job_info is not None else None
+
+    def wait(self, jobId, timeout=-1):
+        """
+        Waits for the job (or any job with JOB_IDS_SESSION_ANY) to finish and
+            returns its JobInfo
+        """
+        self._call("wait")
+        deadline = None if timeout < 0 else time.time() + timeout
+        with self._condition:
+            while True:
+                job = self._reapable(jobId)
+                if job is not None:
+                    job.reaped = True
+                    return job.job_info
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise ExitTimeoutException("code 22: local_drmaa: time-out waiting for %s" % jobId)
+                self._condition.wait(remaining)
+
+    def synchronize(self, jobIds, timeout=-1, dispose=False):
+        self._call("synchronize")
+        deadline = None if timeout < 0 else time.time() + timeout
+        with self._condition:
+            if JOB_IDS_SESSION_ALL in jobIds:
+                jobs = list(self._jobs.values())
+            else:
+                jobs = [self._job(jobid) for jobid in jobIds]
+            while any(job.job_info is None for job in jobs):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise ExitTimeoutException("code 22: local_drmaa: time-out waiting for jobs")
+                self._condition.wait(remaining)
+            if dispose:
+                for job in jobs:
+                    job.reaped = True
+            return True
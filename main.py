@@ -3,24 +3,13 @@
 import os
 import pathlib
 import shutil
+import threading
 import ruffus.cmdline as cmdline
-from ruffus import originate, transform, suffix, mkdir, posttask, follows
-from mnm_drmaa_wrapper import run_job, error_drmaa_job
-
-#
-# Uncomment if you need to test drmaa (needs installation of OS package: slurm-drmaa)
-#
-try:
-    import drmaa
-    session = drmaa.Session()
-    session.initialize()
-except Exception:
-    print( "DRMAA not imported" )
-    pass
-except OSError:
-    print( "DRMAA not imported" )
-    pass
-
+from ruffus import originate, transform, files, suffix, mkdir, posttask, follows, check_if_uptodate
+from record_store import RecordReader, RecordWriter, needs_update
+from mnm_drmaa_wrapper import run_job, error_drmaa_job, add_job_timing_hook, JobTraceRecorder, \
+    get_job_template_cache, DrmaaSessionManager, ResultCache, SubmissionLimiter, JobDispatcher, \
+    ResourceHistory, serve_metrics
 
 def run_slurm_job(cmd, script_dir,
                   cpus=1, mem_per_cpu=1024, walltime="00:01:00",
@@ -32,16 +21,22 @@ def run_slurm_job(cmd, script_dir,
                    " --time={time}"
                    ).format(cpus=cpus, mem=int(1.2 * mem_per_cpu), time=walltime,
                             qos=qos, partition=partition)
+    if resource_history:
+        # request what earlier jobs like this one used
+        job_options = resource_history.right_size(job_options, cmd, "toy")
 
     stdout_res, stderr_res = "" ,""
     try:
-        stdout_res, stderr_res = run_job(cmd,
+        stdout_res, stderr_res = (dispatcher.run_job if dispatcher else run_job)(cmd,
                                          job_name="toy",
                                          job_other_options=job_options,
                                          retain_job_scripts=True,
+                                         journal=options.journal,
+                                         job_launcher=options.job_launcher,
+                                         submission_limiter=submission_limiter,
                                          job_script_directory=script_dir,
                                          logger=logger,
-                                         drmaa_session=session,
+                                         drmaa_session=get_session(),
                                          run_locally=False,
                                          **args)
 
@@ -61,16 +56,101 @@ parser = cmdline.get_argparse(description='WHAT DOES THIS PIPELINE DO?',
 #   <<<---- add your own command line options like --input_file here
 parser.add_argument("--input_path", dest="input_path", type=pathlib.Path)
 parser.add_argument("--count", dest="input_count", type=int)
+parser.add_argument("--drmaa_backend", dest="drmaa_backend", choices=["drmaa", "local"], default="drmaa",
+                    help="Submit jobs through libdrmaa (e.g. slurm-drmaa), or to a local stand-in scheduler")
+parser.add_argument("--local_slots", dest="local_slots", type=int, default=None,
+                    help="Number of cpus the local scheduler may use (default: all)")
+parser.add_argument("--local_memory", dest="local_memory", type=int, default=None,
+                    help="Megabytes of memory the local scheduler may use (default: all)")
+parser.add_argument("--trace_file", dest="trace_file", default=None,
+                    help="Write a Chrome trace (chrome://tracing, Perfetto) of the drmaa jobs to this file")
+parser.add_argument("--result_cache", dest="result_cache", default=None,
+                    help="Directory of a cache of job results: "
+                         "jobs whose command and input contents are unchanged are not run again")
+parser.add_argument("--max_submit_rate", dest="max_submit_rate", type=float, default=None,
+                    help="Submit at most this many jobs per second")
+parser.add_argument("--max_in_flight", dest="max_in_flight", type=int, default=None,
+                    help="Keep at most this many jobs submitted and not finished")
+parser.add_argument("--dispatch", dest="dispatch", action="store_true",
+                    help="Run jobs predicted to finish sooner locally than through the cluster queue on this machine")
+parser.add_argument("--resource_history", dest="resource_history", default=None,
+                    help="File recording the memory and time used by jobs, from which later jobs' requests are sized")
+parser.add_argument("--job_launcher", dest="job_launcher", action="store_true",
+                    help="Run jobs through one shared launcher script rather than a job script each")
+parser.add_argument("--journal", dest="journal", action="store_true",
+                    help="Record submitted jobs, so that a rerun after a crash waits for them instead of resubmitting")
+parser.add_argument("--metrics_port", dest="metrics_port", type=int, default=None,
+                    help="Serve Prometheus metrics of the jobs at http://127.0.0.1:PORT/metrics")
 options = parser.parse_args()
 
-# create list of input files based on the options.input_count
-input_files = [os.path.join(options.input_path, 'file_' + str(i) + "_in") for i in range(1, options.input_count + 1)]
+if options.metrics_port:
+    serve_metrics(options.metrics_port)
+
+submission_limiter = SubmissionLimiter(rate=options.max_submit_rate, max_in_flight=options.max_in_flight)
+
+result_cache = ResultCache(options.result_cache) if options.result_cache else None
+
+dispatcher = JobDispatcher() if options.dispatch else None
+
+resource_history = ResourceHistory(options.resource_history) if options.resource_history else None
 
+trace_recorder = None
+if options.trace_file:
+    trace_recorder = JobTraceRecorder()
+    add_job_timing_hook(trace_recorder)
 
-@mkdir(os.path.dirname(input_files[0]))
-@originate(input_files)
-def create_input_file(fpath):
+session = None
+session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    The drmaa session jobs are submitted through, initialized when the first
+    job is: planning the pipeline (or running no jobs, e.g. --just_print) does
+    not load libdrmaa nor connect to the cluster
+    """
+    global session
+    with session_lock:
+        if session is None:
+            if options.drmaa_backend == "local":
+                import local_drmaa
+                new_session = local_drmaa.Session(slots=options.local_slots, memory=options.local_memory)
+            else:
+                #
+                # needs installation of OS package: slurm-drmaa
+                #
+                try:
+                    import drmaa
+                except (ImportError, RuntimeError, OSError):
+                    print( "DRMAA not imported" )
+                    raise
+                # reconnects if the controller restarts mid-run
+                new_session = DrmaaSessionManager(drmaa.Session)
+            new_session.initialize()
+            session = new_session
+        return session
+
+
+def input_file_paths(file_suffix="_in"):
+    """ Yields the path of each input file (based on options.input_count),
+    or of its output with file_suffix in place of _in; nothing is listed
+    until a task that needs the files runs
+    """
+    for i in range(1, options.input_count + 1):
+        yield os.path.join(options.input_path, 'file_' + str(i) + file_suffix)
+
+
+def input_file_jobs():
+    """ Parameters of the create_input_file jobs: no input, one file each """
+    for fpath in input_file_paths():
+        yield None, fpath
+
+
+@mkdir(os.fspath(options.input_path))
+@files(input_file_jobs)
+def create_input_file(no_input, fpath):
     """ Create file with its numeric suffix as content
+    :param no_input: None (the files are originated)
     :param fpath: path to file to create
     :return: void
     """
@@ -79,21 +159,24 @@ def create_input_file(fpath):
         f.write("\n")
 
 
-@transform(create_input_file, suffix("_in"), "_out1")
-def process_input_in_python(inputf, outputf):
+def process_input_in_python_jobs():
+    """ Parameters of the one process_input_in_python job: all inputs, all outputs """
+    yield list(input_file_paths()), list(input_file_paths("_out1"))
+
+
+@follows(create_input_file)
+@files(process_input_in_python_jobs)
+def process_input_in_python(inputfs, outputfs):
     """
-    Square the value read from inputf and save in outputf
-    :param inputf: file to read number from
-    :param outputf: file to save squere to
+    Square the values read from all inputfs at once and save each in its
+    own output file (file_N_in -> file_N_out1)
+    :param inputfs: files to read numbers from
+    :param outputfs: files to save squares to, in the order of inputfs
     :return: void
     """
-    value=-1
-    with open(inputf, 'r') as f:
-        value = int(f.readline().strip())
-    print(outputf)
-    time.sleep(5)
-    with open(outputf, 'w') as f:
-        f.write(str(value**2))
+    # imported here: it loads numpy, which complete_run does not need
+    from batch_compute import square_files
+    square_files(inputfs, outputfs)
 
 
 @transform(create_input_file, suffix("_in"), "_out2")
@@ -110,7 +193,67 @@ def process_input_using_awk(inputf, outputf):
 
     print(outputf)
     #run_job(cmd, run_locally=True)
-    run_slurm_job(cmd, script_dir) # will need drmaa and running on a SLURM submission node
+    # will need drmaa and running on a SLURM submission node
+    run_slurm_job(cmd, script_dir,
+                  result_cache=result_cache, input_files=[inputf], output_files=[outputf])
+
+
+def record_keys():
+    """ Yields the keys of the records of a packed run, one per input file of a run of files """
+    for i in range(1, options.input_count + 1):
+        yield "file_%d" % i
+
+
+@mkdir(os.fspath(options.input_path))
+@originate(os.path.join(options.input_path, "inputs.records"))
+@check_if_uptodate(lambda inputf, outputf: needs_update(outputf, record_keys()))
+def create_input_records(outputf):
+    """ Create a record container holding what create_input_file would write
+    to each file, as records keyed file_N
+    :param outputf: container to create
+    :return: void
+    """
+    with RecordWriter(outputf, append=False) as writer:
+        for i in range(1, options.input_count + 1):
+            writer.append("file_%d" % i, b"%d\n" % i)
+
+
+@transform(create_input_records, suffix("inputs.records"), "out1.records")
+@check_if_uptodate(lambda inputf, outputf: needs_update(outputf, record_keys(), inputf))
+def process_records_in_python(inputf, outputf):
+    """
+    Square the value of each record of inputf and save it under the same key
+    in outputf
+    :param inputf: container to read numbers from
+    :param outputf: container to save squares to
+    :return: void
+    """
+    from batch_compute import square_values
+    with RecordReader(inputf) as records:
+        keys = list(records)
+        values = [bytes(records[key]).strip() for key in keys]
+    with RecordWriter(outputf, append=False) as writer:
+        for key, square in zip(keys, square_values(values)):
+            writer.append(key, square)
+
+
+@follows(process_records_in_python)
+def complete_packed_run():
+    """ Processes the inputs as records of one container rather than one file
+    each; the containers are kept, so a rerun only checks their indexes """
+    pass
+
+
+def has_subsecond_mtimes(path):
+    """
+    Whether the file system holding path (or its nearest existing parent)
+    records modification times finer than a second, so Ruffus need not pause
+    a second before each task to tell outputs from inputs
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return os.stat(path).st_mtime_ns % 1000000000 != 0
 
 
 def rm_path():
@@ -135,15 +278,27 @@ logger, logger_mutex = cmdline.setup_logging(__name__, options.log_file, options
 
 import time
 start = time.time()
-cmdline.run(options, checksum_level=0)
+cmdline.run(options, checksum_level=0,
+            one_second_per_job=not has_subsecond_mtimes(options.input_path))
 end = time.time()
 print(end - start)
 
+if result_cache:
+    print("result cache: %s" % result_cache.stats())
+print("submission waits: %s" % submission_limiter.stats())
+if dispatcher:
+    print("dispatched: %s" % dispatcher.stats())
+
+if trace_recorder:
+    trace_recorder.write_chrome_trace(options.trace_file)
+
 #
 # Uncomment if you need to test drmaa (needs installation of OS package: slurm-drmaa)
 #
 try:
-    session.exit()
+    if session is not None:
+        get_job_template_cache(session).clear()
+        session.exit()
 except Exception:
     pass
 
@@ -153,4 +308,7 @@ except Exception:
 # python main.py --input_path /tmp/toy --count 10   -j 100                --verbose 2 --target_tasks complete_run
 # python main.py --input_path /tmp/toy --count 100  -j 200  --use_threads --verbose 2 --target_tasks complete_run
 # python main.py --input_path /tmp/toy --count 100  -j 2000 --use_threads --verbose 2 --target_tasks complete_run
-# python main.py --input_path /tmp/toy --count 1000 -j 2000 --use_threads --verbose 2 --target_tasks complete_run
\ No newline at end of file
+# python main.py --input_path /tmp/toy --count 1000 -j 2000 --use_threads --verbose 2 --target_tasks complete_run
+# python main.py --input_path /tmp/toy --count 1000 -j 2000 --use_threads --verbose 2 --target_tasks complete_run \
+#     --drmaa_backend local
+# python main.py --input_path /tmp/toy --count 1000000 --verbose 2 --target_tasks complete_packed_run
\ No newline at end of file
@@ -62,28 +62,35 @@ from __future__ import print_function
 
 import sys
 import os
+import atexit
+import collections
+import ctypes
+import functools
+import hashlib
+import json
+import math
+import random
+import re
+import select
+import shlex
 import stat
 import tempfile
 import datetime
+import errno
+import shutil
 import time
+import threading
+import uuid
+import weakref
+# asyncio, concurrent.futures and ctypes.util are imported where they are used:
+#   they are slow to import, and planning a pipeline does not need them
 from ruffus.task import lookup_pipeline
 from ruffus.ruffus_exceptions import JobSignalledBreak, JobFailed
-from ruffus.drmaa_wrapper import run_job_locally, touch_output_files
 
-
-try:
-    import gevent
-
-    HAVE_GEVENT = True
-except ImportError:
-    HAVE_GEVENT = False
-
-try:
-    import drmaa
-
-    HAVE_DRMAA = True
-except ImportError:
-    HAVE_DRMAA = False
+# True once the drmaa bindings have loaded, False if local_drmaa stands in
+# for them, None until _drmaa() is first called
+HAVE_DRMAA = None
+_drmaa_module = None
 
 try:
     from Queue import Queue, Empty
@@ -100,6 +107,71 @@ GEVENT_TIMEOUT_WAIT = 5
 MAX_JOBSTATUS_ATTEMPTS = 5
 JOBSTATUS_FAILED_TIMEOUT = 60
 
+# Retries of drmaa calls back off exponentially from RETRY_INITIAL_DELAY up to
+# JOBSTATUS_FAILED_TIMEOUT seconds. Across the pipeline, each retry spends one
+# of up to RETRY_BUDGET_TOKENS tokens, and each successful call earns back
+# RETRY_BUDGET_RATIO of one; after CIRCUIT_BREAKER_THRESHOLD consecutive
+# communication failures calls wait JOBSTATUS_FAILED_TIMEOUT seconds, then
+# one call at a time probes the controller until one succeeds
+RETRY_INITIAL_DELAY = 1
+RETRY_BUDGET_TOKENS = 100
+RETRY_BUDGET_RATIO = 0.2
+CIRCUIT_BREAKER_THRESHOLD = 10
+
+# Largest number of tasks gathered into one array job
+ARRAY_JOB_MAX_TASKS = 1000
+
+# Default window for gathering commands into one job when batch_size is set
+COMMAND_BATCH_WINDOW = 1
+
+# Threads used by run_job_async for blocking drmaa / file system calls
+ASYNC_EXECUTOR_WORKERS = 8
+
+# How often a caller waiting on the shared status poller wakes up to check
+# for suspend / resume requests from the pipeline
+POLLER_WAKEUP_INTERVAL = 1
+
+# Checks for job output files which have not appeared yet back off from the
+# initial to the max interval (seconds); inotify, where available, wakes the
+# checks early for files written on this host
+OUTPUT_READY_INITIAL_INTERVAL = 0.05
+OUTPUT_READY_MAX_INTERVAL = 2
+USE_INOTIFY = sys.platform.startswith("linux")
+
+# Consecutive DrmCommunicationExceptions after which a DrmaaSessionManager
+# replaces its session
+SESSION_MAX_COMMUNICATION_FAILURES = 3
+
+# Name of the job journal kept in job_script_directory (run_job(journal=True))
+JOB_JOURNAL_FILE_NAME = ".ruffus_drmaa_journal"
+
+# The wrapper script shared by the jobs of a job script directory
+# (run_job(job_launcher=True)), which runs the command passed as its
+# argument, and the manifest of the commands run by it, kept if
+# retain_job_scripts is set. Commands longer than JOB_LAUNCHER_MAX_COMMAND_SIZE
+# characters still get their own job script.
+JOB_LAUNCHER_FILE_NAME = ".ruffus_drmaa_launcher"
+JOB_MANIFEST_FILE_NAME = ".ruffus_drmaa_manifest"
+JOB_LAUNCHER_MAX_COMMAND_SIZE = 32 * 1024
+
+# Default size limit of a ResultCache, in bytes
+RESULT_CACHE_MAX_SIZE = 10 * 1024 ** 3
+# ioctl cloning a file's extents into another (Linux btrfs, xfs...)
+FICLONE = 0x40049409
+
+# Idle job templates kept for reuse, per drmaa session
+JOB_TEMPLATE_CACHE_SIZE = 64
+
+# JobDispatcher: initial estimate of the seconds a cluster job waits in the
+# queue (refined from the jobs seen), and the longest predicted runtime, in
+# seconds, of a job it runs locally
+DISPATCH_QUEUE_LATENCY = 60
+DISPATCH_MAX_LOCAL_RUNTIME = 300
+
+# Characters of a job's stdout / stderr quoted in error messages: the first
+# and last halves of this many
+OUTPUT_EXCERPT_SIZE = 64 * 1024
+
 if sys.hexversion >= 0x03000000:
     # everything is unicode in python3
     path_str_type = str
@@ -116,7 +188,8 @@ class error_drmaa_job(Exception):
         Exception.__init__(self, *errmsg)
 
 
-def read_stdout_stderr_from_files(stdout_path, stderr_path, logger=None, cmd_str="", tries=5):
+def read_stdout_stderr_from_files(stdout_path, stderr_path, logger=None, cmd_str="", tries=5,
+                                  timeout=None):
     """
     Reads the contents of two specified paths and returns the strings
 
@@ -130,12 +203,13 @@ def read_stdout_stderr_from_files(stdout_path, stderr_path, logger=None, cmd_str
 
         Returns tuple of stdout and stderr.
 
+    Waits up to timeout seconds (default: 2 seconds per try) for the files
+        to appear, through the shared output file watcher, so waiting does
+        not stall other greenlets and returns as soon as the files are there.
     """
-    # delay up to 10 seconds until files are ready
-    for xxx in range(tries):
-        if os.path.exists(stdout_path) and os.path.exists(stderr_path):
-            break
-        time.sleep(2)
+    if timeout is None:
+        timeout = tries * 2
+    get_output_file_watcher().wait_until_ready((stdout_path, stderr_path), timeout)
 
     stdout = []
     try:
@@ -169,6 +243,108 @@ def read_stdout_stderr_from_files(stdout_path, stderr_path, logger=None, cmd_str
     return stdout, stderr
 
 
+class JobOutput(object):
+    """
+    The stdout or stderr of a finished job left in its file rather than read
+        into memory, as returned by run_job(..., stream_output=True)
+
+    Iterate over it for the lines, or read() it, or move_to() its final
+        destination (a rename, so no copy is made if the destination is on
+        the same file system as job_script_directory).
+    The file is not cleaned up: move it or delete() it once done.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return "JobOutput(%r)" % self.path
+
+    def __iter__(self):
+        try:
+            f = open(self.path, "r")
+        except IOError:
+            return
+        with f:
+            for line in f:
+                yield line
+
+    def open(self, mode="r"):
+        return open(self.path, mode)
+
+    def read(self):
+        try:
+            with open(self.path, "r") as f:
+                return f.read()
+        except IOError:
+            return ""
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def excerpt(self, max_size=None):
+        """
+        Returns the first and last max_size / 2 characters (roughly: the file
+            is read in bytes) of the output, without reading the rest
+        """
+        if max_size is None:
+            max_size = OUTPUT_EXCERPT_SIZE
+        size = self.size()
+        if size <= max_size:
+            return self.read()
+        with open(self.path, "rb") as f:
+            head = f.read(max_size // 2)
+            f.seek(size - max_size // 2)
+            tail = f.read()
+        return _join_excerpt(head.decode(errors="replace"), size - len(head) - len(tail),
+                             tail.decode(errors="replace"))
+
+    def move_to(self, destination):
+        """
+        Moves the output to destination (renaming it where possible) and
+            returns destination
+        """
+        try:
+            os.replace(self.path, destination)
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+            shutil.move(self.path, destination)
+        self.path = destination
+        return destination
+
+    def delete(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def _join_excerpt(head, omitted, tail):
+    return "%s\n[... %d characters omitted ...]\n%s" % (head, omitted, tail)
+
+
+def output_excerpt(output, max_size=None):
+    """
+    Returns job output (a list of lines or a JobOutput) as one string,
+        shortened to its head and tail if longer than max_size
+        (OUTPUT_EXCERPT_SIZE) characters
+    """
+    if max_size is None:
+        max_size = OUTPUT_EXCERPT_SIZE
+    if isinstance(output, JobOutput):
+        return output.excerpt(max_size)
+    text = "".join(output)
+    if len(text) <= max_size:
+        return text
+    head = text[:max_size // 2]
+    tail = text[len(text) - max_size // 2:]
+    return _join_excerpt(head, len(text) - len(head) - len(tail), tail)
+
+
 def setup_drmaa_job(drmaa_session, job_name, job_environment, working_directory, job_other_options):
     job_template = drmaa_session.createJobTemplate()
 
@@ -199,6 +375,114 @@ def setup_drmaa_job(drmaa_session, job_name, job_environment, working_directory,
     return job_template
 
 
+class JobTemplateCache(object):
+    """
+    Keeps the job templates of one drmaa session for reuse by later jobs with
+        the same job_name, job_environment, working_directory and
+        job_other_options, rather than creating (and deleting) one per job.
+
+    acquire() hands out a template for the sole use of one job until it is
+        release()d; only remoteCommand, args, outputPath and errorPath are
+        then set per job. Up to max_size idle templates are kept, the least
+        recently used being deleted first.
+
+    Call clear() before exiting the drmaa session.
+    """
+
+    def __init__(self, drmaa_session, max_size=None):
+        self.drmaa_session = drmaa_session
+        self.max_size = JOB_TEMPLATE_CACHE_SIZE if max_size is None else max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._idle = collections.OrderedDict()
+        self._idle_count = 0
+        self._in_use = {}
+
+    def acquire(self, job_name, job_environment, working_directory, job_other_options):
+        if not working_directory:
+            working_directory = os.getcwd()
+        key = (job_name,
+               repr(sorted(job_environment.items())) if job_environment else None,
+               working_directory, job_other_options)
+        job_template = None
+        with self._lock:
+            templates = self._idle.get(key)
+            if templates:
+                job_template = templates.pop()
+                self._idle_count -= 1
+                if templates:
+                    self._idle.move_to_end(key)
+                else:
+                    del self._idle[key]
+                self.hits += 1
+            else:
+                self.misses += 1
+        if job_template is None:
+            job_template = setup_drmaa_job(self.drmaa_session, job_name, job_environment,
+                                           working_directory, job_other_options)
+        elif not job_name:
+            # give nameless jobs a fresh name, as setup_drmaa_job does
+            job_template.jobName = "ruffus_job_" + "_".join(map(str, datetime.datetime.now().timetuple()[0:6]))
+        with self._lock:
+            self._in_use[id(job_template)] = key
+        return job_template
+
+    def release(self, job_template):
+        """
+        Returns job_template once its job has been submitted for the last time
+        """
+        evicted = []
+        with self._lock:
+            key = self._in_use.pop(id(job_template), None)
+            if key is None or not self.max_size:
+                evicted.append(job_template)
+            else:
+                self._idle.setdefault(key, []).append(job_template)
+                self._idle.move_to_end(key)
+                self._idle_count += 1
+                while self._idle_count > self.max_size:
+                    oldest_key, templates = next(iter(self._idle.items()))
+                    evicted.append(templates.pop(0))
+                    self._idle_count -= 1
+                    if not templates:
+                        del self._idle[oldest_key]
+        for job_template in evicted:
+            self.drmaa_session.deleteJobTemplate(job_template)
+
+    def clear(self):
+        """
+        Deletes all idle templates
+        """
+        with self._lock:
+            evicted = [job_template for templates in self._idle.values() for job_template in templates]
+            self._idle.clear()
+            self._idle_count = 0
+        for job_template in evicted:
+            self.drmaa_session.deleteJobTemplate(job_template)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "idle": self._idle_count,
+                    "in_use": len(self._in_use)}
+
+
+_job_template_caches = weakref.WeakKeyDictionary()
+_job_template_caches_lock = threading.Lock()
+
+
+def get_job_template_cache(drmaa_session):
+    """
+    Returns the job template cache shared by all jobs of drmaa_session
+    """
+    with _job_template_caches_lock:
+        cache = _job_template_caches.get(drmaa_session)
+        if cache is None:
+            cache = JobTemplateCache(drmaa_session)
+            _job_template_caches[drmaa_session] = cache
+        return cache
+
+
 def write_job_script_to_temp_file(cmd_str, job_script_directory, job_name, job_other_options,
                                   job_environment, working_directory):
     '''
@@ -244,255 +528,3460 @@ def write_job_script_to_temp_file(cmd_str, job_script_directory, job_name, job_o
     return (job_script_path, stdout_path, stderr_path)
 
 
-def submit_drmaa_job(cmd_str, drmaa_session, job_template, logger, pipeline):
-
-    jobid = drmaa_session.runJob(job_template)
-    if logger:
-        logger.debug("job has been submitted with jobid {}".format(jobid))
+class JobLauncher(object):
+    """
+    Runs the jobs of one job script directory without a job script each:
+        every job runs the same launcher script, which execs the command
+        given as its argument.
 
-    try:
-        gevent.sleep(GEVENT_TIMEOUT_STARTUP)
-    except JobSignalledBreak:
-        if logger:
-            logger.debug("job with jobid {} will be terminated".format(jobid))
-            drmaa_session.control(jobid, drmaa.JobControlAction.TERMINATE)
-        raise
+    The stdout / stderr files of the jobs (and the scripts of commands too
+        long for an argument) are spread over 256 subdirectories by the first
+        two hex digits of a random name, created once per process, so no
+        directory grows too large and submitting a job touches no file.
 
-    job_info = None
-    is_suspended = False
-    attempts = 1
-    while True:
-        try:
-            status = drmaa_session.jobStatus(jobid)
-            logger.debug("status of job with jobid {} {}".format(jobid, status))
-        except drmaa.errors.DrmCommunicationException as e:
-            if logger:
-                logger.debug(e)
-            if (attempts < MAX_JOBSTATUS_ATTEMPTS):
-                if logger:
-                    logger.info(f"DRMAA_wrapper retrying to obtain job status: attempt {attempts} in {MAX_JOBSTATUS_ATTEMPTS}.")
-                attempts += 1
-                gevent.sleep(JOBSTATUS_FAILED_TIMEOUT)
-                continue
-            else:
-                raise e
-        except Exception:
-            exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
-            msg = str(exceptionValue)
-            # ignore message 24 in PBS code 24: drmaa: Job finished
-            # but resource usage information and/or termination status
-            # could not be provided.":
-            if not msg.startswith("code 24"):
-                raise
-            if logger:
-                logger.debug(msg)
+    Commands of jobs whose scripts would be retained (retain_job_scripts) are
+        appended to the manifest file instead, one JSON line per job.
 
-        if status == drmaa.JobState.DONE:
-            break
-        elif status == drmaa.JobState.FAILED:
-            raise JobFailed("job {} failed".format(jobid))
+        {directory}/.ruffus_drmaa_launcher
+        {directory}/.ruffus_drmaa_manifest
+        {directory}/{name[:2]}/{job_name}_{name}.stdout, .stderr
+    """
 
-        try:
-            gevent.sleep(GEVENT_TIMEOUT_WAIT)
-        except JobSignalledBreak:
-            drmaa_session.control(jobid, drmaa.JobControlAction.TERMINATE)
-            raise
+    def __init__(self, job_script_directory):
+        self.directory = os.path.abspath(job_script_directory)
+        self.path = os.path.join(self.directory, JOB_LAUNCHER_FILE_NAME)
+        self.manifest_path = os.path.join(self.directory, JOB_MANIFEST_FILE_NAME)
+        self._lock = threading.Lock()
+        self._shards = set()
+        os.makedirs(self.directory, exist_ok=True)
+        # replaced atomically, as jobs of another pipeline may be starting it
+        temp_path = "%s.%s" % (self.path, uuid.uuid4().hex)
+        with open(temp_path, "w") as f:
+            f.write("#!/bin/sh\n"
+                    "# runs the command given as its argument (mnm_drmaa_wrapper.JobLauncher)\n"
+                    'exec /bin/sh -c "$1"\n')
+        os.chmod(temp_path, stat.S_IRWXG | stat.S_IRWXU)
+        os.replace(temp_path, self.path)
+
+    def shard(self):
+        """
+        Returns (a subdirectory picked at random, a unique name for a job in it)
+        """
+        name = uuid.uuid4().hex
+        directory = os.path.join(self.directory, name[:2])
+        if directory not in self._shards:
+            os.makedirs(directory, exist_ok=True)
+            with self._lock:
+                self._shards.add(directory)
+        return directory, name
+
+    def prepare(self, cmd_str, job_name, job_other_options, job_environment, working_directory):
+        """
+        Returns (remote command, args, job_script_path, stdout_path, stderr_path)
+            for running cmd_str
+        """
+        directory, name = self.shard()
+        if len(cmd_str) > JOB_LAUNCHER_MAX_COMMAND_SIZE:
+            job_script_path, stdout_path, stderr_path = write_job_script_to_temp_file(
+                cmd_str, directory, job_name, job_other_options, job_environment, working_directory)
+            return job_script_path, [], job_script_path, stdout_path, stderr_path
+        output_path = os.path.join(directory, "%s_%s" % (job_name or "drmaa_script", name))
+        return self.path, [cmd_str], self.path, output_path + ".stdout", output_path + ".stderr"
+
+    def retain(self, jobid, cmd_str, stdout_path, stderr_path):
+        """
+        Records the command of a finished job in the manifest
+        """
+        line = json.dumps({"jobid": jobid, "cmd": cmd_str, "time": time.time(),
+                           "stdout_path": stdout_path, "stderr_path": stderr_path}) + "\n"
+        with self._lock:
+            with open(self.manifest_path, "a") as f:
+                f.write(line)
 
-        if not is_suspended and pipeline.is_job_suspended():
-            if logger:
-                logger.debug("job with jobid {} will be suspended".format(jobid))
-            if status == drmaa.JobState.RUNNING:
-                drmaa_session.control(jobid, drmaa.JobControlAction.SUSPEND)
-            elif status == drmaa.JobState.QUEUED_ACTIVE:
-                drmaa_session.control(jobid, drmaa.JobControlAction.HOLD)
-            is_suspended = True
-        elif is_suspended and not pipeline.is_job_suspended():
-            if logger:
-                logger.debug("job with jobid {} will be resumed".format(jobid))
-            if status == drmaa.JobState.USER_SUSPENDED:
-                drmaa_session.control(jobid, drmaa.JobControlAction.RESUME)
-            elif status == drmaa.JobState.USER_ON_HOLD:
-                drmaa_session.control(jobid, drmaa.JobControlAction.RELEASE)
-            is_suspended = False
 
-    return jobid, job_info
+_job_launchers = {}
+_job_launchers_lock = threading.Lock()
 
 
-def run_job_using_drmaa(cmd_str, job_name=None, job_other_options=None,
-                        job_script_directory=None, job_environment=None,
-                        working_directory=None, retain_job_scripts=False, logger=None,
-                        drmaa_session=None, verbose=0, resubmit=0,
-                        pipeline=None):
+def get_job_launcher(job_script_directory):
     """
-    Runs specified command remotely using drmaa,
-    either with the specified session, or the module shared drmaa session
+    Returns the JobLauncher of job_script_directory, set up once per process
     """
-    # used specified session else module session
-    if drmaa_session is None:
-        raise error_drmaa_job("Please specify a drmaa_session in run_job()")
+    directory = os.path.abspath(job_script_directory)
+    with _job_launchers_lock:
+        launcher = _job_launchers.get(directory)
+        if launcher is None:
+            launcher = JobLauncher(directory)
+            _job_launchers[directory] = launcher
+        return launcher
 
-    # make job template
-    job_template = setup_drmaa_job(
-        drmaa_session, job_name, job_environment, working_directory, job_other_options)
 
-    # make job script
-    if not job_script_directory:
-        job_script_directory = os.getcwd()
-    job_script_path, stdout_path, stderr_path = write_job_script_to_temp_file(
-        cmd_str, job_script_directory, job_name, job_other_options, job_environment, working_directory)
-    job_template.remoteCommand = job_script_path
+_job_timing_hooks = []
 
-    # drmaa paths specified as [hostname]:file_path.
-    # See http://www.ogf.org/Public_Comment_Docs/Documents/2007-12/ggf-drmaa-idl-binding-v1%2000%20RC7.pdf
-    job_template.outputPath = ":" + stdout_path
-    job_template.errorPath = ":" + stderr_path
 
-    # Run job and wait
-    jobid = None
-    if resubmit:
-        exitStatus = 1
-        jobCount = 0
-        while (exitStatus and jobCount < resubmit):
-            try:
-                jobid, job_info = submit_drmaa_job(
-                    cmd_str, drmaa_session, job_template, logger, pipeline)
-                if job_info:
-                    exitStatus = job_info.exitStatus
-                    if exitStatus:
-                        if logger:
-                            logger.debug("job %s exited with %d" %
-                                         (str(jobid), exitStatus))
-                    else:
-                        if logger:
-                            logger.debug("job %s exited normally" % str(jobid))
-                break
-            except Exception as err:
-                if logger:
-                    logger.debug(err)
-                exitStatus = 1
+def add_job_timing_hook(hook):
+    """
+    Calls hook(job_timing, phase) each time a job run through drmaa reaches
+        one of JobTiming.PHASES. Hooks may be called from the status poller
+        thread and should be quick.
+    """
+    _job_timing_hooks.append(hook)
 
-            jobCount += 1
-            if logger and exitStatus:
-                logger.debug(
-                    "Resubmitting job, resubmission count is %d" % jobCount)
 
-        if not jobid:
-            raise error_drmaa_job("Job could not be submitted within %d attempts" % resubmit)
-    else:
-        jobid, job_info = submit_drmaa_job(
-            cmd_str, drmaa_session, job_template, logger, pipeline)
+def remove_job_timing_hook(hook):
+    _job_timing_hooks.remove(hook)
 
-    #
-    #   Read output
-    #
-    stdout, stderr = read_stdout_stderr_from_files(
-        stdout_path, stderr_path, logger, cmd_str)
 
-    job_info_str = ("The original command was: >> %s <<\n"
-                    "The jobid was: %s\n"
-                    "The job script name was: %s\n" %
-                    (cmd_str,
-                     jobid,
-                     job_script_path))
+class JobTiming(object):
+    """
+    When each phase of a job run through drmaa was reached (time.time())
 
-    def stderr_stdout_to_str(stderr, stdout):
+    started         run_job called
+    script_written  job template and script ready
+    submitted       runJob returned (the last submission if resubmitted)
+    running         first seen running by the status poller
+    done            seen finished by the status poller
+    output_read     stdout / stderr read back
+    cleaned_up      job template and script cleaned up (or run_job failed)
+
+    Short jobs may finish between two status checks and never be seen running.
+
+    job_info is the drmaa JobInfo of the finished job, where known, from
+        "output_read" on.
+    """
+    PHASES = ("started", "script_written", "submitted", "running", "done",
+              "output_read", "cleaned_up")
+
+    def __init__(self, cmd_str, job_name=None):
+        self.cmd_str = cmd_str
+        self.job_name = job_name
+        self.jobid = None
+        self.job_info = None
+        self.timestamps = {}
+        # hooks for this job only, called after the module hooks
+        self.hooks = []
+        self.record("started")
+
+    def record(self, phase):
         """
-        Concatenate stdout and stderr to string
+        Records the first time phase is reached and notifies the hooks
         """
-        result = ""
-        if stderr:
-            result += "The stderr was: \n%s\n\n" % ("".join(stderr))
-        if stdout:
-            result += "The stdout was: \n%s\n\n" % ("".join(stdout))
-        return result
+        if phase in self.timestamps:
+            return
+        self.timestamps[phase] = time.time()
+        for hook in list(_job_timing_hooks) + self.hooks:
+            hook(self, phase)
+
+    def submitted(self, jobid):
+        # a resubmitted job starts its remote phases again
+        for phase in ("submitted", "running", "done"):
+            self.timestamps.pop(phase, None)
+        self.jobid = jobid
+        self.record("submitted")
+
+    def spans(self):
+        """
+        Returns (name, start, end) for each interval between recorded phases
+        """
+        names = {"script_written": "write script",
+                 "submitted": "submit",
+                 "running": "queued",
+                 "done": "running" if "running" in self.timestamps else "queued / running",
+                 "output_read": "read output",
+                 "cleaned_up": "clean up"}
+        spans = []
+        previous = None
+        for phase in self.PHASES:
+            if phase not in self.timestamps:
+                continue
+            if previous is not None:
+                spans.append((names[phase], self.timestamps[previous], self.timestamps[phase]))
+            previous = phase
+        return spans
 
-    #   Throw if failed
-    if job_info:
-        job_info_str += "Resources used: %s " % (job_info.resourceUsage)
-        if job_info.wasAborted:
-            raise error_drmaa_job("The drmaa command was never ran but used %s:\n%s"
-                                  % (job_info.exitStatus, job_info_str + stderr_stdout_to_str(stderr, stdout)))
-        elif job_info.hasSignal:
-            raise error_drmaa_job("The drmaa command was terminated by signal %i:\n%s"
-                                  % (job_info.exitStatus, job_info_str + stderr_stdout_to_str(stderr, stdout)))
-        elif job_info.hasExited:
-            if job_info.exitStatus:
-                raise error_drmaa_job("The drmaa command was terminated by signal %i:\n%s"
-                                      % (job_info.exitStatus, job_info_str + stderr_stdout_to_str(stderr, stdout)))
-            #   Decorate normal exit with some resource usage information
-            elif verbose:
-                def nice_mem_str(num):
-                    """
-                    Format memory sizes
-                    http://stackoverflow.com/questions/1094841/reusable-library-to-get-human-readable-version-of-file-size
-                    """
-                    num = float(num)
-                    for x in ['bytes', 'KB', 'MB', 'GB']:
-                        if num < 1024.0:
-                            return "%3.1f%s" % (num, x)
-                        num /= 1024.0
-                    return "%3.1f%s" % (num, 'TB')
 
-                try:
-                    resource_usage_str = []
-                    if 'maxvmem' in job_info.resourceUsage:
-                        if 'mem' in job_info.resourceUsage:
-                            resource_usage_str.append("Mem=%s(%s)" % (nice_mem_str(
-                                job_info.resourceUsage['maxvmem']), job_info.resourceUsage['mem']))
-                        else:
-                            resource_usage_str.append("Mem=%s" % nice_mem_str(
-                                job_info.resourceUsage['maxvmem']))
-                    if 'ru_wallclock' in job_info.resourceUsage:
-                        resource_usage_str.append("CPU wallclock= %.2gs" % float(
-                            job_info.resourceUsage['ru_wallclock']))
-                    if len(resource_usage_str):
-                        logger.info("Drmaa command used %s in running %s" % (
-                            ", ".join(resource_usage_str), cmd_str))
-                    else:
-                        logger.info(
-                            "Drmaa command successfully ran %s" % cmd_str)
-                except:
-                    logger.info("Drmaa command used %s in running %s" %
-                                (job_info.resourceUsage, cmd_str))
+class JobTraceRecorder(object):
+    """
+    Collects the timings of finished jobs (a job timing hook) and writes them
+        as a Chrome trace (chrome://tracing, Perfetto) or as a list of
+        OpenTelemetry-style spans.
+
+        recorder = JobTraceRecorder()
+        add_job_timing_hook(recorder)
+        ...
+        recorder.write_chrome_trace("trace.json")
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = []
+
+    def __call__(self, timing, phase):
+        if phase == "cleaned_up":
+            with self._lock:
+                self.timings.append(timing)
+
+    def chrome_trace(self):
+        events = []
+        with self._lock:
+            timings = list(self.timings)
+        for tid, timing in enumerate(timings, 1):
+            args = {"jobid": str(timing.jobid), "job_name": timing.job_name, "cmd": timing.cmd_str}
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+                           "args": {"name": "job %s" % timing.jobid}})
+            for name, start, end in timing.spans():
+                events.append({"name": name, "cat": "drmaa", "ph": "X", "pid": 1, "tid": tid,
+                               "ts": start * 1e6, "dur": (end - start) * 1e6, "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def otel_spans(self):
+        spans = []
+        with self._lock:
+            timings = list(self.timings)
+        for timing in timings:
+            trace_id = uuid.uuid4().hex
+            parent_id = uuid.uuid4().hex[:16]
+            attributes = {"drmaa.jobid": str(timing.jobid), "drmaa.job_name": timing.job_name,
+                          "drmaa.cmd": timing.cmd_str}
+            job_spans = timing.spans()
+            if not job_spans:
+                continue
+            spans.append({"trace_id": trace_id, "span_id": parent_id, "parent_span_id": None,
+                          "name": "drmaa job",
+                          "start_time_unix_nano": int(job_spans[0][1] * 1e9),
+                          "end_time_unix_nano": int(job_spans[-1][2] * 1e9),
+                          "attributes": attributes})
+            for name, start, end in job_spans:
+                spans.append({"trace_id": trace_id, "span_id": uuid.uuid4().hex[:16],
+                              "parent_span_id": parent_id, "name": name,
+                              "start_time_unix_nano": int(start * 1e9),
+                              "end_time_unix_nano": int(end * 1e9),
+                              "attributes": attributes})
+        return spans
+
+    def write_otel_spans(self, path):
+        with open(path, "w") as f:
+            json.dump(self.otel_spans(), f)
+
+
+# Histogram buckets (upper bounds, seconds) of drmaa call latencies and of
+# job phases
+CALL_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+JOB_SECONDS_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, 4 * 3600, 24 * 3600)
+
+
+class DrmaaMetrics(object):
+    """
+    Counters, gauges and histograms of the jobs and drmaa calls of this
+        process, rendered in the Prometheus text exposition format by
+        render(), and served over HTTP by serve_metrics().
 
-    #   clean up job template
-    drmaa_session.deleteJobTemplate(job_template)
+    Job metrics are taken from the job timings (the metrics of the module,
+        get_metrics(), are a job timing hook from the start); the wrapper
+        counts drmaa calls and retries as it makes them.
+    """
+    DEFINITIONS = (
+        ("drmaa_jobs_submitted_total", "counter", "Jobs submitted, resubmissions included", None),
+        ("drmaa_jobs_finished_total", "counter", "Jobs run_job is done with, by outcome", None),
+        ("drmaa_jobs_in_flight", "gauge", "Jobs submitted and not seen finished", None),
+        ("drmaa_jobs_running", "gauge", "Jobs seen running and not seen finished", None),
+        ("drmaa_job_queue_wait_seconds", "histogram",
+         "Time from submission until a job was seen running", JOB_SECONDS_BUCKETS),
+        ("drmaa_job_run_seconds", "histogram",
+         "Time from a job seen running until seen finished", JOB_SECONDS_BUCKETS),
+        ("drmaa_output_wait_seconds", "histogram",
+         "Time from a job seen finished until its output was read", JOB_SECONDS_BUCKETS),
+        ("drmaa_call_seconds", "histogram", "Latency of drmaa calls, by call", CALL_SECONDS_BUCKETS),
+        ("drmaa_call_errors_total", "counter", "drmaa calls which raised, by call", None),
+        ("drmaa_communication_failures_total", "counter",
+         "drmaa calls failed on communication errors", None),
+        ("drmaa_retries_total", "counter", "drmaa calls retried", None),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._definitions = dict((name, (kind, help, buckets))
+                                 for name, kind, help, buckets in self.DEFINITIONS)
+        # (name, sorted label items) -> number, or [bucket counts..., sum, count]
+        self._values = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self._definitions[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def value(self, name, **labels):
+        """
+        Returns a counter or gauge, or the number of observations of a
+            histogram
+        """
+        with self._lock:
+            value = self._values.get((name, tuple(sorted(labels.items()))), 0)
+        return value[-1] if isinstance(value, list) else value
 
-    #   Cleanup job script unless retain_job_scripts is set
-    if retain_job_scripts:
-        # job scripts have the jobid as an extension
-        os.rename(job_script_path, job_script_path + ".%s" % jobid)
-    else:
+    def timed_call(self, name, function, *args):
+        """
+        Calls function(*args), the drmaa call name, counting it
+        """
+        start = time.time()
         try:
-            os.unlink(job_script_path)
-        except OSError:
-            if logger:
-                logger.warning(
-                    "Temporary job script wrapper '%s' missing (and ignored) at clean-up" % job_script_path)
+            return function(*args)
+        except Exception:
+            self.inc("drmaa_call_errors_total", call=name)
+            raise
+        finally:
+            self.observe("drmaa_call_seconds", time.time() - start, call=name)
+
+    def __call__(self, timing, phase):
+        timestamps = timing.timestamps
+        if phase == "submitted":
+            self.inc("drmaa_jobs_submitted_total")
+            self.inc("drmaa_jobs_in_flight")
+        elif phase == "running":
+            self.inc("drmaa_jobs_running")
+            self.observe("drmaa_job_queue_wait_seconds",
+                         timestamps["running"] - timestamps["submitted"])
+        elif phase == "done":
+            self._finished(timing)
+            if "running" in timestamps:
+                self.observe("drmaa_job_run_seconds", timestamps["done"] - timestamps["running"])
+        elif phase == "output_read" and "done" in timestamps:
+            self.observe("drmaa_output_wait_seconds", timestamps["output_read"] - timestamps["done"])
+        elif phase == "cleaned_up":
+            if "submitted" in timestamps and "done" not in timestamps:
+                # never seen finished, e.g. terminated with the pipeline
+                self._finished(timing)
+            failed = job_failed(timing.job_info) or "output_read" not in timestamps
+            self.inc("drmaa_jobs_finished_total", outcome="failed" if failed else "done")
+
+    def _finished(self, timing):
+        self.inc("drmaa_jobs_in_flight", -1)
+        if "running" in timing.timestamps:
+            self.inc("drmaa_jobs_running", -1)
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format
+        """
+        def format_labels(labels):
+            if not labels:
+                return ""
+            return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\")
+                                                  .replace('"', '\\"').replace("\n", "\\n"))
+                                     for name, value in labels)
+
+        with self._lock:
+            values = sorted((key, list(value) if isinstance(value, list) else value)
+                            for key, value in self._values.items())
+        lines = []
+        for name, kind, help, buckets in self.DEFINITIONS:
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            series = [(labels, value) for (series_name, labels), value in values if series_name == name]
+            if not series and kind != "histogram":
+                lines.append("%s 0" % name)
+            for labels, value in series:
+                if kind != "histogram":
+                    lines.append("%s%s %s" % (name, format_labels(labels), value))
+                    continue
+                for bound, count in zip(tuple(buckets) + ("+Inf",), value[:-2] + [value[-1]]):
+                    lines.append("%s_bucket%s %d" % (name, format_labels(labels + (("le", bound),)), count))
+                lines.append("%s_sum%s %s" % (name, format_labels(labels), value[-2]))
+                lines.append("%s_count%s %d" % (name, format_labels(labels), value[-1]))
+        return "\n".join(lines) + "\n"
+
+
+_metrics = DrmaaMetrics()
+_job_timing_hooks.append(_metrics)
+
+
+def get_metrics():
+    """
+    Returns the DrmaaMetrics of this process
+    """
+    return _metrics
 
-    return stdout, stderr
 
+def serve_metrics(port, address="127.0.0.1"):
+    """
+    Serves get_metrics() at http://address:port/metrics from a background
+        thread. Returns the server: call shutdown() on it to stop.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = _metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="drmaa_metrics")
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def _drmaa():
+    """
+    The drmaa module: the drmaa bindings, or local_drmaa (which provides the
+        drmaa names used here) where they or the libdrmaa they load are
+        missing. Imported on first use, as loading libdrmaa is not needed to
+        plan a pipeline or run it with the local backend.
+    """
+    global _drmaa_module, HAVE_DRMAA
+    if _drmaa_module is None:
+        try:
+            import drmaa
+
+            HAVE_DRMAA = True
+        except (ImportError, RuntimeError):
+            import local_drmaa as drmaa
 
-def run_job(cmd_str, job_name=None, job_other_options=None, job_script_directory=None,
-            job_environment=None, working_directory=None, logger=None,
-            drmaa_session=None, retain_job_scripts=False,
-            run_locally=False, output_files=None, touch_only=False,
-            verbose=0, local_echo=False,
-            resubmit=0, pipeline=None):
+            HAVE_DRMAA = False
+        _drmaa_module = drmaa
+    return _drmaa_module
+
+
+def _gevent():
     """
-    Runs specified command either using drmaa, or locally or only in simulation (touch the output files only)
+    gevent if something has imported it (Ruffus does for --use_gevent), else
+        None: greenlets only run jobs once gevent is loaded, so there is no
+        need to pay for importing it up front
     """
+    return sys.modules.get("gevent")
 
-    pipeline = lookup_pipeline(pipeline)
 
-    if touch_only:
-        touch_output_files(cmd_str, output_files, logger)
-        return "", "",
+def _in_greenlet():
+    """
+    True if called from a greenlet run by a gevent pool (Ruffus --use_gevent),
+    where blocking on a thread primitive would stall every other job
+    """
+    gevent = _gevent()
+    return gevent is not None and isinstance(gevent.getcurrent(), gevent.Greenlet)
 
-    if run_locally:
-        return run_job_locally(cmd_str, logger, job_environment, working_directory, local_echo)
 
-    return run_job_using_drmaa(cmd_str, job_name, job_other_options,
-                               job_script_directory, job_environment, working_directory,
-                               retain_job_scripts, logger, drmaa_session,
-                               verbose, resubmit, pipeline)
\ No newline at end of file
+class _WakingEvent(threading.Event):
+    """
+    threading.Event which, when set from any thread, also wakes the
+        greenlets waiting for it in _wait_for_event, through gevent async
+        watchers (which may be sent to from other threads)
+    """
+
+    def __init__(self):
+        super(_WakingEvent, self).__init__()
+        self._watchers_lock = threading.Lock()
+        self._watchers = []
+
+    def set(self):
+        super(_WakingEvent, self).set()
+        with self._watchers_lock:
+            watchers = list(self._watchers)
+        for watcher in watchers:
+            watcher.send()
+
+    def add_watcher(self, watcher):
+        with self._watchers_lock:
+            self._watchers.append(watcher)
+
+    def remove_watcher(self, watcher):
+        with self._watchers_lock:
+            self._watchers.remove(watcher)
+
+
+def _wait_for_event(event, timeout):
+    """
+    Waits up to timeout seconds for a threading.Event without stalling the
+        gevent hub. Returns True if the event is set.
+
+    A greenlet waiting for a _WakingEvent is woken as soon as it is set;
+        for other events it looks again after timeout.
+    """
+    if not _in_greenlet():
+        return event.wait(timeout)
+    if event.is_set():
+        return True
+    if not isinstance(event, _WakingEvent):
+        _gevent().sleep(timeout)
+        return event.is_set()
+
+    from gevent.event import Event
+    woken = Event()
+    watcher = _gevent().get_hub().loop.async_()
+    watcher.start(woken.set)
+    event.add_watcher(watcher)
+    try:
+        # set between is_set() above and add_watcher()?
+        if not event.is_set():
+            woken.wait(timeout)
+    finally:
+        event.remove_watcher(watcher)
+        watcher.stop()
+        watcher.close()
+    return event.is_set()
+
+
+def parse_walltime(job_other_options):
+    """
+    Returns the walltime requested by --time / -t in job_other_options in
+        seconds, or None.
+    Understands the SLURM formats: MM, MM:SS, HH:MM:SS, D-HH, D-HH:MM, D-HH:MM:SS
+    """
+    if not job_other_options:
+        return None
+    match = re.search(r"(?:--time[= ]|-t\s*)(\d+(?:-\d+)?(?::\d+){0,2})(?:\s|$)", job_other_options)
+    if not match:
+        return None
+    walltime = match.group(1)
+    days = 0
+    if "-" in walltime:
+        days, walltime = walltime.split("-")
+        fields = [int(f) for f in walltime.split(":")]
+        # D-HH, D-HH:MM, D-HH:MM:SS
+        fields += [0] * (3 - len(fields))
+        hours, minutes, seconds = fields
+    else:
+        fields = [int(f) for f in walltime.split(":")]
+        if len(fields) == 3:
+            hours, minutes, seconds = fields
+        else:
+            # MM, MM:SS
+            fields += [0] * (2 - len(fields))
+            hours = 0
+            minutes, seconds = fields
+    return ((int(days) * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+class PollingPolicy(object):
+    """
+    Decides how long to wait between status checks of a job.
+
+    The default waits GEVENT_TIMEOUT_STARTUP seconds after submission, then
+        GEVENT_TIMEOUT_WAIT seconds between checks.
+    Subclasses override delays()
+    """
+
+    def delays(self, job_other_options=None):
+        """
+        Returns an iterator of delays in seconds: the first before the
+            initial status check, the others between subsequent checks
+        """
+        yield GEVENT_TIMEOUT_STARTUP
+        while True:
+            yield GEVENT_TIMEOUT_WAIT
+
+
+class ExponentialBackoffPollingPolicy(PollingPolicy):
+    """
+    Starts polling quickly, so that short jobs are noticed soon after they
+        finish, then backs off by factor up to max_interval seconds
+    """
+
+    def __init__(self, initial_interval=0.5, factor=2.0, max_interval=60):
+        self.initial_interval = initial_interval
+        self.factor = factor
+        self.max_interval = max_interval
+
+    def delays(self, job_other_options=None):
+        interval = self.initial_interval
+        while True:
+            yield min(interval, self.max_interval)
+            interval *= self.factor
+
+
+class WalltimePollingPolicy(ExponentialBackoffPollingPolicy):
+    """
+    Exponential backoff capped at a fraction of the walltime requested with
+        --time in job_other_options (clamped to [min_interval, max_interval]),
+        so long jobs are checked rarely
+    """
+
+    def __init__(self, fraction=0.01, initial_interval=0.5, factor=2.0,
+                 min_interval=5, max_interval=600):
+        ExponentialBackoffPollingPolicy.__init__(self, initial_interval, factor, max_interval)
+        self.fraction = fraction
+        self.min_interval = min_interval
+
+    def delays(self, job_other_options=None):
+        walltime = parse_walltime(job_other_options)
+        cap = self.max_interval
+        if walltime is not None:
+            cap = max(self.min_interval, min(cap, walltime * self.fraction))
+        interval = self.initial_interval
+        while True:
+            yield min(interval, cap)
+            interval *= self.factor
+
+
+class JitteredPollingPolicy(PollingPolicy):
+    """
+    Spreads the delays of another policy by +/- jitter (a fraction) so that
+        jobs submitted together are not all checked at the same moment
+    """
+
+    def __init__(self, policy=None, jitter=0.2):
+        self.policy = policy or PollingPolicy()
+        self.jitter = jitter
+
+    def delays(self, job_other_options=None):
+        for delay in self.policy.delays(job_other_options):
+            yield delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def _sleep(seconds):
+    """
+    time.sleep which does not stall the gevent hub
+    """
+    if _in_greenlet():
+        _gevent().sleep(seconds)
+    else:
+        time.sleep(seconds)
+
+
+class RetryBudget(object):
+    """
+    Limits the retries of drmaa calls across all jobs sharing it (a pipeline):
+        a token bucket of retries refilled by successful calls, and a circuit
+        breaker which makes callers wait locally, rather than all retrying
+        at once, while the controller is not answering.
+    """
+
+    def __init__(self, tokens=None, ratio=None, threshold=None, cooldown=None):
+        self.max_tokens = RETRY_BUDGET_TOKENS if tokens is None else tokens
+        self.ratio = RETRY_BUDGET_RATIO if ratio is None else ratio
+        self.threshold = CIRCUIT_BREAKER_THRESHOLD if threshold is None else threshold
+        self._cooldown = cooldown
+        self.tokens = self.max_tokens
+        self.consecutive_failures = 0
+        self.open_until = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def cooldown(self):
+        return JOBSTATUS_FAILED_TIMEOUT if self._cooldown is None else self._cooldown
+
+    def is_open(self):
+        with self._lock:
+            return self.consecutive_failures >= self.threshold
+
+    def try_acquire(self):
+        """
+        Returns 0 if a call may be made now, else how long to wait first.
+            Once the cooldown is over, only one call at a time is let through.
+        """
+        with self._lock:
+            if self.consecutive_failures < self.threshold:
+                return 0
+            now = time.time()
+            if now < self.open_until:
+                return self.open_until - now
+            if self._probing:
+                return max(0.1, min(1, self.cooldown))
+            self._probing = True
+            return 0
+
+    def wait_until_closed(self):
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return
+            _sleep(delay)
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self._probing = False
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def record_failure(self):
+        _metrics.inc("drmaa_communication_failures_total")
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probing = False
+            if self.consecutive_failures >= self.threshold:
+                self.open_until = time.time() + self.cooldown
+
+    def take_retry(self):
+        """
+        Spends a retry token. Returns False if there is none left.
+        """
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+        _metrics.inc("drmaa_retries_total")
+        return True
+
+
+class RetryPolicy(object):
+    """
+    Decides whether, and after how long, failed drmaa calls (runJob,
+        jobStatus, control) are retried.
+
+    Errors are classified (classify()) as
+        TRANSIENT   communication failures: retried after a jittered
+                    exponential backoff, at most max_attempts times in a row,
+                    while the budget allows
+        FINISHED    PBS "code 24": the job finished, but its resource usage
+                    could not be provided
+        PERMANENT   anything else: raised straight away
+
+    All policies share one RetryBudget unless given their own.
+    """
+    TRANSIENT = "transient"
+    FINISHED = "finished"
+    PERMANENT = "permanent"
+
+    def __init__(self, max_attempts=None, initial_delay=None, factor=2.0, max_delay=None,
+                 jitter=0.5, budget=None):
+        self._max_attempts = max_attempts
+        self._initial_delay = initial_delay
+        self.factor = factor
+        self._max_delay = max_delay
+        self.jitter = jitter
+        self.budget = budget or get_retry_budget()
+
+    # defaults read when used, so that the module constants can be changed
+    @property
+    def max_attempts(self):
+        return MAX_JOBSTATUS_ATTEMPTS if self._max_attempts is None else self._max_attempts
+
+    @property
+    def initial_delay(self):
+        return RETRY_INITIAL_DELAY if self._initial_delay is None else self._initial_delay
+
+    @property
+    def max_delay(self):
+        return JOBSTATUS_FAILED_TIMEOUT if self._max_delay is None else self._max_delay
+
+    def classify(self, error):
+        if isinstance(error, _drmaa().errors.DrmCommunicationException):
+            return self.TRANSIENT
+        # ignore message 24 in PBS code 24: drmaa: Job finished
+        # but resource usage information and/or termination status
+        # could not be provided.":
+        if str(error).startswith("code 24"):
+            return self.FINISHED
+        return self.PERMANENT
+
+    def delay(self, attempt):
+        """
+        Seconds to wait before retrying after the attempt-th failure
+        """
+        delay = min(self.max_delay, self.initial_delay * self.factor ** (attempt - 1))
+        return delay * random.uniform(1 - self.jitter, 1)
+
+    def should_retry(self, error, attempt):
+        """
+        Records the outcome of a failed call (the attempt-th in a row) with
+            the budget, and returns whether to retry it
+        """
+        if self.classify(error) != self.TRANSIENT:
+            # the controller answered
+            self.budget.record_success()
+            return False
+        self.budget.record_failure()
+        return attempt < self.max_attempts and self.budget.take_retry()
+
+    def call(self, function, *args):
+        """
+        Calls function(*args), retrying it as the policy allows
+        """
+        attempt = 0
+        while True:
+            self.budget.wait_until_closed()
+            try:
+                result = _metrics.timed_call(getattr(function, "__name__", "call"), function, *args)
+            except Exception as err:
+                attempt += 1
+                if not self.should_retry(err, attempt):
+                    raise
+                _sleep(self.delay(attempt))
+                continue
+            self.budget.record_success()
+            return result
+
+
+_retry_budget = None
+_default_retry_policy = None
+_retry_policy_lock = threading.Lock()
+
+
+def get_retry_budget():
+    """
+    Returns the retry budget shared by the whole pipeline
+    """
+    global _retry_budget
+    with _retry_policy_lock:
+        if _retry_budget is None:
+            _retry_budget = RetryBudget()
+        return _retry_budget
+
+
+def get_default_retry_policy():
+    global _default_retry_policy
+    if _default_retry_policy is None:
+        policy = RetryPolicy()
+        with _retry_policy_lock:
+            if _default_retry_policy is None:
+                _default_retry_policy = policy
+    return _default_retry_policy
+
+
+def parse_partition_qos(job_other_options):
+    """
+    Returns (partition, qos) requested in job_other_options, each None if
+        not given
+    """
+    if not job_other_options:
+        return None, None
+    partition = re.search(r"(?:--partition[= ]|-p\s*)([^\s,]+)", job_other_options)
+    qos = re.search(r"--qos[= ]([^\s,]+)", job_other_options)
+    return (partition.group(1) if partition else None,
+            qos.group(1) if qos else None)
+
+
+class _SubmissionBucket(object):
+    """
+    Token bucket, in-flight count and wait metrics of one SubmissionLimiter key
+    """
+
+    def __init__(self, rate, burst, max_in_flight):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate or 1)
+        self.max_in_flight = max_in_flight
+        self.tokens = self.burst
+        self.last_refill = time.time()
+        self.in_flight = 0
+        self.waiting = 0
+        self.waiters = []
+        self.submitted = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def try_acquire(self):
+        """
+        Takes a submission slot if one is free. Called with the limiter lock held.
+        Returns 0 if it did, else how long to wait (None: until a job finishes)
+        """
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            return None
+        if self.rate:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+        self.in_flight += 1
+        return 0
+
+    def record_wait(self, waited, blocked):
+        """
+        Counts a submission, and a wait of waited seconds if the bucket
+            blocked it (no token, or max_in_flight reached)
+        """
+        self.submitted += 1
+        if blocked:
+            self.waits += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+
+class SubmissionLimiter(object):
+    """
+    Limits how fast jobs are submitted (a token bucket: rate submissions per
+        second, in bursts of up to burst) and how many are in flight
+        (submitted and not finished, max_in_flight), so that excess callers
+        wait here rather than tripping the DRM's submission limits
+        (e.g. SLURM MaxSubmitJobs).
+
+    limits gives other limits for some partitions / QOS, as parsed from
+        job_other_options: {name or (partition, qos): {"rate": ...,
+        "burst": ..., "max_in_flight": ...}}. (partition, qos) is looked up
+        first, then the partition, then the QOS. All jobs matching one entry
+        share its limits.
+
+    Waiting does not stall the gevent hub. stats() reports, per entry, how
+        many submissions had to wait and for how long.
+
+        limiter = SubmissionLimiter(rate=10, max_in_flight=500,
+                                    limits={"short": {"rate": 50}})
+        run_job(cmd_str, submission_limiter=limiter, ...)
+    """
+
+    def __init__(self, rate=None, burst=None, max_in_flight=None, limits=None):
+        self.default_limits = {"rate": rate, "burst": burst, "max_in_flight": max_in_flight}
+        self.limits = limits or {}
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def key(self, job_other_options):
+        partition, qos = parse_partition_qos(job_other_options)
+        for key in ((partition, qos), partition, qos):
+            if key in self.limits:
+                return key
+        return None
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            limits = dict(self.default_limits)
+            if key is not None:
+                limits.update(self.limits[key])
+            bucket = _SubmissionBucket(limits["rate"], limits.get("burst"), limits["max_in_flight"])
+            self._buckets[key] = bucket
+        return bucket
+
+    def _try_acquire(self, key, event=None):
+        with self._lock:
+            bucket = self._bucket(key)
+            delay = bucket.try_acquire()
+            if delay != 0 and event is not None:
+                bucket.waiters.append(event)
+            return delay
+
+    def acquire(self, job_other_options=None):
+        """
+        Waits for a submission slot. Returns the key to release() it with.
+        """
+        key = self.key(job_other_options)
+        start = time.time()
+        blocked = False
+        with self._lock:
+            self._bucket(key).waiting += 1
+        try:
+            while True:
+                event = _WakingEvent()
+                delay = self._try_acquire(key, event)
+                if delay == 0:
+                    break
+                blocked = True
+                # woken by release(), or in time for the next token; greenlets
+                # look again at least every second
+                _wait_for_event(event, min(1.0, delay) if delay is not None else 1.0)
+        finally:
+            with self._lock:
+                bucket = self._bucket(key)
+                bucket.waiting -= 1
+                if event in bucket.waiters:
+                    bucket.waiters.remove(event)
+        self._record_wait(key, time.time() - start, blocked)
+        return key
+
+    async def acquire_async(self, job_other_options=None):
+        """
+        Coroutine version of acquire()
+        """
+        import asyncio
+        key = self.key(job_other_options)
+        start = time.time()
+        blocked = False
+        with self._lock:
+            self._bucket(key).waiting += 1
+        try:
+            while True:
+                delay = self._try_acquire(key)
+                if delay == 0:
+                    break
+                blocked = True
+                await asyncio.sleep(min(0.1, delay) if delay is not None else 0.1)
+        finally:
+            with self._lock:
+                self._bucket(key).waiting -= 1
+        self._record_wait(key, time.time() - start, blocked)
+        return key
+
+    def _record_wait(self, key, waited, blocked):
+        with self._lock:
+            self._bucket(key).record_wait(waited, blocked)
+
+    def release(self, key):
+        """
+        Frees the submission slot taken by acquire() once the job has finished
+        """
+        with self._lock:
+            bucket = self._bucket(key)
+            bucket.in_flight -= 1
+            waiters, bucket.waiters = bucket.waiters, []
+        for event in waiters:
+            event.set()
+
+    def stats(self):
+        with self._lock:
+            return dict((key, {"submitted": bucket.submitted,
+                               "waits": bucket.waits,
+                               "wait_total": bucket.wait_total,
+                               "wait_max": bucket.wait_max,
+                               "in_flight": bucket.in_flight,
+                               "waiting": bucket.waiting})
+                        for key, bucket in self._buckets.items())
+
+
+class _JobWatch(object):
+    """
+    State of one job followed by the shared poller
+    """
+
+    def __init__(self, jobid, logger, delays, timing=None, retry_policy=None):
+        self.jobid = jobid
+        self.logger = logger
+        self.timing = timing
+        self.retry_policy = retry_policy or get_default_retry_policy()
+        self.delays = delays
+        self.next_check = time.time() + next(delays)
+        self.status = None
+        self.error = None
+        self.job_info = None
+        self.attempts = 0
+        self.finished = _WakingEvent()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def wait(self, timeout):
+        """
+        Waits up to timeout seconds for the job to finish.
+        Returns True if it has.
+        """
+        return _wait_for_event(self.finished, timeout)
+
+    def add_done_callback(self, callback):
+        """
+        Calls callback() from the poller thread once the job has finished,
+            or straight away if it already has
+        """
+        with self._lock:
+            if not self.finished.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def set_finished(self, error=None):
+        self.error = error
+        with self._lock:
+            self.finished.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class JobStatusPoller(object):
+    """
+    Polls the status of all outstanding jobs of one drmaa session from a
+        single background thread.
+
+    Each sweep queries the jobs which are due, and callers are woken through
+        per-job events, so the controller sees one sequential stream of
+        queries per session rather than one polling loop per job.
+    DRMAA v1 has no batched status call (and wait(JOB_IDS_SESSION_ANY) in
+        slurm-drmaa refreshes every job of the session in turn anyway).
+
+    The thread only lives while there are jobs to watch.
+    """
+
+    def __init__(self, drmaa_session):
+        self.drmaa_session = drmaa_session
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._watches = {}
+        self._thread = None
+
+    def watch(self, jobid, logger=None, delays=None, timing=None, retry_policy=None):
+        """
+        Start following jobid, checking its status after each of delays
+            (seconds) in turn. See PollingPolicy.delays()
+
+        The "running" and "done" phases are recorded in timing (a JobTiming)
+        Failed status checks are retried as retry_policy (a RetryPolicy) allows
+        """
+        if delays is None:
+            delays = PollingPolicy().delays()
+        watch = _JobWatch(jobid, logger, delays, timing, retry_policy)
+        with self._lock:
+            self._watches[jobid] = watch
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="drmaa_status_poller")
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+        return watch
+
+    def forget(self, jobid):
+        """
+        Stop following jobid, e.g. because it has been terminated
+        """
+        with self._lock:
+            self._watches.pop(jobid, None)
+
+    def outstanding(self):
+        with self._lock:
+            return len(self._watches)
+
+    def _finish(self, watch, error=None):
+        with self._lock:
+            self._watches.pop(watch.jobid, None)
+        if watch.timing is not None:
+            watch.timing.record("done")
+        watch.set_finished(error)
+
+    def _reap(self, watch):
+        """
+        Collects the job info (exit status, signal, resource usage) of a
+            finished job, or None if drmaa does not have it
+        """
+        try:
+            return _metrics.timed_call("wait", self.drmaa_session.wait, watch.jobid,
+                                       _drmaa().Session.TIMEOUT_NO_WAIT)
+        except Exception as e:
+            if watch.logger:
+                watch.logger.debug("no job info for job with jobid {}: {}".format(watch.jobid, e))
+            return None
+
+    def _sweep(self):
+        """
+        Queries the status of all due jobs, and reaps the finished ones.
+        Returns the number of seconds until the next sweep.
+        """
+        now = time.time()
+        with self._lock:
+            due = [w for w in self._watches.values() if w.next_check <= now]
+
+        for watch in due:
+            logger = watch.logger
+            retry_policy = watch.retry_policy
+            # the circuit breaker is open: wait for the controller to recover
+            wait = retry_policy.budget.try_acquire()
+            if wait:
+                return wait
+            try:
+                status = _metrics.timed_call("jobStatus", self.drmaa_session.jobStatus, watch.jobid)
+                if logger:
+                    logger.debug("status of job with jobid {} {}".format(watch.jobid, status))
+                retry_policy.budget.record_success()
+                watch.attempts = 0
+            except Exception as e:
+                if logger:
+                    logger.debug(e)
+                if retry_policy.classify(e) == RetryPolicy.FINISHED:
+                    retry_policy.budget.record_success()
+                    status = _drmaa().JobState.DONE
+                else:
+                    watch.attempts += 1
+                    if not retry_policy.should_retry(e, watch.attempts):
+                        self._finish(watch, e)
+                        continue
+                    if logger:
+                        logger.info(f"DRMAA_wrapper retrying to obtain job status: "
+                                    f"attempt {watch.attempts} in {retry_policy.max_attempts}.")
+                    # the controller is not answering: back off the whole sweep
+                    return retry_policy.delay(watch.attempts)
+
+            watch.status = status
+            if status == _drmaa().JobState.RUNNING and watch.timing is not None:
+                watch.timing.record("running")
+            if status in (_drmaa().JobState.DONE, _drmaa().JobState.FAILED):
+                watch.job_info = self._reap(watch)
+                if status == _drmaa().JobState.FAILED and not job_failed(watch.job_info):
+                    # no job info to report the failure from
+                    self._finish(watch, JobFailed("job {} failed".format(watch.jobid)))
+                else:
+                    # failures are reported from the job info, with the
+                    # job's output, by collect_drmaa_job_output
+                    self._finish(watch)
+            else:
+                watch.next_check = time.time() + next(watch.delays)
+
+        with self._lock:
+            if not self._watches:
+                return GEVENT_TIMEOUT_WAIT
+            return max(0, min(w.next_check for w in self._watches.values()) - time.time())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._watches:
+                    self._thread = None
+                    return
+            self._wakeup.clear()
+            delay = self._sweep()
+            if delay:
+                self._wakeup.wait(delay)
+
+
+_job_status_pollers = weakref.WeakKeyDictionary()
+_job_status_pollers_lock = threading.Lock()
+
+
+def get_job_status_poller(drmaa_session):
+    """
+    Returns the status poller shared by all jobs of drmaa_session
+    """
+    with _job_status_pollers_lock:
+        poller = _job_status_pollers.get(drmaa_session)
+        if poller is None:
+            poller = JobStatusPoller(drmaa_session)
+            _job_status_pollers[drmaa_session] = poller
+        return poller
+
+
+class _Inotify(object):
+    """
+    Minimal inotify binding (through ctypes) reporting changes to directories
+    """
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self):
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        # IN_NONBLOCK | IN_CLOEXEC have the values of their O_ counterparts
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._watches = {}
+
+    def watch_directories(self, directories):
+        """
+        Watches exactly directories (those which exist)
+        """
+        for directory in set(self._watches) - set(directories):
+            self._rm_watch(self.fd, self._watches.pop(directory))
+        for directory in set(directories) - set(self._watches):
+            wd = self._add_watch(self.fd, os.fsencode(directory), self.MASK)
+            if wd >= 0:
+                self._watches[directory] = wd
+
+    def drain(self):
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _open_inotify():
+    if not USE_INOTIFY:
+        return None
+    try:
+        return _Inotify()
+    except (OSError, AttributeError, TypeError):
+        # no libc / inotify (e.g. not linux, or out of inotify instances)
+        return None
+
+
+class _OutputWaiter(object):
+    """
+    Paths one caller is waiting for
+    """
+
+    def __init__(self, paths):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.delays = ExponentialBackoffPollingPolicy(OUTPUT_READY_INITIAL_INTERVAL,
+                                                      max_interval=OUTPUT_READY_MAX_INTERVAL).delays()
+        self.next_check = time.time() + next(self.delays)
+        self.ready = _WakingEvent()
+
+
+class OutputFileWatcher(object):
+    """
+    Waits for job output files (which a shared file system may show some time
+        after the job has finished) from a single background thread.
+
+    Each sweep lists each directory holding awaited files once, so the files
+        of many jobs sharing a job script directory are checked together.
+        Listing the directory, rather than stat-ing each missing file, also
+        sidesteps cached negative lookups on NFS.
+    Between sweeps the thread sleeps until the earliest waiter is due (backing
+        off per waiter from OUTPUT_READY_INITIAL_INTERVAL to
+        OUTPUT_READY_MAX_INTERVAL), or until inotify reports a change in one
+        of the directories. inotify does not see files written by other NFS
+        clients, hence the polling.
+
+    The thread only lives while there are files to wait for.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._thread = None
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+
+    def wait_until_ready(self, paths, timeout):
+        """
+        Waits up to timeout seconds for all of paths to exist, without
+            stalling other greenlets. Returns True if they do.
+        """
+        if all(os.path.exists(path) for path in paths):
+            return True
+        waiter = _OutputWaiter(paths)
+        with self._lock:
+            self._waiters.append(waiter)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="drmaa_output_watcher")
+                self._thread.daemon = True
+                self._thread.start()
+        self._wake()
+        try:
+            deadline = time.time() + timeout
+            while not waiter.ready.is_set():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                # short slices so that greenlets (which cannot block on the
+                # event) notice soon after the files appear
+                _wait_for_event(waiter.ready, min(remaining, OUTPUT_READY_MAX_INTERVAL / 20.0))
+        finally:
+            with self._lock:
+                self._waiters.remove(waiter)
+        return waiter.ready.is_set()
+
+    def outstanding(self):
+        with self._lock:
+            return len(self._waiters)
+
+    def _wake(self):
+        try:
+            os.write(self._wakeup_write, b"x")
+        except (BlockingIOError, OSError):
+            pass
+
+    @staticmethod
+    def _list_directory(directory):
+        try:
+            return set(os.listdir(directory))
+        except OSError:
+            return set()
+
+    def _sweep(self, inotify):
+        """
+        Checks all outstanding waiters, one listing per directory.
+        Returns the number of seconds until the next sweep.
+        """
+        with self._lock:
+            waiters = [w for w in self._waiters if not w.ready.is_set()]
+        directories = set(os.path.dirname(path) for w in waiters for path in w.paths)
+        if inotify is not None:
+            inotify.watch_directories(directories)
+        listings = dict((directory, self._list_directory(directory)) for directory in directories)
+
+        now = time.time()
+        for waiter in waiters:
+            if all(os.path.basename(path) in listings[os.path.dirname(path)] for path in waiter.paths):
+                waiter.ready.set()
+            elif waiter.next_check <= now:
+                waiter.next_check = now + next(waiter.delays)
+
+        pending = [w.next_check for w in waiters if not w.ready.is_set()]
+        if not pending:
+            return OUTPUT_READY_MAX_INTERVAL
+        return max(0, min(pending) - time.time())
+
+    def _run(self):
+        inotify = _open_inotify()
+        try:
+            while True:
+                with self._lock:
+                    if not self._waiters:
+                        self._thread = None
+                        return
+                delay = self._sweep(inotify)
+                readable = [self._wakeup_read] + ([inotify.fd] if inotify is not None else [])
+                ready, _, _ = select.select(readable, [], [], delay)
+                if self._wakeup_read in ready:
+                    try:
+                        os.read(self._wakeup_read, 4096)
+                    except (BlockingIOError, OSError):
+                        pass
+                if inotify is not None and inotify.fd in ready:
+                    inotify.drain()
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+
+_output_file_watcher = None
+_output_file_watcher_lock = threading.Lock()
+
+
+def get_output_file_watcher():
+    """
+    Returns the output file watcher shared by all jobs
+    """
+    global _output_file_watcher
+    with _output_file_watcher_lock:
+        if _output_file_watcher is None:
+            _output_file_watcher = OutputFileWatcher()
+        return _output_file_watcher
+
+
+class _ManagedJobTemplate(object):
+    """
+    Job template handed out by DrmaaSessionManager: keeps the attributes set on
+        it, and copies them (those which changed) to a job template of the
+        current session when submitted, so it outlives reconnections
+    """
+
+    def __init__(self):
+        object.__setattr__(self, "_attributes", {})
+        object.__setattr__(self, "_template", None)
+        object.__setattr__(self, "_generation", None)
+        object.__setattr__(self, "_synced", {})
+
+    def __setattr__(self, name, value):
+        self._attributes[name] = value
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["_attributes"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class DrmaaSessionManager(object):
+    """
+    Owns a drmaa session on behalf of all jobs of a pipeline, and can be
+        passed to run_job as drmaa_session.
+
+    Calls are serialized (unless serialize=False), except for wait() and
+        synchronize() which may block, as the libdrmaa bindings do not
+        promise thread safety.
+
+    After SESSION_MAX_COMMUNICATION_FAILURES consecutive
+        DrmCommunicationExceptions the session is taken to be dead: it is
+        replaced by a new one, initialized with the contact string of the
+        old one so that DRMs which support it reattach the session's jobs,
+        and the failed call is retried once. Submissions (runJob,
+        runBulkJobs) are not retried: the DRM may have queued the job
+        before the connection dropped, so the error is raised for the
+        caller to decide, as RetryPolicy does. Jobs submitted before are
+        followed by their jobids, which the new session is asked about
+        straight away; those it does not know are logged.
+
+        session = DrmaaSessionManager(logger=logger)
+        session.initialize()
+        run_job(cmd_str, drmaa_session=session, ...)
+        session.exit()
+
+    session_factory makes the underlying sessions (default drmaa.Session).
+    """
+
+    def __init__(self, session_factory=None, contact=None, serialize=True,
+                 max_failures=None, logger=None):
+        self.session_factory = session_factory or _drmaa().Session
+        self.contact = contact
+        self.max_failures = SESSION_MAX_COMMUNICATION_FAILURES if max_failures is None else max_failures
+        self.logger = logger
+        self.reconnects = 0
+        self._session = None
+        self._generation = 0
+        self._failures = 0
+        self._outstanding = set()
+        self._call_lock = threading.RLock() if serialize else None
+        self._state_lock = threading.RLock()
+
+    #
+    #   session lifetime
+    #
+    def initialize(self, contactString=None):
+        with self._state_lock:
+            if contactString is not None:
+                self.contact = contactString
+            self._session = self._new_session()
+
+    def _new_session(self):
+        session = self.session_factory()
+        if self.contact:
+            session.initialize(self.contact)
+        else:
+            session.initialize()
+        contact = getattr(session, "contact", None)
+        if isinstance(contact, str) and contact:
+            self.contact = contact
+        return session
+
+    def exit(self):
+        get_job_template_cache(self).clear()
+        with self._state_lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.exit()
+
+    def __enter__(self):
+        if self._session is None:
+            self.initialize()
+        return self
+
+    def __exit__(self, *_):
+        self.exit()
+
+    @property
+    def session(self):
+        """
+        The current underlying drmaa session
+        """
+        with self._state_lock:
+            if self._session is None:
+                raise error_drmaa_job("DrmaaSessionManager has not been initialized")
+            return self._session
+
+    def _reconnect(self, generation):
+        with self._state_lock:
+            if generation != self._generation:
+                # another caller has already reconnected
+                return
+            if self.logger:
+                self.logger.warning("drmaa session stopped responding: reconnecting")
+            try:
+                self._session.exit()
+            except Exception:
+                pass
+            self._session = self._new_session()
+            self._generation += 1
+            self._failures = 0
+            self.reconnects += 1
+            session = self._session
+            outstanding = list(self._outstanding)
+
+        # reattach
+        for jobid in outstanding:
+            try:
+                self._call_session(session, "jobStatus", jobid)
+            except _drmaa().errors.InvalidJobException:
+                if self.logger:
+                    self.logger.warning("job with jobid {} is not known to the new drmaa session".format(jobid))
+            except Exception as err:
+                if self.logger:
+                    self.logger.debug(err)
+
+    # calls which may have taken effect before failing, so are not retried
+    _NOT_RETRIED = ("runJob", "runBulkJobs")
+
+    def _call_session(self, session, name, *args, **kwargs):
+        """
+        Makes a call on session, holding the call lock unless it may block
+        """
+        if self._call_lock is None or name in ("wait", "synchronize"):
+            return getattr(session, name)(*args, **kwargs)
+        with self._call_lock:
+            return getattr(session, name)(*args, **kwargs)
+
+    def _call(self, name, *args, **kwargs):
+        """
+        Makes a call on the current session, reconnecting and retrying once
+            (except for submissions) if it looks dead
+        """
+        for attempt in range(2):
+            with self._state_lock:
+                session = self.session
+                generation = self._generation
+            try:
+                result = self._call_session(session, name, *args, **kwargs)
+            except _drmaa().errors.DrmCommunicationException:
+                with self._state_lock:
+                    self._failures += 1
+                    dead = self._failures >= self.max_failures
+                if not dead or attempt:
+                    raise
+                self._reconnect(generation)
+                if name in self._NOT_RETRIED:
+                    raise
+                continue
+            with self._state_lock:
+                self._failures = 0
+            return result
+
+    #
+    #   job templates
+    #
+    def createJobTemplate(self):
+        return _ManagedJobTemplate()
+
+    def deleteJobTemplate(self, jobTemplate):
+        with self._state_lock:
+            current = jobTemplate._generation == self._generation
+        if jobTemplate._template is not None and current:
+            self._call("deleteJobTemplate", jobTemplate._template)
+
+    def _job_template(self, jobTemplate):
+        """
+        Returns a job template of the current session with the attributes
+            of jobTemplate
+        """
+        with self._state_lock:
+            generation = self._generation
+        if jobTemplate._template is None or jobTemplate._generation != generation:
+            object.__setattr__(jobTemplate, "_template", self._call("createJobTemplate"))
+            object.__setattr__(jobTemplate, "_generation", generation)
+            jobTemplate._synced.clear()
+        template = jobTemplate._template
+        for name, value in jobTemplate._attributes.items():
+            if name not in jobTemplate._synced or jobTemplate._synced[name] != value:
+                setattr(template, name, value)
+                # copied so that later changes to a list / dict are noticed
+                jobTemplate._synced[name] = type(value)(value) if isinstance(value, (list, dict)) else value
+        return template
+
+    #
+    #   jobs
+    #
+    def runJob(self, jobTemplate):
+        jobid = self._call("runJob", self._job_template(jobTemplate))
+        with self._state_lock:
+            self._outstanding.add(jobid)
+        return jobid
+
+    def runBulkJobs(self, jobTemplate, beginIndex, endIndex, step):
+        jobids = self._call("runBulkJobs", self._job_template(jobTemplate), beginIndex, endIndex, step)
+        with self._state_lock:
+            self._outstanding.update(jobids)
+        return jobids
+
+    def jobStatus(self, jobId):
+        status = self._call("jobStatus", jobId)
+        if status in (_drmaa().JobState.DONE, _drmaa().JobState.FAILED):
+            with self._state_lock:
+                self._outstanding.discard(jobId)
+        return status
+
+    def control(self, jobId, operation):
+        return self._call("control", jobId, operation)
+
+    def wait(self, jobId, timeout=-1):
+        job_info = self._call("wait", jobId, timeout)
+        with self._state_lock:
+            self._outstanding.discard(job_info.jobId)
+        return job_info
+
+    def synchronize(self, jobIds, timeout=-1, dispose=False):
+        return self._call("synchronize", jobIds, timeout, dispose)
+
+    def outstanding(self):
+        """
+        jobids submitted through the manager which have not been seen finished
+        """
+        with self._state_lock:
+            return set(self._outstanding)
+
+
+class JobJournal(object):
+    """
+    Append-only log of the jobs submitted from one job script directory, so
+        that a pipeline restarted after its driver died reattaches to its
+        jobs rather than submitting them again.
+
+    Each line is a JSON record of a job: the hash of its command and
+        parameters (job_key()), jobid, job script, stdout and stderr paths and
+        state, which is "submitted", then "finished" once seen done, then
+        "closed" once run_job has returned or raised.
+    Jobs not closed by the previous run are available to claim(), once
+        each. The log is compacted to them when first opened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._open_jobs = collections.OrderedDict()
+        self._load()
+
+    @staticmethod
+    def job_key(cmd_str, job_name, job_other_options, job_environment, working_directory):
+        parameters = json.dumps([cmd_str, job_name, job_other_options,
+                                 sorted(job_environment.items()) if job_environment else None,
+                                 working_directory or os.getcwd()])
+        return hashlib.sha256(parameters.encode()).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except IOError:
+            lines = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # torn last line of a killed run
+                continue
+            if entry["state"] == "closed":
+                self._open_jobs.pop(entry["jobid"], None)
+            else:
+                self._open_jobs[entry["jobid"]] = entry
+        # compact (the first job of a run may not have made the job script directory yet)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            for entry in self._open_jobs.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(temp_path, self.path)
+
+    def _append(self, entry):
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def record(self, key, jobid, state, job_script_path=None, stdout_path=None, stderr_path=None):
+        self._append({"key": key, "jobid": jobid, "state": state, "time": time.time(),
+                      "job_script_path": job_script_path,
+                      "stdout_path": stdout_path, "stderr_path": stderr_path})
+
+    def close(self, key, jobid):
+        self.record(key, jobid, "closed")
+
+    def claim(self, key):
+        """
+        Returns the entry of a job with key left open by an earlier run (and
+            not claimed already), or None
+        """
+        with self._lock:
+            for jobid, entry in self._open_jobs.items():
+                if entry["key"] == key:
+                    del self._open_jobs[jobid]
+                    return entry
+        return None
+
+    def open_jobs(self):
+        with self._lock:
+            return list(self._open_jobs.values())
+
+
+_job_journals = {}
+_job_journals_lock = threading.Lock()
+
+
+def get_job_journal(job_script_directory):
+    """
+    Returns the journal of job_script_directory, read once per process
+    """
+    path = os.path.join(os.path.abspath(job_script_directory), JOB_JOURNAL_FILE_NAME)
+    with _job_journals_lock:
+        journal = _job_journals.get(path)
+        if journal is None:
+            journal = JobJournal(path)
+            _job_journals[path] = journal
+        return journal
+
+
+def reattach_drmaa_job(entry, drmaa_session, logger, pipeline, polling_policy=None,
+                       job_other_options=None, timing=None):
+    """
+    Follows the job of a journal entry left open by an earlier run until it
+        finishes. Returns job_info, or raises if the job can not be followed
+        (and should be submitted again).
+    """
+    if _reattach_drmaa_job(entry, drmaa_session, logger, timing):
+        return None
+    return wait_for_drmaa_job(entry["jobid"], drmaa_session, logger, pipeline,
+                              polling_policy, job_other_options, timing)
+
+
+def _reattach_drmaa_job(entry, drmaa_session, logger, timing=None):
+    """
+    Checks once on the job of a journal entry left open by an earlier run.
+        Returns whether it has finished, or raises if the job can not be
+        followed.
+    """
+    jobid = entry["jobid"]
+    try:
+        status = drmaa_session.jobStatus(jobid)
+    except Exception as err:
+        # jobs which finished a while ago are forgotten by the DRM
+        # (or give PBS code 24, see JobStatusPoller._sweep)
+        outputs_exist = os.path.exists(entry["stdout_path"]) and os.path.exists(entry["stderr_path"])
+        if not (str(err).startswith("code 24") or
+                (entry["state"] == "finished" and outputs_exist)):
+            raise
+        status = _drmaa().JobState.DONE
+    if status == _drmaa().JobState.FAILED:
+        raise JobFailed("job {} failed".format(jobid))
+
+    if logger:
+        logger.info("reattached to job with jobid {} of an earlier run".format(jobid))
+    if timing is not None:
+        timing.submitted(jobid)
+    if status == _drmaa().JobState.DONE:
+        if timing is not None:
+            timing.record("done")
+        return True
+    return False
+
+
+def submit_drmaa_job(cmd_str, drmaa_session, job_template, logger, pipeline,
+                     polling_policy=None, job_other_options=None, timing=None,
+                     retry_policy=None):
+
+    jobid = _submit_through_retry_budget(drmaa_session.runJob, job_template, retry_policy)
+    if logger:
+        logger.debug("job has been submitted with jobid {}".format(jobid))
+    if timing is not None:
+        timing.submitted(jobid)
+
+    return jobid, wait_for_drmaa_job(jobid, drmaa_session, logger, pipeline,
+                                     polling_policy, job_other_options, timing, retry_policy)
+
+
+def _submit_through_retry_budget(run_job_function, job_template, retry_policy=None,
+                                 call_name="runJob"):
+    """
+    Submits a job once, waiting while the circuit breaker is open.
+        Failed submissions are retried by the resubmit loop of
+        run_job_using_drmaa, if at all, as a job may have been created even
+        though the submission timed out.
+    """
+    retry_policy = retry_policy or get_default_retry_policy()
+    retry_policy.budget.wait_until_closed()
+    try:
+        jobid = _metrics.timed_call(call_name, run_job_function, job_template)
+    except Exception as err:
+        if retry_policy.classify(err) == RetryPolicy.TRANSIENT:
+            retry_policy.budget.record_failure()
+        else:
+            retry_policy.budget.record_success()
+        raise
+    retry_policy.budget.record_success()
+    return jobid
+
+
+def job_failed(job_info):
+    """
+    Whether job_info (a drmaa JobInfo, or None if unknown) shows that the
+        job was aborted, killed by a signal or exited with a non-zero status
+    """
+    if job_info is None:
+        return False
+    return bool(job_info.wasAborted or job_info.hasSignal or
+                (job_info.hasExited and job_info.exitStatus))
+
+
+def wait_for_drmaa_job(jobid, drmaa_session, logger, pipeline,
+                       polling_policy=None, job_other_options=None, timing=None,
+                       retry_policy=None):
+    """
+    Waits for a submitted job to finish, suspending / resuming it along with
+        the pipeline and terminating it if the pipeline is interrupted.
+
+    Returns job_info
+    """
+    poller = get_job_status_poller(drmaa_session)
+    if polling_policy is None:
+        polling_policy = PollingPolicy()
+    retry_policy = retry_policy or get_default_retry_policy()
+    watch = poller.watch(jobid, logger, polling_policy.delays(job_other_options), timing,
+                         retry_policy)
+
+    is_suspended = False
+    while True:
+        try:
+            if watch.wait(POLLER_WAKEUP_INTERVAL):
+                break
+        except JobSignalledBreak:
+            if logger:
+                logger.debug("job with jobid {} will be terminated".format(jobid))
+            poller.forget(jobid)
+            retry_policy.call(drmaa_session.control, jobid, _drmaa().JobControlAction.TERMINATE)
+            raise
+
+        is_suspended = _follow_pipeline_suspension(jobid, watch.status, is_suspended,
+                                                   drmaa_session, pipeline, logger, retry_policy)
+
+    if watch.error is not None:
+        raise watch.error
+
+    return watch.job_info
+
+
+def _follow_pipeline_suspension(jobid, status, is_suspended, drmaa_session, pipeline, logger,
+                                retry_policy=None):
+    """
+    Suspends / resumes the job if the pipeline has been suspended / resumed
+        since the last call.
+    Returns whether the job is now suspended
+    """
+    retry_policy = retry_policy or get_default_retry_policy()
+    is_suspended, action = _pipeline_suspension_action(jobid, status, is_suspended, pipeline,
+                                                       logger)
+    if action is not None:
+        retry_policy.call(drmaa_session.control, jobid, action)
+    return is_suspended
+
+
+def _pipeline_suspension_action(jobid, status, is_suspended, pipeline, logger):
+    """
+    Decides how to follow the pipeline being suspended / resumed since the
+        last call, without calling drmaa.
+    Returns (whether the job is now suspended, JobControlAction to take or None)
+    """
+    if not is_suspended and pipeline.is_job_suspended():
+        if logger:
+            logger.debug("job with jobid {} will be suspended".format(jobid))
+        if status == _drmaa().JobState.RUNNING:
+            return True, _drmaa().JobControlAction.SUSPEND
+        elif status == _drmaa().JobState.QUEUED_ACTIVE:
+            return True, _drmaa().JobControlAction.HOLD
+        return True, None
+    elif is_suspended and not pipeline.is_job_suspended():
+        if logger:
+            logger.debug("job with jobid {} will be resumed".format(jobid))
+        if status == _drmaa().JobState.USER_SUSPENDED:
+            return False, _drmaa().JobControlAction.RESUME
+        elif status == _drmaa().JobState.USER_ON_HOLD:
+            return False, _drmaa().JobControlAction.RELEASE
+        return False, None
+    return is_suspended, None
+
+
+class _JobBatch(object):
+    """
+    Jobs gathered for a single combined submission
+    """
+
+    def __init__(self):
+        self.items = []
+        self.full = _WakingEvent()
+        self.submitted = _WakingEvent()
+        self.error = None
+        self.unreleased = 0
+        self.script_path = None
+        self.jobids = None
+        self.results = None
+
+
+class _JobGatherer(object):
+    """
+    Gathers jobs with identical submission parameters arriving within a short
+        window into batches.
+    The first job of each batch (the leader) submits it for everyone.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open_batches = {}
+
+    def _join(self, key, item, window, max_jobs):
+        """
+        Adds item to the open batch for key.
+        The leader returns once the batch has max_jobs items or window seconds
+            have passed.
+
+        Returns (batch, index, is_leader) where index is 1-based
+        """
+        with self._lock:
+            batch = self._open_batches.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = _JobBatch()
+                self._open_batches[key] = batch
+            batch.items.append(item)
+            batch.unreleased += 1
+            index = len(batch.items)
+            if index >= max_jobs:
+                del self._open_batches[key]
+                batch.full.set()
+
+        if is_leader:
+            _wait_for_event(batch.full, window)
+            with self._lock:
+                if self._open_batches.get(key) is batch:
+                    del self._open_batches[key]
+        return batch, index, is_leader
+
+    def _wait_until_submitted(self, batch):
+        while not _wait_for_event(batch.submitted, POLLER_WAKEUP_INTERVAL):
+            pass
+
+
+class ArrayJobSubmitter(_JobGatherer):
+    """
+    Submits gathered jobs as one array job with runBulkJobs.
+
+    Each job keeps its own job script: a dispatcher script run by every
+        array task execs the script matching its parametric index, and
+        stdout / stderr are separated per task through the same index.
+    """
+
+    def __init__(self, max_jobs=None):
+        _JobGatherer.__init__(self)
+        self.max_jobs = max_jobs or ARRAY_JOB_MAX_TASKS
+
+    def submit(self, drmaa_session, job_template, job_script_path, window, key,
+               job_script_directory, job_name, logger=None):
+        """
+        Adds a job script to the open batch for key, submitting the batch
+            once window seconds have passed or it is full.
+
+        Returns (batch, index) where index is the 1-based array task index
+        """
+        batch, index, is_leader = self._join((drmaa_session,) + tuple(key), job_script_path,
+                                              window, self.max_jobs)
+
+        if is_leader:
+            try:
+                self._submit_batch(drmaa_session, job_template, batch,
+                                   job_script_directory, job_name, logger)
+            except Exception as err:
+                batch.error = err
+            finally:
+                batch.submitted.set()
+        else:
+            self._wait_until_submitted(batch)
+
+        if batch.error is not None:
+            self.release(batch, logger=logger)
+            raise batch.error
+        return batch, index
+
+    def _submit_batch(self, drmaa_session, job_template, batch,
+                      job_script_directory, job_name, logger):
+        cases = ["%d) exec %s ;;" % (i, shlex.quote(path))
+                 for i, path in enumerate(batch.items, 1)]
+        # Not every drmaa implementation expands the parametric index in
+        # args: fall back on the array task id set by the DRM
+        dispatcher = ('index="$1"\n'
+                      'case "$index" in\n'
+                      '\'\'|*[!0-9]*) '
+                      'index="${SLURM_ARRAY_TASK_ID:-${SGE_TASK_ID:-${PBS_ARRAYID:-$LSB_JOBINDEX}}}" ;;\n'
+                      'esac\n'
+                      'case "$index" in\n%s\n*) echo "unknown array index $index" >&2; exit 1 ;;\nesac'
+                      % "\n".join(cases))
+        batch.script_path, _, _ = write_job_script_to_temp_file(
+            dispatcher, job_script_directory, (job_name or "drmaa_script") + "_array",
+            None, None, None)
+
+        job_template.remoteCommand = batch.script_path
+        job_template.args = [_drmaa().JobTemplate.PARAMETRIC_INDEX]
+        job_template.outputPath = ":%s.%s.stdout" % (batch.script_path, _drmaa().JobTemplate.PARAMETRIC_INDEX)
+        job_template.errorPath = ":%s.%s.stderr" % (batch.script_path, _drmaa().JobTemplate.PARAMETRIC_INDEX)
+
+        batch.jobids = list(_submit_through_retry_budget(
+            lambda job_template: drmaa_session.runBulkJobs(job_template, 1, len(batch.items), 1),
+            job_template, call_name="runBulkJobs"))
+        if logger:
+            logger.debug("array job with {} tasks has been submitted with jobids {}".format(
+                len(batch.jobids), batch.jobids))
+
+    def release(self, batch, retain_job_scripts=False, logger=None):
+        """
+        Called by each job of the batch when done: the last one cleans up
+            the dispatcher script
+        """
+        with self._lock:
+            batch.unreleased -= 1
+            if batch.unreleased or batch.script_path is None:
+                return
+        if retain_job_scripts:
+            os.rename(batch.script_path, batch.script_path + ".%s" % batch.jobids[0])
+        else:
+            try:
+                os.unlink(batch.script_path)
+            except OSError:
+                if logger:
+                    logger.warning(
+                        "Temporary array job dispatcher '%s' missing (and ignored) at clean-up" % batch.script_path)
+
+
+_array_job_submitter = ArrayJobSubmitter()
+
+
+def _job_parameters_key(job_script_directory, job_name, job_other_options,
+                        job_environment, working_directory):
+    """
+    Jobs can only share a submission if all of these match
+    """
+    return (job_script_directory, job_name, job_other_options,
+            repr(sorted(job_environment.items())) if job_environment else None,
+            working_directory)
+
+
+def submit_drmaa_array_task(cmd_str, drmaa_session, job_template, job_script_path, window,
+                            job_script_directory, job_name, job_other_options,
+                            job_environment, working_directory, logger, pipeline,
+                            polling_policy=None, timing=None, retry_policy=None):
+    """
+    Submits the job script as one task of an array job shared with other
+        jobs with the same parameters, and waits for it.
+
+    Returns (jobid, job_info, batch, stdout_path, stderr_path)
+    """
+    key = _job_parameters_key(job_script_directory, job_name, job_other_options,
+                              job_environment, working_directory)
+    batch, index = _array_job_submitter.submit(drmaa_session, job_template, job_script_path, window,
+                                               key, job_script_directory, job_name, logger)
+    jobid = batch.jobids[index - 1]
+    stdout_path = "%s.%d.stdout" % (batch.script_path, index)
+    stderr_path = "%s.%d.stderr" % (batch.script_path, index)
+    if timing is not None:
+        timing.submitted(jobid)
+    try:
+        job_info = wait_for_drmaa_job(jobid, drmaa_session, logger, pipeline,
+                                      polling_policy, job_other_options, timing, retry_policy)
+    except BaseException:
+        _array_job_submitter.release(batch, logger=logger)
+        raise
+    return jobid, job_info, batch, stdout_path, stderr_path
+
+
+class CommandBatcher(_JobGatherer):
+    """
+    Packs many short commands into a single job script.
+
+    Each command runs in its own subshell between marker lines carrying its
+        index (and, on stdout, its exit code), so the stdout / stderr of the
+        combined job can be split back per command.
+    """
+
+    def run(self, cmd_str, batch_size, window, key, run_batch):
+        """
+        Adds cmd_str to the open batch for key. The leader runs the combined
+            script through run_batch(batch_cmd_str) -> (stdout, stderr).
+
+        Returns (exit_status, stdout, stderr) of cmd_str alone.
+            exit_status is None if the command never completed.
+        """
+        batch, index, is_leader = self._join(key, cmd_str, window, batch_size)
+
+        if is_leader:
+            try:
+                marker = "@@ruffus_batch_" + uuid.uuid4().hex
+                stdout, stderr = run_batch(self._combine_commands(batch.items, marker))
+                batch.results = self._split_output(stdout, stderr, marker, len(batch.items))
+            except Exception as err:
+                batch.error = err
+            finally:
+                batch.submitted.set()
+        else:
+            self._wait_until_submitted(batch)
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index - 1]
+
+    @staticmethod
+    def _combine_commands(cmd_strs, marker):
+        lines = []
+        for index, cmd_str in enumerate(cmd_strs, 1):
+            lines.append("echo '%s begin %d'; echo '%s begin %d' >&2" % (marker, index, marker, index))
+            lines.append("(\n%s\n)" % cmd_str)
+            # the newline before each end marker is stripped again when splitting
+            lines.append("printf '\\n%s end %d %%d\\n' $?; printf '\\n%s end %d\\n' >&2"
+                         % (marker, index, marker, index))
+        lines.append("exit 0")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _split_section(text, marker, index):
+        """
+        Returns (section text, rest of the end marker line) or (None, None)
+        """
+        begin = "%s begin %d\n" % (marker, index)
+        end = "\n%s end %d" % (marker, index)
+        start = text.find(begin)
+        if start < 0:
+            return None, None
+        start += len(begin)
+        finish = text.find(end, start)
+        if finish < 0:
+            return text[start:], None
+        end_line = text[finish + len(end):].split("\n", 1)[0]
+        return text[start:finish], end_line
+
+    @classmethod
+    def _split_output(cls, stdout, stderr, marker, count):
+        stdout = "".join(stdout)
+        stderr = "".join(stderr)
+        results = []
+        for index in range(1, count + 1):
+            cmd_stdout, end_line = cls._split_section(stdout, marker, index)
+            cmd_stderr, _ = cls._split_section(stderr, marker, index)
+            try:
+                exit_status = int(end_line)
+            except (TypeError, ValueError):
+                exit_status = None
+            results.append((exit_status,
+                            (cmd_stdout or "").splitlines(True),
+                            (cmd_stderr or "").splitlines(True)))
+        return results
+
+
+_command_batcher = CommandBatcher()
+
+
+def run_job_in_command_batch(cmd_str, batch_size, batch_window, job_name, job_other_options,
+                             job_script_directory, job_environment, working_directory,
+                             retain_job_scripts, logger, drmaa_session, verbose, resubmit,
+                             pipeline, array_window, polling_policy=None, submission_limiter=None):
+    """
+    Runs cmd_str as part of a job script shared with up to batch_size - 1
+        other commands with the same parameters
+    """
+    if batch_window is None:
+        batch_window = COMMAND_BATCH_WINDOW
+
+    def run_batch(batch_cmd_str):
+        return run_job_using_drmaa(batch_cmd_str, job_name, job_other_options,
+                                   job_script_directory, job_environment, working_directory,
+                                   retain_job_scripts, logger, drmaa_session,
+                                   verbose, resubmit, pipeline, array_window,
+                                   polling_policy=polling_policy,
+                                   submission_limiter=submission_limiter)
+
+    key = (drmaa_session,) + _job_parameters_key(job_script_directory, job_name, job_other_options,
+                                                 job_environment, working_directory)
+    exit_status, stdout, stderr = _command_batcher.run(cmd_str, batch_size, batch_window,
+                                                       key, run_batch)
+
+    job_info_str = "The original command was: >> %s <<\n" % cmd_str
+    if stderr:
+        job_info_str += "The stderr was: \n%s\n\n" % output_excerpt(stderr)
+    if stdout:
+        job_info_str += "The stdout was: \n%s\n\n" % output_excerpt(stdout)
+    if exit_status is None:
+        raise error_drmaa_job("The batched drmaa command did not complete:\n%s" % job_info_str)
+    if exit_status:
+        raise error_drmaa_job("The batched drmaa command exited with status %i:\n%s"
+                              % (exit_status, job_info_str))
+    return stdout, stderr
+
+
+def prepare_drmaa_job(cmd_str, drmaa_session, job_name, job_other_options, job_script_directory,
+                      job_environment, working_directory, job_launcher=False):
+    """
+    Makes the job template and job script for cmd_str, or with job_launcher
+        passes cmd_str to the JobLauncher of job_script_directory
+
+    Returns (job_template, job_script_path, stdout_path, stderr_path)
+    """
+    # make job template, or reuse one prepared with the same parameters
+    job_template = get_job_template_cache(drmaa_session).acquire(
+        job_name, job_environment, working_directory, job_other_options)
+
+    # make job script
+    if not job_script_directory:
+        job_script_directory = os.getcwd()
+    if job_launcher:
+        (job_template.remoteCommand, job_template.args, job_script_path,
+         stdout_path, stderr_path) = get_job_launcher(job_script_directory).prepare(
+            cmd_str, job_name, job_other_options, job_environment, working_directory)
+    else:
+        job_script_path, stdout_path, stderr_path = write_job_script_to_temp_file(
+            cmd_str, job_script_directory, job_name, job_other_options, job_environment,
+            working_directory)
+        job_template.remoteCommand = job_script_path
+        job_template.args = []
+
+    # drmaa paths specified as [hostname]:file_path.
+    # See http://www.ogf.org/Public_Comment_Docs/Documents/2007-12/ggf-drmaa-idl-binding-v1%2000%20RC7.pdf
+    job_template.outputPath = ":" + stdout_path
+    job_template.errorPath = ":" + stderr_path
+
+    return job_template, job_script_path, stdout_path, stderr_path
+
+
+def collect_drmaa_job_output(cmd_str, jobid, job_info, drmaa_session, job_template,
+                             job_script_path, stdout_path, stderr_path,
+                             retain_job_scripts, logger, verbose, timing=None,
+                             stream_output=False):
+    """
+    Reads the output of a finished job, throws if it failed, and cleans up
+        its job template and script
+
+    Returns (stdout, stderr): lists of lines, or JobOutput if stream_output
+    """
+    #   clean up job template (keep it for the next job like it), whether
+    #   or not the job failed
+    if job_template is not None:
+        get_job_template_cache(drmaa_session).release(job_template)
+
+    #
+    #   Read output
+    #
+    if stream_output:
+        get_output_file_watcher().wait_until_ready((stdout_path, stderr_path), 10)
+        stdout, stderr = JobOutput(stdout_path), JobOutput(stderr_path)
+    else:
+        stdout, stderr = read_stdout_stderr_from_files(
+            stdout_path, stderr_path, logger, cmd_str)
+    if timing is not None:
+        timing.job_info = job_info
+        timing.record("output_read")
+
+    #   Cleanup job script unless retain_job_scripts is set, whether or not
+    #   the job failed
+    if os.path.basename(job_script_path) == JOB_LAUNCHER_FILE_NAME:
+        # shared by all jobs: keep the command in the manifest instead
+        if retain_job_scripts:
+            get_job_launcher(os.path.dirname(job_script_path)).retain(
+                jobid, cmd_str, stdout_path, stderr_path)
+    elif retain_job_scripts:
+        # job scripts have the jobid as an extension
+        os.rename(job_script_path, job_script_path + ".%s" % jobid)
+    else:
+        try:
+            os.unlink(job_script_path)
+        except OSError:
+            if logger:
+                logger.warning(
+                    "Temporary job script wrapper '%s' missing (and ignored) at clean-up" % job_script_path)
+
+    job_info_str = ("The original command was: >> %s <<\n"
+                    "The jobid was: %s\n"
+                    "The job script name was: %s\n" %
+                    (cmd_str,
+                     jobid,
+                     job_script_path))
+
+    def stderr_stdout_to_str(stderr, stdout):
+        """
+        Concatenate stdout and stderr to string
+        """
+        result = ""
+        stderr_str = output_excerpt(stderr)
+        stdout_str = output_excerpt(stdout)
+        if stderr_str:
+            result += "The stderr was: \n%s\n\n" % stderr_str
+        if stdout_str:
+            result += "The stdout was: \n%s\n\n" % stdout_str
+        if stream_output:
+            # nobody gets the output files of a failed job to clean up
+            stderr.delete()
+            stdout.delete()
+        return result
+
+    #   Throw if failed
+    if job_info:
+        job_info_str += "Resources used: %s " % (job_info.resourceUsage)
+        if job_info.wasAborted:
+            raise error_drmaa_job("The drmaa command was never ran but used %s:\n%s"
+                                  % (job_info.exitStatus, job_info_str + stderr_stdout_to_str(stderr, stdout)))
+        elif job_info.hasSignal:
+            raise error_drmaa_job("The drmaa command was terminated by signal %s:\n%s"
+                                  % (job_info.terminatedSignal, job_info_str + stderr_stdout_to_str(stderr, stdout)))
+        elif job_info.hasExited:
+            if job_info.exitStatus:
+                raise error_drmaa_job("The drmaa command exited with status %i:\n%s"
+                                      % (job_info.exitStatus, job_info_str + stderr_stdout_to_str(stderr, stdout)))
+            #   Decorate normal exit with some resource usage information
+            elif verbose:
+                def nice_mem_str(num):
+                    """
+                    Format memory sizes
+                    http://stackoverflow.com/questions/1094841
+                    """
+                    num = float(num)
+                    for x in ['bytes', 'KB', 'MB', 'GB']:
+                        if num < 1024.0:
+                            return "%3.1f%s" % (num, x)
+                        num /= 1024.0
+                    return "%3.1f%s" % (num, 'TB')
+
+                try:
+                    resource_usage_str = []
+                    if 'maxvmem' in job_info.resourceUsage:
+                        if 'mem' in job_info.resourceUsage:
+                            resource_usage_str.append("Mem=%s(%s)" % (nice_mem_str(
+                                job_info.resourceUsage['maxvmem']), job_info.resourceUsage['mem']))
+                        else:
+                            resource_usage_str.append("Mem=%s" % nice_mem_str(
+                                job_info.resourceUsage['maxvmem']))
+                    if 'ru_wallclock' in job_info.resourceUsage:
+                        resource_usage_str.append("CPU wallclock= %.2gs" % float(
+                            job_info.resourceUsage['ru_wallclock']))
+                    if len(resource_usage_str):
+                        logger.info("Drmaa command used %s in running %s" % (
+                            ", ".join(resource_usage_str), cmd_str))
+                    else:
+                        logger.info(
+                            "Drmaa command successfully ran %s" % cmd_str)
+                except:
+                    logger.info("Drmaa command used %s in running %s" %
+                                (job_info.resourceUsage, cmd_str))
+
+    return stdout, stderr
+
+
+def run_job_using_drmaa(cmd_str, job_name=None, job_other_options=None,
+                        job_script_directory=None, job_environment=None,
+                        working_directory=None, retain_job_scripts=False, logger=None,
+                        drmaa_session=None, verbose=0, resubmit=0,
+                        pipeline=None, array_window=0, batch_size=0, batch_window=None,
+                        polling_policy=None, stream_output=False, journal=False,
+                        retry_policy=None, submission_limiter=None, job_launcher=False):
+    """
+    Runs specified command remotely using drmaa,
+    either with the specified session, or the module shared drmaa session
+
+    If array_window is set, jobs with the same parameters arriving within
+        array_window seconds of each other are submitted together as one
+        array job.
+
+    If batch_size is set, up to batch_size commands with the same parameters
+        arriving within batch_window seconds are run one after the other by
+        a single job.
+
+    polling_policy (a PollingPolicy) decides how often the job status is
+        checked.
+
+    If stream_output is set, stdout and stderr are returned as JobOutput,
+        left in their files, instead of lists of lines. Batched commands
+        (batch_size) always return lists.
+
+    If journal is set, the job is recorded in the JobJournal of
+        job_script_directory, and an identical command run after the driver
+        died reattaches to the job of the earlier run, if it can still be
+        followed, instead of submitting it again. Jobs gathered into arrays
+        (array_window) are not journalled.
+
+    retry_policy (a RetryPolicy, default get_default_retry_policy()) decides
+        how drmaa calls are retried. Submissions are retried only by
+        resubmitting (resubmit), after the policy's delay if the submission
+        failed on a communication error. Permanent drmaa errors (e.g. a
+        rejected native specification) are not resubmitted.
+
+    submission_limiter (a SubmissionLimiter) limits how fast jobs are
+        submitted and how many are in flight.
+
+    If job_launcher is set, the job runs the JobLauncher script of
+        job_script_directory rather than a job script of its own. Jobs gathered
+        into arrays (array_window) or batches (batch_size) still get scripts.
+    """
+    retry_policy = retry_policy or get_default_retry_policy()
+    # used specified session else module session
+    if drmaa_session is None:
+        raise error_drmaa_job("Please specify a drmaa_session in run_job()")
+
+    if batch_size > 1:
+        return run_job_in_command_batch(cmd_str, batch_size, batch_window, job_name,
+                                        job_other_options, job_script_directory,
+                                        job_environment, working_directory,
+                                        retain_job_scripts, logger, drmaa_session,
+                                        verbose, resubmit, pipeline, array_window,
+                                        polling_policy, submission_limiter)
+
+    timing = JobTiming(cmd_str, job_name)
+
+    if not job_script_directory:
+        job_script_directory = os.getcwd()
+
+    job_journal = None
+    if journal and not array_window:
+        job_journal = get_job_journal(job_script_directory)
+        job_key = JobJournal.job_key(cmd_str, job_name, job_other_options,
+                                     job_environment, working_directory)
+        result = _run_journalled_job(job_journal, job_key, cmd_str, drmaa_session, timing,
+                                     retain_job_scripts, logger, verbose, pipeline,
+                                     polling_policy, job_other_options, stream_output)
+        if result is not None:
+            return result
+
+    job_template, job_script_path, stdout_path, stderr_path = prepare_drmaa_job(
+        cmd_str, drmaa_session, job_name, job_other_options, job_script_directory,
+        job_environment, working_directory, job_launcher and not array_window)
+    timing.record("script_written")
+
+    if job_journal is not None:
+        timing.hooks.append(_journal_hook(job_journal, job_key, job_script_path,
+                                          stdout_path, stderr_path))
+
+    array_batch = None
+
+    def submit():
+        if submission_limiter is None:
+            return submit_job()
+        limiter_key = submission_limiter.acquire(job_other_options)
+        try:
+            return submit_job()
+        finally:
+            submission_limiter.release(limiter_key)
+
+    def submit_job():
+        nonlocal stdout_path, stderr_path, array_batch
+        if not array_window:
+            return submit_drmaa_job(cmd_str, drmaa_session, job_template, logger, pipeline,
+                                    polling_policy, job_other_options, timing, retry_policy)
+        if array_batch is not None:
+            # resubmitted: done with the array job of the failed attempt
+            _array_job_submitter.release(array_batch, retain_job_scripts, logger)
+            array_batch = None
+        jobid, job_info, array_batch, stdout_path, stderr_path = submit_drmaa_array_task(
+            cmd_str, drmaa_session, job_template, job_script_path, array_window,
+            job_script_directory, job_name, job_other_options, job_environment,
+            working_directory, logger, pipeline, polling_policy, timing, retry_policy)
+        return jobid, job_info
+
+    # Run job and wait
+    jobid = None
+    try:
+        if resubmit:
+            exitStatus = 1
+            jobCount = 0
+            while (exitStatus and jobCount < resubmit):
+                try:
+                    jobid, job_info = submit()
+                    if job_failed(job_info):
+                        exitStatus = job_info.exitStatus or 1
+                        if logger:
+                            logger.debug("job %s exited with %d" %
+                                         (str(jobid), job_info.exitStatus))
+                    else:
+                        exitStatus = 0
+                        if logger:
+                            logger.debug("job %s exited normally" % str(jobid))
+                except JobSignalledBreak:
+                    raise
+                except Exception as err:
+                    if logger:
+                        logger.debug(err)
+                    exitStatus = 1
+                    error_kind = retry_policy.classify(err)
+                    if isinstance(err, _drmaa().errors.DrmaaException) and error_kind == RetryPolicy.PERMANENT:
+                        raise
+                    if error_kind == RetryPolicy.TRANSIENT and jobCount + 1 < resubmit:
+                        _sleep(retry_policy.delay(jobCount + 1))
+
+                jobCount += 1
+                if logger and exitStatus:
+                    logger.debug(
+                        "Resubmitting job, resubmission count is %d" % jobCount)
+
+            if not jobid:
+                raise error_drmaa_job("Job could not be submitted within %d attempts" % resubmit)
+        else:
+            jobid, job_info = submit()
+
+        # the job template is released below, also when the job failed
+        return collect_drmaa_job_output(cmd_str, jobid, job_info, drmaa_session, None,
+                                        job_script_path, stdout_path, stderr_path,
+                                        retain_job_scripts, logger, verbose, timing,
+                                        stream_output)
+    finally:
+        get_job_template_cache(drmaa_session).release(job_template)
+        if array_batch is not None:
+            _array_job_submitter.release(array_batch, retain_job_scripts, logger)
+        # also when submission failed, or the job did (JobFailed)
+        timing.record("cleaned_up")
+
+
+def _journal_hook(job_journal, job_key, job_script_path, stdout_path, stderr_path):
+    """
+    Returns a JobTiming hook recording the job in job_journal as it is
+        submitted (and resubmitted), finishes and is cleaned up
+    """
+    def journal_job(timing, phase):
+        if phase == "submitted":
+            if journal_job.jobid is not None:
+                # resubmitted
+                job_journal.close(job_key, journal_job.jobid)
+            journal_job.jobid = timing.jobid
+            job_journal.record(job_key, timing.jobid, "submitted",
+                               job_script_path, stdout_path, stderr_path)
+        elif phase == "done":
+            job_journal.record(job_key, timing.jobid, "finished",
+                               job_script_path, stdout_path, stderr_path)
+        elif phase == "cleaned_up" and timing.jobid is not None:
+            job_journal.close(job_key, timing.jobid)
+    journal_job.jobid = None
+    return journal_job
+
+
+def _run_journalled_job(job_journal, job_key, cmd_str, drmaa_session, timing,
+                        retain_job_scripts, logger, verbose, pipeline,
+                        polling_policy, job_other_options, stream_output):
+    """
+    Reattaches to the job left open in job_journal by an earlier run of the
+        same command, if any, and returns its output.
+    Returns None if there is no job to reattach to.
+    """
+    while True:
+        entry = job_journal.claim(job_key)
+        if entry is None:
+            return None
+        try:
+            job_info = reattach_drmaa_job(entry, drmaa_session, logger, pipeline,
+                                          polling_policy, job_other_options, timing)
+        except JobSignalledBreak:
+            raise
+        except Exception as err:
+            if logger:
+                logger.info("could not reattach to job with jobid {}: {}".format(entry["jobid"], err))
+            job_journal.close(job_key, entry["jobid"])
+            continue
+        try:
+            return collect_drmaa_job_output(cmd_str, entry["jobid"], job_info, drmaa_session, None,
+                                            entry["job_script_path"], entry["stdout_path"],
+                                            entry["stderr_path"], retain_job_scripts, logger,
+                                            verbose, timing, stream_output)
+        finally:
+            job_journal.close(job_key, entry["jobid"])
+            timing.record("cleaned_up")
+
+
+class ResultCache(object):
+    """
+    Content-addressed store of job results: the output files, stdout and
+        stderr of each job, keyed on its command, job_other_options and the
+        contents of its input files (run_job(..., result_cache=...)).
+
+    On a hit, run_job recreates the output files as copies of the stored
+        ones and returns the stored stdout and stderr without running
+        anything. Outputs are stored as copies too: cloned (reflinked) where
+        the file system can, so storing costs no space until either side is
+        modified. No stored file shares an inode with an output, which jobs
+        may rewrite in place (awk ... > output).
+
+    The least recently used results are evicted once the store grows beyond
+        max_size bytes.
+
+        {directory}/{key[:2]}/{key}/result.json, output.0, output.1...
+    """
+
+    def __init__(self, directory, max_size=None):
+        self.directory = os.path.abspath(directory)
+        self.max_size = RESULT_CACHE_MAX_SIZE if max_size is None else max_size
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._digests = {}
+        os.makedirs(self.directory, exist_ok=True)
+        # running total of the stored results, so that storing one does
+        # not rescan the store
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def file_digest(self, path):
+        """
+        sha256 of the contents of path, remembered while its size and
+            modification time are unchanged
+        """
+        file_stat = os.stat(path)
+        signature = (file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+        with self._lock:
+            known = self._digests.get(path)
+        if known is not None and known[0] == signature:
+            return known[1]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        with self._lock:
+            self._digests[path] = (signature, digest.hexdigest())
+        return digest.hexdigest()
+
+    def key(self, cmd_str, job_other_options, input_files):
+        """
+        Returns the key of a job, or None if an input file is missing
+        """
+        try:
+            digests = [self.file_digest(path) for path in input_files or []]
+        except OSError:
+            return None
+        return hashlib.sha256(json.dumps([cmd_str, job_other_options, digests]).encode()).hexdigest()
+
+    def _entry_directory(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    @staticmethod
+    def _copy(source, destination):
+        """
+        Replaces destination by a reflinked clone of source, or a copy where
+            the file system cannot clone
+        """
+        temp_path = "%s.%s.tmp" % (destination, uuid.uuid4().hex)
+        try:
+            try:
+                import fcntl
+                with open(source, "rb") as source_file, open(temp_path, "wb") as temp_file:
+                    fcntl.ioctl(temp_file.fileno(), FICLONE, source_file.fileno())
+                shutil.copystat(source, temp_path)
+            except (ImportError, OSError):
+                shutil.copy2(source, temp_path)
+            os.replace(temp_path, destination)
+        except BaseException:
+            if os.path.lexists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def fetch(self, key, output_files):
+        """
+        Recreates output_files from the result stored under key and returns
+            (stdout, stderr), or None if there is no such result
+        """
+        entry_directory = self._entry_directory(key)
+        try:
+            with open(os.path.join(entry_directory, "result.json")) as f:
+                result = json.load(f)
+            if len(result["output_files"]) != len(output_files or []):
+                raise ValueError("different number of output files")
+            for index, path in enumerate(output_files or []):
+                self._copy(os.path.join(entry_directory, "output.%d" % index), path)
+            # last used
+            os.utime(os.path.join(entry_directory, "result.json"))
+        except (IOError, OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return result["stdout"], result["stderr"]
+
+    def store(self, key, output_files, stdout, stderr):
+        """
+        Stores the result of a successful job. Does nothing if an output
+            file is missing.
+        """
+        entry_directory = self._entry_directory(key)
+        temp_directory = tempfile.mkdtemp(prefix=".tmp_", dir=self.directory)
+        try:
+            size = 0
+            for index, path in enumerate(output_files or []):
+                stored_path = os.path.join(temp_directory, "output.%d" % index)
+                self._copy(path, stored_path)
+                size += os.path.getsize(stored_path)
+            with open(os.path.join(temp_directory, "result.json"), "w") as f:
+                json.dump({"output_files": list(output_files or []), "stdout": list(stdout),
+                           "stderr": list(stderr), "size": size}, f)
+            os.makedirs(os.path.dirname(entry_directory), exist_ok=True)
+            os.rename(temp_directory, entry_directory)
+        except OSError:
+            # missing output, or stored concurrently by an identical job
+            shutil.rmtree(temp_directory, ignore_errors=True)
+            return
+        with self._lock:
+            self.stores += 1
+            self._size += size
+            over_size = self._size > self.max_size
+        if over_size:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for prefix in os.listdir(self.directory):
+            prefix_directory = os.path.join(self.directory, prefix)
+            if prefix.startswith(".") or not os.path.isdir(prefix_directory):
+                continue
+            for key in os.listdir(prefix_directory):
+                result_path = os.path.join(prefix_directory, key, "result.json")
+                try:
+                    with open(result_path) as f:
+                        size = json.load(f)["size"]
+                    entries.append((os.stat(result_path).st_mtime, size, os.path.dirname(result_path)))
+                except (IOError, OSError, ValueError, KeyError):
+                    continue
+        return entries
+
+    def size(self):
+        with self._lock:
+            return self._size
+
+    def evict(self):
+        """
+        Removes the least recently used results until the store fits max_size.
+            Rescans the store, so results stored by other processes count too.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_directory in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+        with self._lock:
+            self._size = total
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "stores": self.stores,
+                    "evictions": self.evictions}
+
+
+def run_job(cmd_str, job_name=None, job_other_options=None, job_script_directory=None,
+            job_environment=None, working_directory=None, logger=None,
+            drmaa_session=None, retain_job_scripts=False,
+            run_locally=False, output_files=None, touch_only=False,
+            verbose=0, local_echo=False,
+            resubmit=0, pipeline=None, array_window=0, batch_size=0, batch_window=None,
+            polling_policy=None, stream_output=False, journal=False,
+            result_cache=None, input_files=None, retry_policy=None, submission_limiter=None,
+            local_executor=None, job_launcher=False):
+    """
+    Runs specified command either using drmaa, or locally or only in simulation (touch the output files only)
+
+    drmaa_session may be a drmaa.Session, or a DrmaaSessionManager (which
+        reconnects if the session dies).
+
+    run_locally: runs the job on this machine through local_executor (a
+        local_drmaa.Session, get_local_executor() by default), which packs
+        jobs onto the cpus and memory they request in job_other_options
+        (--cpus-per-task, --mem, --mem-per-cpu) as SLURM would. With
+        local_echo, Ruffus' run_job_locally runs the job instead, echoing its
+        output.
+
+    stream_output, job_launcher: see run_job_using_drmaa. Ignored with local_echo.
+
+    result_cache: a ResultCache. The job is not run if the cache holds the
+        result of cmd_str with the same job_other_options and input_files
+        contents: output_files are copied from the cache instead. Not used
+        with stream_output.
+    """
+
+    pipeline = lookup_pipeline(pipeline)
+
+    if touch_only:
+        touch_output_files(cmd_str, output_files, logger)
+        return "", "",
+
+    cache_key = None
+    if result_cache is not None and not stream_output:
+        cache_key = result_cache.key(cmd_str, job_other_options, input_files)
+    if cache_key is not None:
+        result = result_cache.fetch(cache_key, output_files)
+        if result is not None:
+            if logger:
+                logger.debug("result of %s taken from the cache" % cmd_str)
+            return result
+        stdout, stderr = _run_job(cmd_str, job_name, job_other_options, job_script_directory,
+                                  job_environment, working_directory, logger, drmaa_session,
+                                  retain_job_scripts, run_locally, verbose, local_echo,
+                                  resubmit, pipeline, array_window, batch_size, batch_window,
+                                  polling_policy, stream_output, journal, retry_policy,
+                                  submission_limiter, local_executor, job_launcher)
+        result_cache.store(cache_key, output_files, stdout, stderr)
+        return stdout, stderr
+
+    return _run_job(cmd_str, job_name, job_other_options, job_script_directory,
+                    job_environment, working_directory, logger, drmaa_session,
+                    retain_job_scripts, run_locally, verbose, local_echo,
+                    resubmit, pipeline, array_window, batch_size, batch_window,
+                    polling_policy, stream_output, journal, retry_policy,
+                    submission_limiter, local_executor, job_launcher)
+
+
+def run_job_locally(cmd_str, logger=None, job_environment=None, working_directory=None,
+                    local_echo=False):
+    """
+    Ruffus' run_job_locally. ruffus.drmaa_wrapper imports drmaa and gevent
+        itself, so it is only imported once a job needs it.
+    """
+    from ruffus.drmaa_wrapper import run_job_locally
+    return run_job_locally(cmd_str, logger, job_environment, working_directory, local_echo)
+
+
+def touch_output_files(cmd_str, output_files, logger=None):
+    """
+    Ruffus' touch_output_files, imported on first use as run_job_locally is
+    """
+    from ruffus.drmaa_wrapper import touch_output_files
+    return touch_output_files(cmd_str, output_files, logger)
+
+
+def _run_job(cmd_str, job_name, job_other_options, job_script_directory,
+             job_environment, working_directory, logger, drmaa_session,
+             retain_job_scripts, run_locally, verbose, local_echo,
+             resubmit, pipeline, array_window, batch_size, batch_window,
+             polling_policy, stream_output, journal, retry_policy,
+             submission_limiter, local_executor, job_launcher):
+    if run_locally:
+        if local_echo:
+            # Ruffus echoes the output as it is written
+            return run_job_locally(cmd_str, logger, job_environment, working_directory, local_echo)
+        # local jobs are not journalled (they die with the driver) nor held
+        # back by the cluster submission limiter
+        return run_job_using_drmaa(cmd_str, job_name, job_other_options,
+                                   job_script_directory, job_environment, working_directory,
+                                   retain_job_scripts, logger, local_executor or get_local_executor(),
+                                   verbose, resubmit, pipeline, array_window,
+                                   batch_size, batch_window, polling_policy or LOCAL_POLLING_POLICY,
+                                   stream_output, False, retry_policy, None, job_launcher)
+
+    return run_job_using_drmaa(cmd_str, job_name, job_other_options,
+                               job_script_directory, job_environment, working_directory,
+                               retain_job_scripts, logger, drmaa_session,
+                               verbose, resubmit, pipeline, array_window,
+                               batch_size, batch_window, polling_policy, stream_output,
+                               journal, retry_policy, submission_limiter, job_launcher)
+
+
+# Polling of jobs run by the local executor, which start without queueing
+LOCAL_POLLING_POLICY = ExponentialBackoffPollingPolicy(initial_interval=0.05, max_interval=1)
+
+_local_executor = None
+_local_executor_lock = threading.Lock()
+
+
+def get_local_executor():
+    """
+    Returns the local_drmaa.Session that run_job(run_locally=True) runs jobs
+        on by default, using all cpus and memory of this machine. Its
+        unfinished jobs are terminated when python exits.
+    """
+    global _local_executor
+    with _local_executor_lock:
+        if _local_executor is None:
+            import local_drmaa
+            _local_executor = local_drmaa.Session()
+            _local_executor.initialize()
+            atexit.register(_local_executor.exit)
+        return _local_executor
+
+
+def default_task_key(cmd_str, job_name):
+    """
+    Jobs of the same task: same job_name and command, ignoring numbers
+    """
+    return job_name, re.sub(r"\d+", "#", cmd_str)
+
+
+class JobDispatcher(object):
+    """
+    Runs each job locally or through drmaa, whichever is predicted to finish
+        first, from the runtimes of earlier jobs of the same task
+        (default_task_key unless task_key is given).
+
+        dispatcher = JobDispatcher()
+        stdout, stderr = dispatcher.run_job(cmd_str, drmaa_session=session, ...)
+
+    A job runs through drmaa if its task has fewer than min_samples runtimes
+        recorded, if its median runtime is over max_local_runtime seconds, if
+        it asks for more cpus or memory than the local executor has, or if
+        waiting for the local executor and running there (local_slowdown
+        times slower) would take longer than waiting in the cluster queue.
+
+    The queue wait starts at queue_latency seconds and follows the waits seen
+        for the jobs dispatched to the cluster. Runtimes are taken from the job
+        timings (the dispatcher is a job timing hook, added on creation and
+        removed by close()); jobs never seen running count from submission.
+    """
+
+    def __init__(self, local_executor=None, queue_latency=None, max_local_runtime=None,
+                 local_slowdown=1.0, min_samples=3, history_size=50, task_key=None):
+        self.local_executor = local_executor
+        self.queue_latency = DISPATCH_QUEUE_LATENCY if queue_latency is None else queue_latency
+        self.max_local_runtime = (DISPATCH_MAX_LOCAL_RUNTIME if max_local_runtime is None
+                                  else max_local_runtime)
+        self.local_slowdown = local_slowdown
+        self.min_samples = min_samples
+        self.history_size = history_size
+        self.task_key = task_key or default_task_key
+        self._lock = threading.Lock()
+        self._runtimes = {}
+        # (cmd_str, job_name) -> route, for the jobs being run
+        self._routes = {}
+        self._local_in_flight = 0
+        self._counts = collections.Counter()
+        add_job_timing_hook(self)
+
+    def close(self):
+        remove_job_timing_hook(self)
+
+    def predicted_runtime(self, cmd_str, job_name=None):
+        """
+        Median recorded runtime of the task of cmd_str, or None if it has
+            fewer than min_samples
+        """
+        with self._lock:
+            runtimes = sorted(self._runtimes.get(self.task_key(cmd_str, job_name), ()))
+        if len(runtimes) < max(1, self.min_samples):
+            return None
+        return runtimes[len(runtimes) // 2]
+
+    def route(self, cmd_str, job_name=None, job_other_options=None):
+        """
+        Returns "local" or "drmaa"
+        """
+        runtime = self.predicted_runtime(cmd_str, job_name)
+        if runtime is None or runtime > self.max_local_runtime:
+            return "drmaa"
+        local_executor = self.local_executor or get_local_executor()
+        if not local_executor.can_run(job_other_options):
+            return "drmaa"
+        with self._lock:
+            # whole runs of the local executor ahead of this job
+            waves = self._local_in_flight // local_executor.slots
+            queue_latency = self.queue_latency
+        local_time = runtime * (waves + self.local_slowdown)
+        return "local" if local_time < queue_latency + runtime else "drmaa"
+
+    def run_job(self, cmd_str, job_name=None, job_other_options=None, run_locally=False,
+                **run_job_args):
+        """
+        Calls run_job for cmd_str, locally if route() says so or run_locally
+        """
+        route = "local" if run_locally else self.route(cmd_str, job_name, job_other_options)
+        with self._lock:
+            self._counts[route] += 1
+            self._routes[cmd_str, job_name] = route
+            if route == "local":
+                self._local_in_flight += 1
+        try:
+            return run_job(cmd_str, job_name=job_name, job_other_options=job_other_options,
+                           run_locally=route == "local", local_executor=self.local_executor,
+                           **run_job_args)
+        finally:
+            with self._lock:
+                self._routes.pop((cmd_str, job_name), None)
+                if route == "local":
+                    self._local_in_flight -= 1
+
+    def __call__(self, timing, phase):
+        if phase != "done" or "submitted" not in timing.timestamps:
+            return
+        done = timing.timestamps["done"]
+        started = timing.timestamps.get("running", timing.timestamps["submitted"])
+        key = self.task_key(timing.cmd_str, timing.job_name)
+        with self._lock:
+            runtimes = self._runtimes.setdefault(key, collections.deque(maxlen=self.history_size))
+            runtimes.append(done - started)
+            if (self._routes.get((timing.cmd_str, timing.job_name)) == "drmaa" and
+                    "running" in timing.timestamps):
+                wait = timing.timestamps["running"] - timing.timestamps["submitted"]
+                self.queue_latency += 0.2 * (wait - self.queue_latency)
+
+    def stats(self):
+        """
+        Returns the number of jobs run locally and through drmaa, and the
+            current estimate of the cluster queue wait
+        """
+        with self._lock:
+            return {"local": self._counts["local"],
+                    "drmaa": self._counts["drmaa"],
+                    "queue_latency": self.queue_latency}
+
+
+class ResourceHistory(object):
+    """
+    Memory and walltime used by the jobs of each task (default_task_key
+        unless task_key is given), kept in an append-only JSON lines file, from
+        which later jobs of the task are requested the percentile of the
+        recorded usage times margin:
+
+        history = ResourceHistory("job_resources.jsonl")
+        job_other_options = history.right_size(job_other_options, cmd_str, job_name)
+
+    Usage is taken from the maxvmem and ru_wallclock resources of the job
+        info of jobs which exited successfully (the history is a job timing
+        hook, added on creation and removed by close()). Requests are left
+        alone until a task has min_samples jobs recorded.
+    """
+
+    def __init__(self, path, percentile=0.95, margin=1.2, min_samples=5, history_size=100,
+                 task_key=None):
+        self.path = path
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.history_size = history_size
+        self.task_key = task_key or default_task_key
+        self._lock = threading.Lock()
+        self._usage = {}
+        self._load()
+        add_job_timing_hook(self)
+
+    def close(self):
+        remove_job_timing_hook(self)
+
+    def _history(self, key):
+        return self._usage.setdefault(key, collections.deque(maxlen=self.history_size))
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except IOError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # torn last line of a killed run
+                continue
+            self._history((entry["job_name"], entry["command"])).append(
+                (entry["memory"], entry["walltime"]))
+
+    def record(self, cmd_str, job_name, memory, walltime):
+        """
+        Records a job of the task of cmd_str using memory MB for walltime seconds
+        """
+        key = self.task_key(cmd_str, job_name)
+        line = json.dumps({"job_name": key[0], "command": key[1],
+                           "memory": memory, "walltime": walltime}) + "\n"
+        with self._lock:
+            self._history(key).append((memory, walltime))
+            with open(self.path, "a") as f:
+                f.write(line)
+
+    def __call__(self, timing, phase):
+        job_info = timing.job_info
+        if phase != "output_read" or job_info is None:
+            return
+        if not job_info.hasExited or job_info.exitStatus:
+            return
+        try:
+            memory = float(job_info.resourceUsage["maxvmem"]) / 1024 ** 2
+            walltime = float(job_info.resourceUsage["ru_wallclock"])
+        except (KeyError, TypeError, ValueError):
+            return
+        self.record(timing.cmd_str, timing.job_name, memory, walltime)
+
+    def suggest(self, cmd_str, job_name=None):
+        """
+        Returns (memory in MB, walltime in seconds) to request for a job of
+            the task of cmd_str, or None if the task has too few jobs recorded
+        """
+        with self._lock:
+            usage = list(self._usage.get(self.task_key(cmd_str, job_name), ()))
+        if len(usage) < max(1, self.min_samples):
+            return None
+        index = min(len(usage) - 1, int(math.ceil(self.percentile * len(usage))) - 1)
+        memory = sorted(memory for memory, _ in usage)[index]
+        walltime = sorted(walltime for _, walltime in usage)[index]
+        return memory * self.margin, walltime * self.margin
+
+    def right_size(self, job_other_options, cmd_str, job_name=None):
+        """
+        Returns job_other_options with the --mem / --mem-per-cpu and --time
+            requests replaced by suggest()ed ones (in whole MB and minutes),
+            or unchanged if there is no suggestion
+        """
+        suggestion = self.suggest(cmd_str, job_name)
+        if suggestion is None:
+            return job_other_options
+        memory, walltime = suggestion
+        job_other_options = job_other_options or ""
+        cpus = re.search(r"(?:--cpus-per-task(?:=|\s+)|(?:^|\s)-c\s*)(\d+)", job_other_options)
+        if re.search(r"--mem-per-cpu(?:=|\s)", job_other_options):
+            memory_option = "--mem-per-cpu=%d" % math.ceil(memory / int(cpus.group(1) if cpus else 1))
+        else:
+            memory_option = "--mem=%d" % math.ceil(memory)
+        time_option = "--time=%d" % max(1, math.ceil(walltime / 60))
+        # --time 60, --time=60 and -t 60 / -t60 alike
+        options = re.sub(r"(?:^|\s+)(?:--(?:mem|mem-per-cpu|time)(?:=|\s+)|-t\s*)\S+", "",
+                         job_other_options).strip()
+        return " ".join(option for option in (options, memory_option, time_option) if option)
+
+
+def _get_async_executor():
+    """
+    The bounded thread pool on which run_job_async makes blocking calls
+    """
+    global _async_executor
+    with _async_executor_lock:
+        if _async_executor is None:
+            import concurrent.futures
+            _async_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix="drmaa_async")
+        return _async_executor
+
+
+_async_executor = None
+_async_executor_lock = threading.Lock()
+
+
+async def wait_for_drmaa_job_async(jobid, drmaa_session, logger, pipeline,
+                                   polling_policy=None, job_other_options=None, executor=None,
+                                   timing=None, retry_policy=None):
+    """
+    Coroutine version of wait_for_drmaa_job: awaits the shared status poller
+        rather than blocking a thread.
+    The job is terminated if the awaiting task is cancelled.
+
+    Returns job_info
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    executor = executor or _get_async_executor()
+
+    poller = get_job_status_poller(drmaa_session)
+    if polling_policy is None:
+        polling_policy = PollingPolicy()
+    retry_policy = retry_policy or get_default_retry_policy()
+    watch = poller.watch(jobid, logger, polling_policy.delays(job_other_options), timing,
+                         retry_policy)
+
+    finished = loop.create_future()
+
+    def set_finished():
+        if not finished.done():
+            finished.set_result(None)
+    watch.add_done_callback(lambda: loop.call_soon_threadsafe(set_finished))
+
+    is_suspended = False
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(asyncio.shield(finished), POLLER_WAKEUP_INTERVAL)
+                break
+            except asyncio.TimeoutError:
+                pass
+            # only the control call itself goes to the executor
+            is_suspended, action = _pipeline_suspension_action(jobid, watch.status, is_suspended,
+                                                               pipeline, logger)
+            if action is not None:
+                await loop.run_in_executor(executor, retry_policy.call, drmaa_session.control,
+                                           jobid, action)
+    except asyncio.CancelledError:
+        if logger:
+            logger.debug("job with jobid {} will be terminated".format(jobid))
+        poller.forget(jobid)
+        await loop.run_in_executor(executor, retry_policy.call, drmaa_session.control, jobid,
+                                   _drmaa().JobControlAction.TERMINATE)
+        raise
+
+    if watch.error is not None:
+        raise watch.error
+
+    return watch.job_info
+
+
+async def _run_journalled_job_async(job_journal, job_key, cmd_str, drmaa_session, timing,
+                                    retain_job_scripts, logger, verbose, pipeline,
+                                    polling_policy, job_other_options, stream_output,
+                                    call, executor):
+    """
+    Coroutine version of _run_journalled_job: only the journal and a first
+        status check use the executor, the job is awaited through the
+        shared status poller.
+    """
+    import asyncio
+    while True:
+        entry = await call(job_journal.claim, job_key)
+        if entry is None:
+            return None
+        try:
+            job_info = None
+            if not await call(_reattach_drmaa_job, entry, drmaa_session, logger, timing):
+                job_info = await wait_for_drmaa_job_async(entry["jobid"], drmaa_session, logger,
+                                                          pipeline, polling_policy,
+                                                          job_other_options, executor, timing)
+        except (JobSignalledBreak, asyncio.CancelledError):
+            raise
+        except Exception as err:
+            if logger:
+                logger.info("could not reattach to job with jobid {}: {}".format(entry["jobid"], err))
+            await call(job_journal.close, job_key, entry["jobid"])
+            continue
+        try:
+            return await call(collect_drmaa_job_output, cmd_str, entry["jobid"], job_info,
+                              drmaa_session, None, entry["job_script_path"], entry["stdout_path"],
+                              entry["stderr_path"], retain_job_scripts, logger, verbose, timing,
+                              stream_output)
+        finally:
+            await call(job_journal.close, job_key, entry["jobid"])
+            timing.record("cleaned_up")
+
+
+async def run_job_async(cmd_str, job_name=None, job_other_options=None, job_script_directory=None,
+                        job_environment=None, working_directory=None, logger=None,
+                        drmaa_session=None, retain_job_scripts=False,
+                        run_locally=False, output_files=None, touch_only=False,
+                        verbose=0, local_echo=False,
+                        resubmit=0, pipeline=None, array_window=0, batch_size=0, batch_window=None,
+                        polling_policy=None, stream_output=False, journal=False,
+                        result_cache=None, input_files=None, executor=None,
+                        retry_policy=None, submission_limiter=None, local_executor=None,
+                        job_launcher=False):
+    """
+    Coroutine version of run_job, taking the same parameters.
+
+    Blocking drmaa and file system calls are made on a small bounded executor
+        (ASYNC_EXECUTOR_WORKERS threads unless executor is given), and job
+        completion is awaited through the shared status poller, so no thread
+        is held while jobs are queued or running.
+
+    Jobs gathered into arrays (array_window) or batches (batch_size) wait for
+        their batch on an executor thread.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    executor = executor or _get_async_executor()
+
+    def call(function, *args):
+        return loop.run_in_executor(executor, functools.partial(function, *args))
+
+    pipeline = lookup_pipeline(pipeline)
+
+    if touch_only:
+        await call(touch_output_files, cmd_str, output_files, logger)
+        return "", "",
+
+    cache_key = None
+    if result_cache is not None and not stream_output:
+        cache_key = await call(result_cache.key, cmd_str, job_other_options, input_files)
+    if cache_key is not None:
+        result = await call(result_cache.fetch, cache_key, output_files)
+        if result is not None:
+            if logger:
+                logger.debug("result of %s taken from the cache" % cmd_str)
+            return result
+
+    if run_locally:
+        if local_echo:
+            return await call(run_job_locally, cmd_str, logger, job_environment, working_directory,
+                              local_echo)
+        # not journalled, as in run_job
+        drmaa_session = local_executor or get_local_executor()
+        polling_policy = polling_policy or LOCAL_POLLING_POLICY
+        submission_limiter = None
+        journal = False
+
+    if array_window or batch_size > 1:
+        stdout, stderr = await call(run_job_using_drmaa, cmd_str, job_name, job_other_options,
+                                    job_script_directory, job_environment, working_directory,
+                                    retain_job_scripts, logger, drmaa_session,
+                                    verbose, resubmit, pipeline, array_window,
+                                    batch_size, batch_window, polling_policy, stream_output,
+                                    journal, retry_policy, submission_limiter)
+    else:
+        stdout, stderr = await _run_job_async(cmd_str, job_name, job_other_options,
+                                              job_script_directory, job_environment,
+                                              working_directory, logger, drmaa_session,
+                                              retain_job_scripts, resubmit, pipeline,
+                                              polling_policy, stream_output, journal, call,
+                                              executor, retry_policy, submission_limiter,
+                                              job_launcher, verbose)
+    if cache_key is not None:
+        await call(result_cache.store, cache_key, output_files, stdout, stderr)
+    return stdout, stderr
+
+
+async def _run_job_async(cmd_str, job_name, job_other_options, job_script_directory,
+                         job_environment, working_directory, logger, drmaa_session,
+                         retain_job_scripts, resubmit, pipeline, polling_policy,
+                         stream_output, journal, call, executor, retry_policy,
+                         submission_limiter, job_launcher, verbose):
+    import asyncio
+
+    if drmaa_session is None:
+        raise error_drmaa_job("Please specify a drmaa_session in run_job()")
+
+    timing = JobTiming(cmd_str, job_name)
+
+    job_journal = None
+    if journal:
+        job_script_directory = job_script_directory or os.getcwd()
+        job_journal = await call(get_job_journal, job_script_directory)
+        job_key = JobJournal.job_key(cmd_str, job_name, job_other_options,
+                                     job_environment, working_directory)
+        result = await _run_journalled_job_async(job_journal, job_key, cmd_str, drmaa_session,
+                                                 timing, retain_job_scripts, logger, verbose,
+                                                 pipeline, polling_policy, job_other_options,
+                                                 stream_output, call, executor)
+        if result is not None:
+            return result
+
+    job_template, job_script_path, stdout_path, stderr_path = await call(
+        prepare_drmaa_job, cmd_str, drmaa_session, job_name, job_other_options,
+        job_script_directory, job_environment, working_directory, job_launcher)
+    timing.record("script_written")
+
+    if job_journal is not None:
+        timing.hooks.append(_journal_hook(job_journal, job_key, job_script_path,
+                                          stdout_path, stderr_path))
+
+    # Run job and wait, resubmitting as run_job_using_drmaa does
+    retry_policy = retry_policy or get_default_retry_policy()
+    jobid = None
+    job_info = None
+    try:
+        for attempt in range(max(resubmit, 1)):
+            acquired = False
+            try:
+                if submission_limiter is not None:
+                    limiter_key = await submission_limiter.acquire_async(job_other_options)
+                    acquired = True
+                jobid = await call(_submit_through_retry_budget, drmaa_session.runJob, job_template,
+                                   retry_policy)
+                if logger:
+                    logger.debug("job has been submitted with jobid {}".format(jobid))
+                timing.submitted(jobid)
+                job_info = await wait_for_drmaa_job_async(jobid, drmaa_session, logger, pipeline,
+                                                          polling_policy, job_other_options, executor,
+                                                          timing, retry_policy)
+                if not job_failed(job_info) or attempt + 1 >= resubmit:
+                    break
+                if logger:
+                    logger.debug("job %s exited with %d" % (str(jobid), job_info.exitStatus))
+                    logger.debug("Resubmitting job, resubmission count is %d" % (attempt + 1))
+            except Exception as err:
+                if not resubmit:
+                    raise
+                error_kind = retry_policy.classify(err)
+                if isinstance(err, _drmaa().errors.DrmaaException) and error_kind == RetryPolicy.PERMANENT:
+                    raise
+                if logger:
+                    logger.debug(err)
+                    logger.debug("Resubmitting job, resubmission count is %d" % (attempt + 1))
+                jobid = None
+                if error_kind == RetryPolicy.TRANSIENT and attempt + 1 < resubmit:
+                    await asyncio.sleep(retry_policy.delay(attempt + 1))
+            finally:
+                if acquired:
+                    submission_limiter.release(limiter_key)
+
+        if not jobid:
+            raise error_drmaa_job("Job could not be submitted within %d attempts" % resubmit)
+
+        # the job template is released below, also when the job failed
+        return await call(collect_drmaa_job_output, cmd_str, jobid, job_info, drmaa_session,
+                          None, job_script_path, stdout_path, stderr_path,
+                          retain_job_scripts, logger, verbose, timing, stream_output)
+    finally:
+        await call(get_job_template_cache(drmaa_session).release, job_template)
+        # also when submission failed, or the job did (JobFailed)
+        timing.record("cleaned_up")
+
+
+async def run_jobs_async(cmd_strs, return_exceptions=False, **run_job_args):
+    """
+    Runs all cmd_strs concurrently with run_job_async and the same run_job_args.
+
+    Returns a list of (stdout, stderr) in the order of cmd_strs
+        (with exceptions in place of failed jobs if return_exceptions is set)
+    """
+    import asyncio
+    return await asyncio.gather(*[run_job_async(cmd_str, **run_job_args) for cmd_str in cmd_strs],
+                                return_exceptions=return_exceptions)
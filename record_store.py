@@ -0,0 +1,188 @@
+"""
+A packed record container: many small named records in one data file plus an
+offset index, instead of one tiny file per item.
+
+    <path>          the records' contents, one after another
+    <path>.idx      one entry per record: offset and length in <path>, and key
+
+RecordWriter only ever appends to both files, so a record written twice is
+found at its latest offset. RecordReader memory-maps the data file and returns
+memoryview slices of it, so reading a record copies nothing. Index entries are
+written after their data; entries past the end of the data file (a writer that
+died between the two) are ignored.
+
+    with RecordWriter("/tmp/toy/inputs.records") as writer:
+        writer.append("file_1", b"1\\n")
+    with RecordReader("/tmp/toy/inputs.records") as records:
+        value = bytes(records["file_1"])
+
+needs_update() decides whether a container is up to date from its index and
+the modification times of two index files, so Ruffus's checks (through
+@check_if_uptodate) cost a couple of stats rather than one per record.
+"""
+
+import mmap
+import os
+import struct
+
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"RECIDX1\n"
+
+# offset and length in the data file, length of the key that follows
+_ENTRY = struct.Struct("<QIH")
+
+
+def index_path(path):
+    """
+    Returns the path of the index of the container at path
+    """
+    return path + INDEX_SUFFIX
+
+
+def read_index(path):
+    """
+    Returns a dict of the records in the container at path: key -> (offset, length)
+    :param path: data file of the container
+    :return: dict, empty if the container does not exist
+    """
+    try:
+        with open(index_path(path), "rb") as f:
+            index_data = f.read()
+        data_size = os.path.getsize(path)
+    except FileNotFoundError:
+        return {}
+    if index_data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        raise ValueError("%s is not a record index" % index_path(path))
+
+    index = {}
+    position = len(INDEX_MAGIC)
+    while position + _ENTRY.size <= len(index_data):
+        offset, length, key_length = _ENTRY.unpack_from(index_data, position)
+        position += _ENTRY.size
+        key = index_data[position:position + key_length]
+        position += key_length
+        if len(key) < key_length or offset + length > data_size:
+            break
+        index[key.decode()] = (offset, length)
+    return index
+
+
+class RecordWriter(object):
+    """
+    Appends records to the container at path, creating it if need be
+
+    :param path: data file of the container
+    :param append: keep the records already in the container (otherwise start an empty one)
+    """
+
+    def __init__(self, path, append=True):
+        self.path = path
+        mode = "ab" if append else "wb"
+        self._data = open(path, mode)
+        self._index = open(index_path(path), mode)
+        self._offset = self._data.seek(0, os.SEEK_END)
+        if self._index.seek(0, os.SEEK_END) == 0:
+            self._index.write(INDEX_MAGIC)
+
+    def append(self, key, data):
+        """
+        Append the record key with contents data (bytes)
+        """
+        key = key.encode()
+        self._data.write(data)
+        self._index.write(_ENTRY.pack(self._offset, len(data), len(key)) + key)
+        self._offset += len(data)
+
+    def flush(self):
+        """
+        Make the records appended so far visible to readers
+        """
+        self._data.flush()
+        self._index.flush()
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordReader(object):
+    """
+    Reads the records of the container at path through a memory map. Records
+    are returned as memoryviews of the map: release them (or copy them with
+    bytes()) before closing the reader.
+
+    :param path: data file of the container
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = read_index(path)
+        self._map = None
+        self._view = memoryview(b"")
+        if os.path.getsize(path):
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._map)
+
+    def __getitem__(self, key):
+        offset, length = self.index[key]
+        return self._view[offset:offset + length]
+
+    def get(self, key, default=None):
+        return self[key] if key in self.index else default
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def items(self):
+        for key in self.index:
+            yield key, self[key]
+
+    def close(self):
+        self._view.release()
+        if self._map is not None:
+            self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def needs_update(output_path, keys=(), input_path=None):
+    """
+    Decides whether the container at output_path must be (re)written, in the
+        form Ruffus's @check_if_uptodate expects
+    :param output_path: data file of the container
+    :param keys: records the container must hold
+    :param input_path: container the output is made from: the output is out of
+        date if its index is older than the input's
+    :return: (needs update, reason)
+    """
+    try:
+        output_mtime = os.path.getmtime(index_path(output_path))
+    except FileNotFoundError:
+        return True, "Missing record container %s" % output_path
+    if input_path is not None and os.path.getmtime(index_path(input_path)) > output_mtime:
+        return True, "Record container %s is older than %s" % (output_path, input_path)
+    index = read_index(output_path)
+    missing = sum(1 for key in keys if key not in index)
+    if missing:
+        return True, "%d records missing from %s" % (missing, output_path)
+    return False, "Record container %s is up to date" % output_path
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import batch_compute
+
+
+class SquareFilesTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def write_inputs(self, values):
+        paths = []
+        for i, value in enumerate(values):
+            paths.append(os.path.join(self.directory, "file_%d_in" % i))
+            with open(paths[-1], "w") as f:
+                f.write("%s\n" % value)
+        return paths
+
+    def read(self, paths):
+        contents = []
+        for path in paths:
+            with open(path) as f:
+                contents.append(f.read())
+        return contents
+
+    def test_same_outputs_as_square_file(self) -> None:
+        inputs = self.write_inputs([1, -7, 42, 3037000499])
+        batch_outputs = [path + ".batch" for path in inputs]
+        per_file_outputs = [path + ".per_file" for path in inputs]
+
+        batch_compute.square_files(inputs, batch_outputs)
+        for inputf, outputf in zip(inputs, per_file_outputs):
+            batch_compute.square_file(inputf, outputf)
+
+        self.assertEqual(self.read(batch_outputs), ["1", "49", "1764", "9223372030926249001"])
+        self.assertEqual(self.read(batch_outputs), self.read(per_file_outputs))
+
+    def test_values_beyond_int64(self) -> None:
+        inputs = self.write_inputs([3037000500, 2])
+        outputs = [path + ".out" for path in inputs]
+
+        batch_compute.square_files(inputs, outputs)
+
+        self.assertEqual(self.read(outputs), [str(3037000500 ** 2), "4"])
+
+    def test_values_beyond_64_bits(self) -> None:
+        values = [2 ** 63 + 1, -2 ** 63, 2]
+
+        self.assertEqual(batch_compute.square_values([str(value).encode() for value in values]),
+                         [str(value ** 2).encode() for value in values])
+
+    def test_inputs_and_outputs_must_pair_up(self) -> None:
+        with self.assertRaises(ValueError):
+            batch_compute.square_files(self.write_inputs([1, 2]), [os.path.join(self.directory, "out")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,526 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+
+import local_drmaa
+from local_drmaa import JobState, JobControlAction
+import mnm_drmaa_wrapper
+
+# poll the local scheduler quickly
+fast_polling = mnm_drmaa_wrapper.ExponentialBackoffPollingPolicy(initial_interval=0.01, max_interval=0.05)
+
+
+class LocalSessionTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.session = local_drmaa.Session(slots=2)
+        self.session.initialize()
+
+    def tearDown(self) -> None:
+        self.session.exit()
+        shutil.rmtree(self.directory)
+
+    def job_template(self, cmd_str, name="job"):
+        script_path = os.path.join(self.directory, name)
+        with open(script_path, "w") as f:
+            f.write("#!/bin/sh\n" + cmd_str + "\n")
+        os.chmod(script_path, 0o700)
+        job_template = self.session.createJobTemplate()
+        job_template.remoteCommand = script_path
+        job_template.outputPath = ":" + script_path + ".stdout"
+        job_template.errorPath = ":" + script_path + ".stderr"
+        return job_template
+
+    def test_job_runs_and_reports_job_info(self) -> None:
+        jobid = self.session.runJob(self.job_template("echo hello; exit 3"))
+
+        job_info = self.session.wait(jobid, local_drmaa.Session.TIMEOUT_WAIT_FOREVER)
+
+        self.assertEqual(job_info.jobId, jobid)
+        self.assertTrue(job_info.hasExited)
+        self.assertEqual(job_info.exitStatus, 3)
+        self.assertIn("ru_wallclock", job_info.resourceUsage)
+        self.assertIn("maxvmem", job_info.resourceUsage)
+        self.assertEqual(self.session.jobStatus(jobid), JobState.FAILED)
+        with open(os.path.join(self.directory, "job.stdout")) as f:
+            self.assertEqual(f.read(), "hello\n")
+
+    def test_slots_limit_running_jobs(self) -> None:
+        job_template = self.job_template("sleep 0.5")
+        jobids = [self.session.runJob(job_template) for _ in range(4)]
+        time.sleep(0.2)
+
+        states = [self.session.jobStatus(jobid) for jobid in jobids]
+        self.assertEqual(states.count(JobState.RUNNING), 2)
+        self.assertEqual(states.count(JobState.QUEUED_ACTIVE), 2)
+        self.session.synchronize(jobids)
+        self.assertEqual([self.session.jobStatus(jobid) for jobid in jobids], [JobState.DONE] * 4)
+
+    def test_queue_delay(self) -> None:
+        self.session.queue_delay = 0.3
+        jobid = self.session.runJob(self.job_template("true"))
+
+        self.assertEqual(self.session.jobStatus(jobid), JobState.QUEUED_ACTIVE)
+        with self.assertRaises(local_drmaa.ExitTimeoutException):
+            self.session.wait(jobid, 0.1)
+        self.assertTrue(self.session.wait(jobid).hasExited)
+
+    def test_terminate_running_job(self) -> None:
+        jobid = self.session.runJob(self.job_template("sleep 100"))
+        time.sleep(0.2)
+
+        self.session.control(jobid, JobControlAction.TERMINATE)
+
+        job_info = self.session.wait(jobid, 10)
+        self.assertTrue(job_info.hasSignal)
+        self.assertEqual(job_info.terminatedSignal, "SIGTERM")
+
+    def test_hold_and_release(self) -> None:
+        self.session.queue_delay = 0.2
+        jobid = self.session.runJob(self.job_template("true"))
+        self.session.control(jobid, JobControlAction.HOLD)
+        time.sleep(0.3)
+        self.assertEqual(self.session.jobStatus(jobid), JobState.USER_ON_HOLD)
+
+        self.session.control(jobid, JobControlAction.RELEASE)
+        self.assertFalse(self.session.wait(jobid, 10).exitStatus)
+
+    def test_bulk_jobs_get_their_own_output(self) -> None:
+        job_template = self.job_template('echo "$SLURM_ARRAY_TASK_ID"', name="array")
+        job_template.outputPath = ":%s/array.%s.stdout" % (self.directory, local_drmaa.PARAMETRIC_INDEX)
+
+        jobids = self.session.runBulkJobs(job_template, 1, 3, 1)
+        self.session.synchronize(jobids)
+
+        self.assertEqual(len(set(jobids)), 3)
+        for index in range(1, 4):
+            with open(os.path.join(self.directory, "array.%d.stdout" % index)) as f:
+                self.assertEqual(f.read(), "%d\n" % index)
+
+    def test_memory_packing_and_backfill(self) -> None:
+        self.session.exit()
+        self.session = local_drmaa.Session(slots=4, memory=100)
+        self.session.initialize()
+        big = self.job_template("sleep 0.5", name="big")
+        big.nativeSpecification = "--mem=60M"
+        small = self.job_template("sleep 0.5", name="small")
+        small.nativeSpecification = "--mem-per-cpu=20 --cpus-per-task=2"
+
+        jobids = [self.session.runJob(big), self.session.runJob(big), self.session.runJob(small)]
+        time.sleep(0.2)
+
+        # the second 60M job does not fit beside the first; the small one does
+        self.assertEqual([self.session.jobStatus(jobid) for jobid in jobids],
+                         [JobState.RUNNING, JobState.QUEUED_ACTIVE, JobState.RUNNING])
+        self.session.synchronize(jobids)
+        self.assertEqual(self.session._free_memory, 100)
+
+    def test_communication_failures_are_injected(self) -> None:
+        self.session.comm_failure_rate = 1
+
+        with self.assertRaises(local_drmaa.DrmCommunicationException):
+            self.session.runJob(self.job_template("true"))
+        self.assertEqual(self.session.call_counts["runJob"], 1)
+
+
+class RunJobWithLocalSessionTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.session = local_drmaa.Session(slots=4)
+        self.session.initialize()
+
+    def tearDown(self) -> None:
+        self.session.exit()
+        shutil.rmtree(self.directory)
+
+    def test_run_job(self) -> None:
+        stdout, stderr = mnm_drmaa_wrapper.run_job("echo hello; echo world >&2",
+                                                   job_script_directory=self.directory,
+                                                   drmaa_session=self.session,
+                                                   polling_policy=fast_polling)
+
+        self.assertEqual((stdout, stderr), (["hello\n"], ["world\n"]))
+
+    def test_run_job_resubmits_failed_job(self) -> None:
+        with self.assertRaisesRegex(mnm_drmaa_wrapper.error_drmaa_job, "exited with status 4"):
+            mnm_drmaa_wrapper.run_job("exit 4", job_script_directory=self.directory,
+                                      drmaa_session=self.session, polling_policy=fast_polling)
+
+        # fails the first time only
+        marker = os.path.join(self.directory, "marker")
+        stdout, _ = mnm_drmaa_wrapper.run_job("if test -e %s; then echo second; else touch %s; exit 4; fi"
+                                              % (marker, marker),
+                                              job_script_directory=self.directory,
+                                              drmaa_session=self.session,
+                                              polling_policy=fast_polling,
+                                              resubmit=3)
+
+        self.assertEqual(stdout, ["second\n"])
+        self.assertEqual(self.session.call_counts["runJob"], 3)
+
+    def test_run_job_through_job_launcher(self) -> None:
+        for i in range(3):
+            stdout, _ = mnm_drmaa_wrapper.run_job("echo 'job %d'" % i,
+                                                  job_script_directory=self.directory,
+                                                  drmaa_session=self.session,
+                                                  polling_policy=fast_polling,
+                                                  retain_job_scripts=True,
+                                                  job_launcher=True)
+            self.assertEqual(stdout, ["job %d\n" % i])
+
+        files = [os.path.join(path, name) for path, _, names in os.walk(self.directory) for name in names]
+        self.assertEqual(sorted(os.path.basename(path) for path in files),
+                         [mnm_drmaa_wrapper.JOB_LAUNCHER_FILE_NAME, mnm_drmaa_wrapper.JOB_MANIFEST_FILE_NAME])
+        with open(os.path.join(self.directory, mnm_drmaa_wrapper.JOB_MANIFEST_FILE_NAME)) as f:
+            manifest = [json.loads(line) for line in f]
+        self.assertEqual([entry["cmd"] for entry in manifest],
+                         ["echo 'job %d'" % i for i in range(3)])
+        self.assertTrue(all(os.path.dirname(os.path.dirname(entry["stdout_path"])) == self.directory
+                            for entry in manifest))
+
+    def test_run_job_retries_job_status(self) -> None:
+        mnm_drmaa_wrapper.JOBSTATUS_FAILED_TIMEOUT = 0
+        self.session.comm_failure_rate = 0.3
+        self.session.comm_failure_calls = {"jobStatus"}
+
+        stdout, _ = mnm_drmaa_wrapper.run_job("echo hello",
+                                              job_script_directory=self.directory,
+                                              drmaa_session=self.session,
+                                              polling_policy=fast_polling)
+
+        self.assertEqual(stdout, ["hello\n"])
+
+    def test_run_job_streams_output(self) -> None:
+        stdout, stderr = mnm_drmaa_wrapper.run_job("seq 100000; echo oops >&2",
+                                                   job_script_directory=self.directory,
+                                                   drmaa_session=self.session,
+                                                   polling_policy=fast_polling,
+                                                   stream_output=True)
+
+        self.assertIsInstance(stdout, mnm_drmaa_wrapper.JobOutput)
+        self.assertEqual(list(stderr), ["oops\n"])
+        excerpt = stdout.excerpt(100)
+        self.assertTrue(excerpt.startswith("1\n2\n"))
+        self.assertTrue(excerpt.endswith("99999\n100000\n"))
+        self.assertIn("characters omitted", excerpt)
+
+        destination = os.path.join(self.directory, "numbers.txt")
+        self.assertEqual(stdout.move_to(destination), destination)
+        stderr.delete()
+        self.assertEqual(sorted(os.listdir(self.directory)), ["numbers.txt"])
+        with open(destination) as f:
+            self.assertEqual(sum(1 for _ in f), 100000)
+
+    def test_run_job_reattaches_to_journalled_job(self) -> None:
+        # a job submitted by an earlier driver which died while it was running
+        cmd_str = "sleep 0.5; echo earlier run"
+        job_template, job_script_path, stdout_path, stderr_path = mnm_drmaa_wrapper.prepare_drmaa_job(
+            cmd_str, self.session, None, None, self.directory, None, None)
+        jobid = self.session.runJob(job_template)
+        journal = mnm_drmaa_wrapper.JobJournal(os.path.join(self.directory,
+                                                            mnm_drmaa_wrapper.JOB_JOURNAL_FILE_NAME))
+        key = journal.job_key(cmd_str, None, None, None, None)
+        journal.record(key, jobid, "submitted", job_script_path, stdout_path, stderr_path)
+        mnm_drmaa_wrapper._job_journals.clear()
+
+        stdout, _ = mnm_drmaa_wrapper.run_job(cmd_str,
+                                              job_script_directory=self.directory,
+                                              drmaa_session=self.session,
+                                              polling_policy=fast_polling,
+                                              journal=True)
+
+        self.assertEqual(stdout, ["earlier run\n"])
+        self.assertEqual(self.session.call_counts["runJob"], 1)
+        self.assertEqual(os.listdir(self.directory), [mnm_drmaa_wrapper.JOB_JOURNAL_FILE_NAME])
+        mnm_drmaa_wrapper._job_journals.clear()
+        self.assertEqual(mnm_drmaa_wrapper.get_job_journal(self.directory).open_jobs(), [])
+
+    def test_run_job_closes_journalled_jobs(self) -> None:
+        for _ in range(2):
+            stdout, _ = mnm_drmaa_wrapper.run_job("echo hello",
+                                                  job_script_directory=self.directory,
+                                                  drmaa_session=self.session,
+                                                  polling_policy=fast_polling,
+                                                  journal=True)
+            self.assertEqual(stdout, ["hello\n"])
+
+        self.assertEqual(self.session.call_counts["runJob"], 2)
+        mnm_drmaa_wrapper._job_journals.clear()
+        self.assertEqual(mnm_drmaa_wrapper.get_job_journal(self.directory).open_jobs(), [])
+
+    def test_run_job_uses_result_cache(self) -> None:
+        cache = mnm_drmaa_wrapper.ResultCache(os.path.join(self.directory, "cache"))
+        input_path = os.path.join(self.directory, "in")
+        output_path = os.path.join(self.directory, "out")
+        cmd_str = "awk '{print $1*$1}' %s > %s; echo squared" % (input_path, output_path)
+
+        def run(value):
+            with open(input_path, "w") as f:
+                f.write(value)
+            if os.path.exists(output_path):
+                os.unlink(output_path)
+            stdout, _ = mnm_drmaa_wrapper.run_job(cmd_str,
+                                                  job_script_directory=self.directory,
+                                                  drmaa_session=self.session,
+                                                  polling_policy=fast_polling,
+                                                  result_cache=cache,
+                                                  input_files=[input_path],
+                                                  output_files=[output_path])
+            self.assertEqual(stdout, ["squared\n"])
+            with open(output_path) as f:
+                return f.read()
+
+        self.assertEqual(run("3\n"), "9\n")
+        # recreated with the same content: not run again
+        self.assertEqual(run("3\n"), "9\n")
+        self.assertEqual(self.session.call_counts["runJob"], 1)
+        self.assertEqual(run("4\n"), "16\n")
+        self.assertEqual(self.session.call_counts["runJob"], 2)
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2, "stores": 2, "evictions": 0})
+
+        cache.max_size = 3
+        cache.evict()
+        self.assertEqual(cache.size(), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_result_cache_keeps_results_of_outputs_rewritten_in_place(self) -> None:
+        cache = mnm_drmaa_wrapper.ResultCache(os.path.join(self.directory, "cache"))
+        input_path = os.path.join(self.directory, "in")
+        output_path = os.path.join(self.directory, "out")
+        # rewrites the output in place, as main.py's awk jobs do
+        cmd_str = "awk '{print $1*$1}' %s > %s" % (input_path, output_path)
+
+        def run(value):
+            with open(input_path, "w") as f:
+                f.write(value)
+            mnm_drmaa_wrapper.run_job(cmd_str,
+                                      job_script_directory=self.directory,
+                                      drmaa_session=self.session,
+                                      polling_policy=fast_polling,
+                                      result_cache=cache,
+                                      input_files=[input_path],
+                                      output_files=[output_path])
+            with open(output_path) as f:
+                return f.read()
+
+        self.assertEqual(run("3\n"), "9\n")
+        first_key = cache.key(cmd_str, None, [input_path])
+        self.assertEqual(run("4\n"), "16\n")
+        self.assertEqual(cache.stats()["misses"], 2)
+
+        with open(os.path.join(cache._entry_directory(first_key), "output.0")) as f:
+            self.assertEqual(f.read(), "9\n")
+        self.assertEqual(run("3\n"), "9\n")
+        self.assertEqual(self.session.call_counts["runJob"], 2)
+
+    def test_result_cache_keeps_a_running_size(self) -> None:
+        directory = os.path.join(self.directory, "cache")
+        cache = mnm_drmaa_wrapper.ResultCache(directory, max_size=10)
+        output_path = os.path.join(self.directory, "out")
+        entries = cache._entries
+        scans = []
+        cache._entries = lambda: scans.append(1) or entries()
+
+        for value in range(4):
+            with open(output_path, "w") as f:
+                f.write("%d\n" % value)
+            cache.store(cache.key("echo %d" % value, None, []), [output_path], [], [])
+
+        # the store is only rescanned once it grows beyond max_size
+        self.assertEqual(len(scans), 0)
+        self.assertEqual(cache.size(), 8)
+        self.assertEqual(mnm_drmaa_wrapper.ResultCache(directory).size(), 8)
+        for value in range(4, 6):
+            cache.store(cache.key("echo %d" % value, None, []), [output_path], [], [])
+        self.assertEqual(len(scans), 1)
+        self.assertEqual(cache.size(), 10)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_run_job_async_uses_journal_and_result_cache(self) -> None:
+        import asyncio
+        cache = mnm_drmaa_wrapper.ResultCache(os.path.join(self.directory, "cache"))
+        input_path = os.path.join(self.directory, "in")
+        output_path = os.path.join(self.directory, "out")
+        with open(input_path, "w") as f:
+            f.write("3\n")
+        cmd_str = "awk '{print $1*$1}' %s > %s; echo squared" % (input_path, output_path)
+
+        for _ in range(2):
+            stdout, _ = asyncio.run(mnm_drmaa_wrapper.run_job_async(cmd_str,
+                                                                    job_script_directory=self.directory,
+                                                                    drmaa_session=self.session,
+                                                                    polling_policy=fast_polling,
+                                                                    journal=True,
+                                                                    result_cache=cache,
+                                                                    input_files=[input_path],
+                                                                    output_files=[output_path]))
+            self.assertEqual(stdout, ["squared\n"])
+
+        self.assertEqual(self.session.call_counts["runJob"], 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        mnm_drmaa_wrapper._job_journals.clear()
+        self.assertEqual(mnm_drmaa_wrapper.get_job_journal(self.directory).open_jobs(), [])
+
+    def test_run_job_async_awaits_reattached_job_without_holding_a_thread(self) -> None:
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        cmd_str = "sleep 1; echo earlier run"
+        job_template, job_script_path, stdout_path, stderr_path = mnm_drmaa_wrapper.prepare_drmaa_job(
+            cmd_str, self.session, None, None, self.directory, None, None)
+        jobid = self.session.runJob(job_template)
+        journal = mnm_drmaa_wrapper.JobJournal(os.path.join(self.directory,
+                                                            mnm_drmaa_wrapper.JOB_JOURNAL_FILE_NAME))
+        journal.record(journal.job_key(cmd_str, None, None, None, None), jobid, "submitted",
+                       job_script_path, stdout_path, stderr_path)
+        mnm_drmaa_wrapper._job_journals.clear()
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        finished = []
+
+        async def run(cmd_str):
+            stdout, _ = await mnm_drmaa_wrapper.run_job_async(cmd_str,
+                                                              job_script_directory=self.directory,
+                                                              drmaa_session=self.session,
+                                                              polling_policy=fast_polling,
+                                                              journal=True,
+                                                              executor=executor)
+            finished.append(stdout)
+
+        async def run_both():
+            await asyncio.gather(run(cmd_str), run("echo this run"))
+        asyncio.run(run_both())
+
+        # the new job was not held up behind the reattached one
+        self.assertEqual(finished, [["this run\n"], ["earlier run\n"]])
+        self.assertEqual(self.session.call_counts["runJob"], 2)
+
+    def test_run_job_waits_for_submission_limiter(self) -> None:
+        limiter = mnm_drmaa_wrapper.SubmissionLimiter(max_in_flight=1)
+        outputs = []
+
+        def run_one(i):
+            stdout, _ = mnm_drmaa_wrapper.run_job("echo %d" % i,
+                                                  job_script_directory=self.directory,
+                                                  drmaa_session=self.session,
+                                                  polling_policy=fast_polling,
+                                                  submission_limiter=limiter)
+            outputs.append(stdout)
+        threads = [threading.Thread(target=run_one, args=(i,)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(outputs), [["0\n"], ["1\n"], ["2\n"]])
+        stats = limiter.stats()[None]
+        self.assertEqual((stats["submitted"], stats["in_flight"]), (3, 0))
+        self.assertGreaterEqual(stats["waits"], 2)
+
+    def test_run_job_locally_uses_local_executor(self) -> None:
+        stdout, _ = mnm_drmaa_wrapper.run_job('echo "$SLURM_JOB_ID"',
+                                              job_other_options="--cpus-per-task=2 --mem=10M",
+                                              job_script_directory=self.directory,
+                                              run_locally=True,
+                                              local_executor=self.session,
+                                              polling_policy=fast_polling)
+
+        self.assertEqual(stdout, ["1\n"])
+        self.assertEqual(self.session._jobs["1"].cpus, 2)
+        self.assertEqual(self.session.call_counts["runJob"], 1)
+
+    def test_failing_local_job_is_reported_with_its_output(self) -> None:
+        with self.assertRaisesRegex(mnm_drmaa_wrapper.error_drmaa_job,
+                                    "(?s)exited with status 3.*stderr was: \nerr\n.*stdout was: \nout\n"):
+            mnm_drmaa_wrapper.run_job("echo out; echo err >&2; exit 3",
+                                      job_script_directory=self.directory,
+                                      run_locally=True,
+                                      local_executor=self.session,
+                                      polling_policy=fast_polling)
+
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_dispatcher_runs_short_jobs_locally(self) -> None:
+        self.session.queue_delay = 0.3
+        local_executor = local_drmaa.Session(slots=2)
+        local_executor.initialize()
+        self.addCleanup(local_executor.exit)
+        dispatcher = mnm_drmaa_wrapper.JobDispatcher(local_executor, queue_latency=1, min_samples=2)
+        self.addCleanup(dispatcher.close)
+
+        for i in range(3):
+            stdout, _ = dispatcher.run_job("sleep 0.2; echo %d" % i,
+                                           job_script_directory=self.directory,
+                                           drmaa_session=self.session,
+                                           polling_policy=fast_polling)
+            self.assertEqual(stdout, ["%d\n" % i])
+
+        self.assertEqual(self.session.call_counts["runJob"], 2)
+        self.assertEqual(local_executor.call_counts["runJob"], 1)
+        stats = dispatcher.stats()
+        self.assertEqual((stats["drmaa"], stats["local"]), (2, 1))
+        self.assertLess(stats["queue_latency"], 1)
+        # too big for the local executor
+        self.assertEqual(dispatcher.route("echo 3", job_other_options="--cpus-per-task=8"), "drmaa")
+
+    def test_run_job_updates_metrics(self) -> None:
+        metrics = mnm_drmaa_wrapper.get_metrics()
+        before = dict((name, metrics.value(name)) for name in ("drmaa_jobs_submitted_total",
+                                                               "drmaa_output_wait_seconds",
+                                                               "drmaa_jobs_in_flight"))
+        failed = metrics.value("drmaa_jobs_finished_total", outcome="failed")
+
+        mnm_drmaa_wrapper.run_job("sleep 0.2", job_script_directory=self.directory,
+                                  drmaa_session=self.session, polling_policy=fast_polling)
+        with self.assertRaises(mnm_drmaa_wrapper.error_drmaa_job):
+            mnm_drmaa_wrapper.run_job("exit 1", job_script_directory=self.directory,
+                                      drmaa_session=self.session, polling_policy=fast_polling)
+
+        self.assertEqual(metrics.value("drmaa_jobs_submitted_total"), before["drmaa_jobs_submitted_total"] + 2)
+        self.assertEqual(metrics.value("drmaa_output_wait_seconds"), before["drmaa_output_wait_seconds"] + 2)
+        self.assertEqual(metrics.value("drmaa_jobs_finished_total", outcome="failed"), failed + 1)
+        self.assertEqual(metrics.value("drmaa_jobs_in_flight"), before["drmaa_jobs_in_flight"])
+
+        server = mnm_drmaa_wrapper.serve_metrics(0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        with urllib.request.urlopen("http://127.0.0.1:%d/metrics" % server.server_address[1]) as response:
+            text = response.read().decode()
+        self.assertIn("# TYPE drmaa_call_seconds histogram", text)
+        self.assertIn('drmaa_call_seconds_bucket{call="jobStatus",le="+Inf"}', text)
+        self.assertIn('drmaa_jobs_finished_total{outcome="done"}', text)
+
+    def test_run_job_records_timing(self) -> None:
+        recorder = mnm_drmaa_wrapper.JobTraceRecorder()
+        mnm_drmaa_wrapper.add_job_timing_hook(recorder)
+        self.addCleanup(mnm_drmaa_wrapper.remove_job_timing_hook, recorder)
+
+        mnm_drmaa_wrapper.run_job("sleep 0.3",
+                                  job_script_directory=self.directory,
+                                  drmaa_session=self.session,
+                                  polling_policy=fast_polling)
+
+        self.assertEqual(len(recorder.timings), 1)
+        timing = recorder.timings[0]
+        self.assertEqual(set(timing.timestamps), set(mnm_drmaa_wrapper.JobTiming.PHASES))
+        times = [timing.timestamps[phase] for phase in mnm_drmaa_wrapper.JobTiming.PHASES]
+        self.assertEqual(times, sorted(times))
+        self.assertEqual([name for name, _, _ in timing.spans()],
+                         ["write script", "submit", "queued", "running", "read output", "clean up"])
+
+        trace_path = os.path.join(self.directory, "trace.json")
+        recorder.write_chrome_trace(trace_path)
+        with open(trace_path) as f:
+            events = json.load(f)["traceEvents"]
+        self.assertEqual(len([event for event in events if event["ph"] == "X"]), 6)
+        self.assertEqual(len(recorder.otel_spans()), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
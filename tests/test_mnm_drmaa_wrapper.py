@@ -1,9 +1,20 @@
 from unittest.mock import Mock
+import asyncio
+import functools
+import importlib.util
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
 import drmaa
 import mnm_drmaa_wrapper
-from mnm_drmaa_wrapper import submit_drmaa_job, run_job_using_drmaa
+from mnm_drmaa_wrapper import submit_drmaa_job, run_job_using_drmaa, get_job_status_poller
 
 # reduce waiting times for tests
 mnm_drmaa_wrapper.GEVENT_TIMEOUT_WAIT = 0
@@ -11,6 +22,25 @@ mnm_drmaa_wrapper.GEVENT_TIMEOUT_STARTUP = 0
 mnm_drmaa_wrapper.JOBSTATUS_FAILED_TIMEOUT = 0
 
 
+def run_job_script(job_template):
+    """
+    Runs the job script straight away, the way the DRM would
+    """
+    with open(job_template.outputPath[1:], "w") as out, open(job_template.errorPath[1:], "w") as err:
+        subprocess.call([job_template.remoteCommand], stdout=out, stderr=err)
+    return next(jobids)
+
+
+jobids = itertools.count(333333)
+
+
+def exited_job_info(jobid, timeout=None, exit_status=0):
+    """
+    The job info drmaa's wait() returns for a job which exited with exit_status
+    """
+    return drmaa.JobInfo(jobid, True, False, "", False, False, exit_status, {})
+
+
 class SubmitDrmaaJobTests(unittest.TestCase):
 
     job_script_directory = "/tmp"
@@ -25,6 +55,7 @@ class SubmitDrmaaJobTests(unittest.TestCase):
         self.mock_pipeline.is_job_suspended.return_value = False
 
         self.mock_session = Mock()
+        self.mock_session.wait.side_effect = exited_job_info
         self.mock_session.runJob.return_value=111111
 
 
@@ -69,6 +100,299 @@ class SubmitDrmaaJobTests(unittest.TestCase):
         self.assertEqual(self.mock_session.jobStatus.call_count, 5)
 
 
+class JobStatusPollerTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.mock_logger = Mock()
+        self.mock_pipeline = Mock()
+        self.mock_pipeline.is_job_suspended.return_value = False
+        self.mock_session = Mock()
+        self.mock_session.wait.side_effect = exited_job_info
+
+    def test_poller_is_shared_per_session(self) -> None:
+        self.assertIs(get_job_status_poller(self.mock_session), get_job_status_poller(self.mock_session))
+        self.assertIsNot(get_job_status_poller(self.mock_session), get_job_status_poller(Mock()))
+
+    def test_concurrent_jobs_share_one_poller(self) -> None:
+
+        self.mock_session.runJob.side_effect = [1, 2, 3]
+        # each job is seen running once, then done
+        seen = set()
+        lock = threading.Lock()
+
+        def job_status(jobid):
+            with lock:
+                if jobid in seen:
+                    return drmaa.JobState.DONE
+                seen.add(jobid)
+                return drmaa.JobState.RUNNING
+        self.mock_session.jobStatus.side_effect = job_status
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                        submit_drmaa_job("echo Hello", self.mock_session, None, self.mock_logger, self.mock_pipeline)))
+                   for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+
+        self.assertEqual(sorted(jobid for jobid, _ in results), [1, 2, 3])
+        self.assertEqual(self.mock_session.jobStatus.call_count, 6)
+        self.assertEqual(get_job_status_poller(self.mock_session).outstanding(), 0)
+
+    def test_failed_job_raises(self) -> None:
+        self.mock_session.runJob.return_value = 111111
+        self.mock_session.jobStatus.side_effect = [drmaa.JobState.RUNNING, drmaa.JobState.FAILED]
+        # no job info to tell why
+        self.mock_session.wait.side_effect = drmaa.errors.InvalidJobException("code 18: job not found")
+
+        with self.assertRaises(mnm_drmaa_wrapper.JobFailed):
+            submit_drmaa_job("echo Hello", self.mock_session, None, self.mock_logger, self.mock_pipeline)
+
+    def test_failed_job_with_clean_job_info_raises(self) -> None:
+        self.mock_session.runJob.return_value = 111113
+        self.mock_session.jobStatus.side_effect = [drmaa.JobState.RUNNING, drmaa.JobState.FAILED]
+        # exited normally, no signal, not aborted
+        self.mock_session.wait.side_effect = exited_job_info
+
+        with self.assertRaises(mnm_drmaa_wrapper.JobFailed):
+            submit_drmaa_job("echo Hello", self.mock_session, None, self.mock_logger, self.mock_pipeline)
+        self.assertEqual(get_job_status_poller(self.mock_session).outstanding(), 0)
+
+    def test_finished_job_is_reaped(self) -> None:
+        self.mock_session.runJob.return_value = 111112
+        self.mock_session.jobStatus.side_effect = [drmaa.JobState.RUNNING, drmaa.JobState.FAILED]
+        self.mock_session.wait.side_effect = functools.partial(exited_job_info, exit_status=2)
+
+        self.assertEqual(submit_drmaa_job("echo Hello", self.mock_session, None, self.mock_logger, self.mock_pipeline),
+                         (111112, exited_job_info(111112, exit_status=2)))
+        self.mock_session.wait.assert_called_once_with(111112, drmaa.Session.TIMEOUT_NO_WAIT)
+
+    def test_failed_job_is_reported_with_its_output(self) -> None:
+        self.mock_session.runJob.side_effect = run_job_script
+        self.mock_session.createJobTemplate.side_effect = Mock
+        self.mock_session.jobStatus.return_value = drmaa.JobState.FAILED
+        self.mock_session.wait.side_effect = functools.partial(exited_job_info, exit_status=3)
+        job_script_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, job_script_directory)
+
+        with self.assertRaisesRegex(mnm_drmaa_wrapper.error_drmaa_job, "(?s)exited with status 3.*no such input"):
+            run_job_using_drmaa("echo no such input >&2; exit 3",
+                                job_script_directory=job_script_directory,
+                                drmaa_session=self.mock_session, logger=self.mock_logger,
+                                pipeline=self.mock_pipeline)
+        self.assertEqual(os.listdir(job_script_directory), [])
+
+
+class PollingPolicyTests(unittest.TestCase):
+
+    @staticmethod
+    def first_delays(policy, count, job_other_options=None):
+        delays = policy.delays(job_other_options)
+        return [next(delays) for _ in range(count)]
+
+    def test_parse_walltime(self) -> None:
+        parse_walltime = mnm_drmaa_wrapper.parse_walltime
+        self.assertEqual(parse_walltime(" --ntasks=1 --time=00:01:00"), 60)
+        self.assertEqual(parse_walltime("--time 90"), 90 * 60)
+        self.assertEqual(parse_walltime("-t 10:30"), 10 * 60 + 30)
+        self.assertEqual(parse_walltime("--time=2-01:00:05 --mem=10"), (49 * 60) * 60 + 5)
+        self.assertEqual(parse_walltime("--time=1-12"), 36 * 3600)
+        self.assertIsNone(parse_walltime("--ntasks=1"))
+        self.assertIsNone(parse_walltime(None))
+
+    def test_exponential_backoff_is_capped(self) -> None:
+        policy = mnm_drmaa_wrapper.ExponentialBackoffPollingPolicy(initial_interval=1, factor=2, max_interval=5)
+        self.assertEqual(self.first_delays(policy, 5), [1, 2, 4, 5, 5])
+
+    def test_walltime_policy_caps_at_fraction_of_walltime(self) -> None:
+        policy = mnm_drmaa_wrapper.WalltimePollingPolicy(fraction=0.01, initial_interval=1,
+                                                         min_interval=2, max_interval=600)
+        self.assertEqual(self.first_delays(policy, 10, "--time=10:00:00")[-1], 360)
+        self.assertEqual(self.first_delays(policy, 5, "--time=00:01:00")[-1], 2)
+        self.assertEqual(self.first_delays(policy, 12)[-1], 600)
+
+    def test_jitter_stays_within_bounds(self) -> None:
+        policy = mnm_drmaa_wrapper.JitteredPollingPolicy(
+            mnm_drmaa_wrapper.ExponentialBackoffPollingPolicy(initial_interval=10, factor=1), jitter=0.1)
+        for delay in self.first_delays(policy, 100):
+            self.assertTrue(9 <= delay <= 11)
+
+    def test_policy_is_used_for_polling(self) -> None:
+        mock_session = Mock()
+        mock_session.runJob.return_value = 111111
+        mock_session.jobStatus.side_effect = [drmaa.JobState.RUNNING, drmaa.JobState.DONE]
+        mock_pipeline = Mock()
+        mock_pipeline.is_job_suspended.return_value = False
+        policy = Mock()
+        policy.delays.return_value = iter([0, 0])
+
+        submit_drmaa_job("echo Hello", mock_session, None, Mock(), mock_pipeline,
+                         polling_policy=policy, job_other_options="--time=1")
+
+        policy.delays.assert_called_once_with("--time=1")
+        self.assertEqual(mock_session.jobStatus.call_count, 2)
+
+
+class RetryPolicyTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.budget = mnm_drmaa_wrapper.RetryBudget(tokens=3, ratio=0.5, threshold=2, cooldown=0.2)
+        self.policy = mnm_drmaa_wrapper.RetryPolicy(max_attempts=5, initial_delay=0, budget=self.budget)
+        self.comm_error = drmaa.errors.DrmCommunicationException("code 2: Socket timed out")
+
+    def test_errors_are_classified(self) -> None:
+        RetryPolicy = mnm_drmaa_wrapper.RetryPolicy
+        self.assertEqual(self.policy.classify(self.comm_error), RetryPolicy.TRANSIENT)
+        self.assertEqual(self.policy.classify(Exception("code 24: drmaa: Job finished")), RetryPolicy.FINISHED)
+        self.assertEqual(self.policy.classify(drmaa.errors.DeniedByDrmException("bad partition")),
+                         RetryPolicy.PERMANENT)
+
+    def test_backoff_is_jittered_and_capped(self) -> None:
+        policy = mnm_drmaa_wrapper.RetryPolicy(initial_delay=1, max_delay=10, jitter=0.5, budget=self.budget)
+        for attempt, delay in ((1, 1), (3, 4), (10, 10)):
+            self.assertTrue(delay / 2 <= policy.delay(attempt) <= delay)
+
+    def test_retries_are_limited_by_budget(self) -> None:
+        control = Mock(side_effect=[self.comm_error, "ok"] * 2 + [self.comm_error] * 5)
+
+        self.assertEqual(self.policy.call(control), "ok")
+        self.assertEqual(self.policy.call(control), "ok")
+        # 3 tokens - 2 retries + 2 * 0.5 for the successes leave 2
+        with self.assertRaises(drmaa.errors.DrmCommunicationException):
+            self.policy.call(control)
+        self.assertEqual(control.call_count, 7)
+
+    def test_permanent_errors_are_not_retried(self) -> None:
+        control = Mock(side_effect=drmaa.errors.DeniedByDrmException("bad partition"))
+
+        with self.assertRaises(drmaa.errors.DeniedByDrmException):
+            self.policy.call(control)
+        control.assert_called_once_with()
+
+    def test_circuit_breaker_makes_callers_wait(self) -> None:
+        self.budget.record_failure()
+        self.budget.record_failure()
+
+        self.assertTrue(self.budget.is_open())
+        self.assertGreater(self.budget.try_acquire(), 0)
+        start = time.time()
+        self.assertEqual(self.policy.call(Mock(return_value="ok")), "ok")
+        self.assertGreater(time.time() - start, 0.15)
+        self.assertFalse(self.budget.is_open())
+
+    def test_resubmission_stops_at_permanent_error(self) -> None:
+        mock_session = Mock()
+        mock_session.runJob.side_effect = drmaa.errors.DeniedByDrmException("bad partition")
+        job_script_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, job_script_directory)
+
+        with self.assertRaises(drmaa.errors.DeniedByDrmException):
+            run_job_using_drmaa("echo Hello", job_script_directory=job_script_directory,
+                                drmaa_session=mock_session, logger=Mock(),
+                                resubmit=5, retry_policy=self.policy)
+        mock_session.runJob.assert_called_once()
+
+
+class SubmissionLimiterTests(unittest.TestCase):
+
+    def test_parse_partition_qos(self) -> None:
+        parse_partition_qos = mnm_drmaa_wrapper.parse_partition_qos
+        self.assertEqual(parse_partition_qos(None), (None, None))
+        self.assertEqual(parse_partition_qos("--qos=high --partition=short --ntasks=1"), ("short", "high"))
+        self.assertEqual(parse_partition_qos("-p long --time=10"), ("long", None))
+
+    def test_in_flight_jobs_are_capped(self) -> None:
+        limiter = mnm_drmaa_wrapper.SubmissionLimiter(max_in_flight=2)
+        lock = threading.Lock()
+        in_flight = []
+
+        def run_one():
+            key = limiter.acquire("--time=1")
+            with lock:
+                in_flight.append(limiter.stats()[None]["in_flight"])
+            time.sleep(0.1)
+            limiter.release(key)
+        threads = [threading.Thread(target=run_one) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(max(in_flight), 2)
+        stats = limiter.stats()[None]
+        self.assertEqual((stats["submitted"], stats["in_flight"], stats["waiting"]), (6, 0, 0))
+        self.assertGreaterEqual(stats["waits"], 4)
+        self.assertGreater(stats["wait_max"], 0.15)
+
+    def test_submission_rate_is_limited_per_partition(self) -> None:
+        limiter = mnm_drmaa_wrapper.SubmissionLimiter(rate=1000, limits={"short": {"rate": 20, "burst": 1}})
+
+        start = time.time()
+        for _ in range(5):
+            limiter.release(limiter.acquire("--partition=long"))
+        self.assertLess(time.time() - start, 0.1)
+        for _ in range(5):
+            limiter.release(limiter.acquire("--partition=short"))
+        self.assertGreater(time.time() - start, 0.15)
+        self.assertEqual(set(limiter.stats()), {None, "short"})
+
+    def test_unthrottled_submissions_do_not_wait(self) -> None:
+        limiter = mnm_drmaa_wrapper.SubmissionLimiter(max_in_flight=100)
+
+        for _ in range(50):
+            limiter.release(limiter.acquire("--time=1"))
+        asyncio.run(limiter.acquire_async("--time=1"))
+
+        stats = limiter.stats()[None]
+        self.assertEqual((stats["submitted"], stats["waits"], stats["wait_total"]), (51, 0, 0.0))
+
+
+class ResourceHistoryTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.path = os.path.join(tempfile.mkdtemp(), "resources.jsonl")
+        self.history = mnm_drmaa_wrapper.ResourceHistory(self.path, min_samples=3)
+        self.addCleanup(self.history.close)
+
+    def finish_job(self, cmd_str, memory, walltime, exit_status=0) -> None:
+        timing = mnm_drmaa_wrapper.JobTiming(cmd_str, "toy")
+        timing.job_info = Mock(hasExited=True, exitStatus=exit_status,
+                               resourceUsage={"maxvmem": str(memory * 1024 ** 2),
+                                              "ru_wallclock": str(walltime)})
+        timing.record("output_read")
+
+    def test_right_size_from_recorded_usage(self) -> None:
+        options = "--ntasks=1 --cpus-per-task=2 --mem-per-cpu=4096 --time=01:00:00"
+        for i, memory in enumerate((100, 200, 300)):
+            self.assertEqual(self.history.right_size(options, "awk file_%d" % i, "toy"), options)
+            self.finish_job("awk file_%d" % i, memory, 100)
+        # failed jobs are not recorded
+        self.finish_job("awk file_9", 5000, 1000, exit_status=1)
+
+        self.assertEqual(self.history.right_size(options, "awk file_10", "toy"),
+                         "--ntasks=1 --cpus-per-task=2 --mem-per-cpu=180 --time=2")
+        self.assertEqual(self.history.right_size("--mem 1G", "awk file_10", "toy"), "--mem=360 --time=2")
+        self.assertIsNone(self.history.suggest("sed file_1", "toy"))
+
+        # read back by the next run
+        history = mnm_drmaa_wrapper.ResourceHistory(self.path, min_samples=3)
+        self.addCleanup(history.close)
+        self.assertEqual(history.suggest("awk file_11", "toy"), (360, 120))
+
+    def test_right_size_replaces_short_and_space_separated_options(self) -> None:
+        for i, memory in enumerate((100, 200, 300)):
+            self.finish_job("awk file_%d" % i, memory, 100)
+
+        self.assertEqual(self.history.right_size("-p short -t 01:00:00 --mem  4G", "awk file_10", "toy"),
+                         "-p short --mem=360 --time=2")
+        self.assertEqual(self.history.right_size("-c 2 -t60 --mem-per-cpu 4096", "awk file_10", "toy"),
+                         "-c 2 --mem-per-cpu=180 --time=2")
+        self.assertEqual(self.history.right_size("--time 60 --partition=long", "awk file_10", "toy"),
+                         "--partition=long --mem=360 --time=2")
+
+
 class RunJobUsingDrmaaTests(unittest.TestCase):
 
     def setUp(self) -> None:
@@ -79,7 +403,12 @@ class RunJobUsingDrmaaTests(unittest.TestCase):
         self.mock_pipeline = Mock()
         self.mock_pipeline.is_job_suspended.return_value = False
 
+        # scripts of jobs that were never submitted are left behind
+        self.job_script_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.job_script_directory)
+
         self.mock_session = Mock()
+        self.mock_session.wait.side_effect = exited_job_info
         self.mock_session.jobStatus.side_effect = [drmaa.JobState.RUNNING,
                                                    drmaa.JobState.DONE]
 
@@ -96,6 +425,7 @@ class RunJobUsingDrmaaTests(unittest.TestCase):
     def test_run_job_using_drmaa_failing_to_submit_resubmit_0(self) -> None:
         with self.assertRaises(drmaa.errors.DrmCommunicationException):
             run_job_using_drmaa("echo Hello",
+                                job_script_directory=self.job_script_directory,
                                 drmaa_session=self.mock_session,
                                 logger = self.mock_logger,
                                 resubmit = 0,
@@ -107,6 +437,7 @@ class RunJobUsingDrmaaTests(unittest.TestCase):
 
         with self.assertRaises(mnm_drmaa_wrapper.error_drmaa_job):
             run_job_using_drmaa("echo Hello",
+                                job_script_directory=self.job_script_directory,
                                 drmaa_session=self.mock_session,
                                 logger=self.mock_logger,
                                 resubmit=2,
@@ -116,6 +447,7 @@ class RunJobUsingDrmaaTests(unittest.TestCase):
 
     def test_run_job_using_drmaa_failing_to_submit_resubmit_5(self) -> None:
         run_job_using_drmaa("echo Hello",
+                            job_script_directory=self.job_script_directory,
                             drmaa_session=self.mock_session,
                             logger=self.mock_logger,
                             resubmit=5,
@@ -126,6 +458,480 @@ class RunJobUsingDrmaaTests(unittest.TestCase):
 
 
 
+class ArrayJobTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.mock_logger = Mock()
+        self.mock_pipeline = Mock()
+        self.mock_pipeline.is_job_suspended.return_value = False
+        self.job_script_directory = tempfile.mkdtemp()
+
+        self.mock_session = Mock()
+        self.mock_session.wait.side_effect = exited_job_info
+        self.mock_session.jobStatus.return_value = drmaa.JobState.DONE
+        self.mock_session.runBulkJobs.side_effect = self.run_bulk_jobs
+
+    def run_bulk_jobs(self, job_template, begin, end, step):
+        # run every array task the way the DRM would
+        jobids = []
+        for index in range(begin, end + 1, step):
+            task_path = lambda path: path[1:].replace(drmaa.JobTemplate.PARAMETRIC_INDEX, str(index))
+            with open(task_path(job_template.outputPath), "w") as out, \
+                    open(task_path(job_template.errorPath), "w") as err:
+                subprocess.call([job_template.remoteCommand, str(index)], stdout=out, stderr=err)
+            jobids.append("222_%d" % index)
+        return jobids
+
+    def test_jobs_within_window_share_one_array_job(self) -> None:
+        results = {}
+
+        def run(i):
+            results[i] = run_job_using_drmaa("echo Hello %d" % i,
+                                             job_script_directory=self.job_script_directory,
+                                             drmaa_session=self.mock_session,
+                                             logger=self.mock_logger,
+                                             pipeline=self.mock_pipeline,
+                                             array_window=0.5)
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+
+        self.mock_session.runBulkJobs.assert_called_once()
+        self.mock_session.runJob.assert_not_called()
+        for i in range(3):
+            self.assertEqual(results[i], (["Hello %d\n" % i], []))
+        # dispatcher and job scripts are cleaned up
+        self.assertEqual(os.listdir(self.job_script_directory), [])
+
+    def test_resubmission_releases_the_failed_array_job(self) -> None:
+        self.mock_session.wait.side_effect = [exited_job_info(None, exit_status=1), exited_job_info(None)]
+
+        self.assertEqual(run_job_using_drmaa("echo Hello",
+                                             job_script_directory=self.job_script_directory,
+                                             drmaa_session=self.mock_session,
+                                             logger=self.mock_logger,
+                                             pipeline=self.mock_pipeline,
+                                             array_window=0.01,
+                                             resubmit=2),
+                         (["Hello\n"], []))
+
+        self.assertEqual(self.mock_session.runBulkJobs.call_count, 2)
+        # both dispatcher scripts are cleaned up
+        self.assertEqual([name for name in os.listdir(self.job_script_directory)
+                          if not name.endswith((".stdout", ".stderr"))], [])
+
+    def test_job_scripts_are_quoted_in_the_dispatcher(self) -> None:
+        job_script_directory = os.path.join(self.job_script_directory, "with space; $(false)")
+        os.mkdir(job_script_directory)
+
+        self.assertEqual(run_job_using_drmaa("echo Hello",
+                                             job_script_directory=job_script_directory,
+                                             drmaa_session=self.mock_session,
+                                             logger=self.mock_logger,
+                                             pipeline=self.mock_pipeline,
+                                             array_window=0.01),
+                         (["Hello\n"], []))
+
+    def test_array_submission_failure_reaches_every_caller(self) -> None:
+        self.mock_session.runBulkJobs.side_effect = drmaa.errors.DeniedByDrmException("denied")
+
+        with self.assertRaises(drmaa.errors.DeniedByDrmException):
+            run_job_using_drmaa("echo Hello",
+                                job_script_directory=self.job_script_directory,
+                                drmaa_session=self.mock_session,
+                                logger=self.mock_logger,
+                                pipeline=self.mock_pipeline,
+                                array_window=0.01)
+
+
+class CommandBatchTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.mock_logger = Mock()
+        self.mock_pipeline = Mock()
+        self.mock_pipeline.is_job_suspended.return_value = False
+        self.job_script_directory = tempfile.mkdtemp()
+
+        self.mock_session = Mock()
+        self.mock_session.wait.side_effect = exited_job_info
+        self.mock_session.jobStatus.return_value = drmaa.JobState.DONE
+        self.mock_session.runJob.side_effect = run_job_script
+
+    def test_commands_share_one_job_and_get_their_own_output(self) -> None:
+        cmds = ["echo a", "printf b; exit 3", "echo c >&2"]
+        results = {}
+
+        def run(i):
+            try:
+                results[i] = run_job_using_drmaa(cmds[i],
+                                                 job_script_directory=self.job_script_directory,
+                                                 drmaa_session=self.mock_session,
+                                                 logger=self.mock_logger,
+                                                 pipeline=self.mock_pipeline,
+                                                 batch_size=3, batch_window=5)
+            except mnm_drmaa_wrapper.error_drmaa_job as err:
+                results[i] = err
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+
+        self.mock_session.runJob.assert_called_once()
+        self.assertEqual(results[0], (["a\n"], []))
+        self.assertIsInstance(results[1], mnm_drmaa_wrapper.error_drmaa_job)
+        self.assertIn("exited with status 3", str(results[1]))
+        self.assertIn("The stdout was: \nb\n", str(results[1]))
+        self.assertEqual(results[2], ([], ["c\n"]))
+
+
+class DrmaaSessionManagerTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.mock_logger = Mock()
+        self.sessions = []
+
+        def make_session():
+            session = Mock()
+            session.wait.side_effect = exited_job_info
+            session.createJobTemplate.side_effect = Mock
+            session.runJob.side_effect = run_job_script
+            session.jobStatus.return_value = drmaa.JobState.DONE
+            session.contact = "session-%d" % len(self.sessions)
+            self.sessions.append(session)
+            return session
+        self.manager = mnm_drmaa_wrapper.DrmaaSessionManager(make_session, logger=self.mock_logger)
+        self.manager.initialize()
+        self.job_script_directory = tempfile.mkdtemp()
+
+    def test_run_job_through_manager(self) -> None:
+        stdout, _ = run_job_using_drmaa("echo Hello", job_script_directory=self.job_script_directory,
+                                        drmaa_session=self.manager, logger=self.mock_logger)
+
+        self.assertEqual(stdout, ["Hello\n"])
+        self.assertEqual(len(self.sessions), 1)
+        self.assertEqual(self.manager.outstanding(), set())
+
+    def test_dead_session_is_replaced_and_jobs_reattached(self) -> None:
+        job_template = self.manager.createJobTemplate()
+        job_template.remoteCommand = "/bin/true"
+        self.sessions[0].runJob.side_effect = None
+        self.sessions[0].runJob.return_value = "42"
+        jobid = self.manager.runJob(job_template)
+        self.sessions[0].jobStatus.side_effect = drmaa.errors.DrmCommunicationException()
+
+        for attempt in range(2):
+            with self.assertRaises(drmaa.errors.DrmCommunicationException):
+                self.manager.jobStatus(jobid)
+        self.assertEqual(self.manager.jobStatus(jobid), drmaa.JobState.DONE)
+
+        self.assertEqual(self.manager.reconnects, 1)
+        self.assertEqual(len(self.sessions), 2)
+        self.sessions[0].exit.assert_called_once_with()
+        self.sessions[1].initialize.assert_called_once_with("session-0")
+        self.sessions[1].jobStatus.assert_called_with("42")
+
+        # the template is recreated on the new session when next submitted
+        self.sessions[1].runJob.side_effect = None
+        self.manager.runJob(job_template)
+        submitted = self.sessions[1].runJob.call_args[0][0]
+        self.assertEqual(submitted.remoteCommand, "/bin/true")
+        self.sessions[1].createJobTemplate.assert_called_once_with()
+
+    def test_jobs_are_reattached_holding_the_call_lock(self) -> None:
+        self.sessions[0].runJob.side_effect = None
+        self.sessions[0].runJob.return_value = "42"
+        self.manager.runJob(self.manager.createJobTemplate())
+        self.sessions[0].jobStatus.side_effect = drmaa.errors.DrmCommunicationException()
+        lock_held = []
+        make_session = self.manager.session_factory
+
+        def job_status(jobid):
+            lock_held.append(self.manager._call_lock._is_owned())
+            return drmaa.JobState.DONE
+
+        def make_watched_session():
+            session = make_session()
+            session.jobStatus.side_effect = job_status
+            return session
+        self.manager.session_factory = make_watched_session
+
+        for attempt in range(2):
+            with self.assertRaises(drmaa.errors.DrmCommunicationException):
+                self.manager.jobStatus("42")
+        self.manager.jobStatus("42")
+
+        # the reattach and then the call itself
+        self.assertEqual(lock_held, [True, True])
+
+    def test_run_job_survives_reconnection(self) -> None:
+        failures = iter([drmaa.errors.DrmCommunicationException()] * 3)
+
+        def job_status(jobid):
+            try:
+                raise next(failures)
+            except StopIteration:
+                return drmaa.JobState.DONE
+        self.sessions[0].jobStatus.side_effect = job_status
+
+        stdout, _ = run_job_using_drmaa("echo Hello", job_script_directory=self.job_script_directory,
+                                        drmaa_session=self.manager, logger=self.mock_logger)
+
+        self.assertEqual(stdout, ["Hello\n"])
+        self.assertEqual(self.manager.reconnects, 1)
+
+
+    def test_submission_is_not_retried_after_reconnection(self) -> None:
+        self.manager.max_failures = 1
+        submitted = []
+
+        def run_job(job_template):
+            # queued by the DRM, but the reply is lost
+            submitted.append(job_template)
+            raise drmaa.errors.DrmCommunicationException()
+        self.sessions[0].runJob.side_effect = run_job
+        job_template = self.manager.createJobTemplate()
+        job_template.remoteCommand = "/bin/true"
+
+        with self.assertRaises(drmaa.errors.DrmCommunicationException):
+            self.manager.runJob(job_template)
+
+        self.assertEqual(len(submitted), 1)
+        self.assertEqual(self.manager.reconnects, 1)
+        self.sessions[1].runJob.assert_not_called()
+
+class JobTemplateCacheTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.mock_session = Mock()
+        self.mock_session.wait.side_effect = exited_job_info
+        self.mock_session.createJobTemplate.side_effect = Mock
+        self.cache = mnm_drmaa_wrapper.JobTemplateCache(self.mock_session, max_size=2)
+
+    def test_released_templates_are_reused(self) -> None:
+        first = self.cache.acquire("job", {"A": "1"}, "/tmp", "--time=1")
+        second = self.cache.acquire("job", {"A": "1"}, "/tmp", "--time=1")
+        self.assertIsNot(first, second)
+        self.cache.release(first)
+
+        self.assertIs(self.cache.acquire("job", {"A": "1"}, "/tmp", "--time=1"), first)
+        self.assertIsNot(self.cache.acquire("job", {"A": "1"}, "/tmp", "--time=2"), first)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+        self.assertEqual(first.nativeSpecification, "--time=1")
+        self.mock_session.deleteJobTemplate.assert_not_called()
+
+    def test_least_recently_used_templates_are_deleted(self) -> None:
+        templates = [self.cache.acquire("job%d" % i, None, "/tmp", None) for i in range(3)]
+        for job_template in templates:
+            self.cache.release(job_template)
+
+        self.mock_session.deleteJobTemplate.assert_called_once_with(templates[0])
+        self.assertEqual(self.cache.stats(), {"hits": 0, "misses": 3, "idle": 2, "in_use": 0})
+        self.cache.clear()
+        self.assertEqual(self.mock_session.deleteJobTemplate.call_count, 3)
+
+    def test_run_job_reuses_templates(self) -> None:
+        self.mock_session.jobStatus.return_value = drmaa.JobState.DONE
+        self.mock_session.runJob.side_effect = run_job_script
+        job_script_directory = tempfile.mkdtemp()
+
+        for i in range(3):
+            stdout, _ = run_job_using_drmaa("echo %d" % i, job_name="same",
+                                            job_script_directory=job_script_directory,
+                                            drmaa_session=self.mock_session)
+            self.assertEqual(stdout, ["%d\n" % i])
+
+        self.assertEqual(self.mock_session.createJobTemplate.call_count, 1)
+        self.assertEqual(mnm_drmaa_wrapper.get_job_template_cache(self.mock_session).hits, 2)
+
+    def test_failed_job_releases_its_template(self) -> None:
+        self.mock_session.jobStatus.return_value = drmaa.JobState.DONE
+        self.mock_session.runJob.side_effect = run_job_script
+        self.mock_session.wait.side_effect = functools.partial(exited_job_info, exit_status=1)
+        job_script_directory = tempfile.mkdtemp()
+
+        with self.assertRaises(mnm_drmaa_wrapper.error_drmaa_job):
+            run_job_using_drmaa("echo Hello", job_script_directory=job_script_directory,
+                                drmaa_session=self.mock_session)
+        self.mock_session.runJob.side_effect = drmaa.errors.DeniedByDrmException("denied")
+        with self.assertRaises(drmaa.errors.DeniedByDrmException):
+            run_job_using_drmaa("echo Hello", job_script_directory=job_script_directory,
+                                drmaa_session=self.mock_session)
+
+        self.assertEqual(mnm_drmaa_wrapper.get_job_template_cache(self.mock_session).stats()["in_use"], 0)
+
+
+@unittest.skipUnless(importlib.util.find_spec("gevent"), "gevent is not installed")
+class GeventTests(unittest.TestCase):
+
+    def test_greenlet_is_woken_when_its_job_finishes(self) -> None:
+        import gevent
+        mock_session = Mock()
+        mock_session.runJob.return_value = 555555
+        mock_session.jobStatus.return_value = drmaa.JobState.DONE
+        mock_session.wait.side_effect = exited_job_info
+        mock_pipeline = Mock()
+        mock_pipeline.is_job_suspended.return_value = False
+        polling_policy = mnm_drmaa_wrapper.ExponentialBackoffPollingPolicy(initial_interval=0.05)
+
+        start = time.time()
+        jobid, _ = gevent.spawn(submit_drmaa_job, "echo Hello", mock_session, None, Mock(),
+                                mock_pipeline, polling_policy).get(timeout=10)
+
+        self.assertEqual(jobid, 555555)
+        # rather than after POLLER_WAKEUP_INTERVAL
+        self.assertLess(time.time() - start, mnm_drmaa_wrapper.POLLER_WAKEUP_INTERVAL / 2.0)
+
+
+class OutputFileWatcherTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.stdout_path = os.path.join(self.directory, "job.stdout")
+        self.stderr_path = os.path.join(self.directory, "job.stderr")
+
+    def write_outputs_later(self, delay):
+        def write():
+            # each file appears complete, as a finished job's output does
+            for path in (self.stdout_path, self.stderr_path):
+                with open(path + ".tmp", "w") as f:
+                    f.write("out\n")
+                os.rename(path + ".tmp", path)
+        timer = threading.Timer(delay, write)
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def test_output_is_read_as_soon_as_it_appears(self) -> None:
+        self.write_outputs_later(0.3)
+
+        start = time.time()
+        stdout, stderr = mnm_drmaa_wrapper.read_stdout_stderr_from_files(self.stdout_path, self.stderr_path)
+
+        self.assertEqual((stdout, stderr), (["out\n"], ["out\n"]))
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_output_appears_without_inotify(self) -> None:
+        use_inotify = mnm_drmaa_wrapper.USE_INOTIFY
+        mnm_drmaa_wrapper.USE_INOTIFY = False
+        self.addCleanup(setattr, mnm_drmaa_wrapper, "USE_INOTIFY", use_inotify)
+        self.write_outputs_later(0.3)
+
+        self.assertTrue(mnm_drmaa_wrapper.get_output_file_watcher().wait_until_ready(
+            (self.stdout_path, self.stderr_path), 5))
+
+    def test_missing_output_times_out(self) -> None:
+        watcher = mnm_drmaa_wrapper.get_output_file_watcher()
+
+        self.assertFalse(watcher.wait_until_ready((self.stdout_path, self.stderr_path), 0.2))
+        self.assertEqual(watcher.outstanding(), 0)
+
+    def test_many_waiters_are_woken(self) -> None:
+        watcher = mnm_drmaa_wrapper.get_output_file_watcher()
+        paths = [os.path.join(self.directory, "job%d.stdout" % i) for i in range(20)]
+        results = []
+        threads = [threading.Thread(target=lambda path=path: results.append(watcher.wait_until_ready([path], 5)))
+                   for path in paths]
+        for thread in threads:
+            thread.start()
+        for path in paths:
+            open(path, "w").close()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [True] * 20)
+
+
+class RunJobAsyncTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.mock_logger = Mock()
+        self.job_script_directory = tempfile.mkdtemp()
+
+        self.mock_session = Mock()
+        self.mock_session.wait.side_effect = exited_job_info
+        self.mock_session.jobStatus.return_value = drmaa.JobState.DONE
+        self.mock_session.runJob.side_effect = run_job_script
+        self.mock_session.createJobTemplate.side_effect = Mock
+
+    def test_run_jobs_async(self) -> None:
+        results = asyncio.run(mnm_drmaa_wrapper.run_jobs_async(
+            ["echo %d" % i for i in range(20)],
+            job_script_directory=self.job_script_directory,
+            drmaa_session=self.mock_session,
+            logger=self.mock_logger))
+
+        self.assertEqual(results, [(["%d\n" % i], []) for i in range(20)])
+        self.assertEqual(self.mock_session.runJob.call_count, 20)
+        self.assertEqual(os.listdir(self.job_script_directory), [])
+
+    def test_failed_job_raises(self) -> None:
+        self.mock_session.jobStatus.return_value = drmaa.JobState.FAILED
+        self.mock_session.wait.side_effect = functools.partial(exited_job_info, exit_status=1)
+
+        with self.assertRaisesRegex(mnm_drmaa_wrapper.error_drmaa_job, "exited with status 1"):
+            asyncio.run(mnm_drmaa_wrapper.run_job_async("echo Hello",
+                                                        job_script_directory=self.job_script_directory,
+                                                        drmaa_session=self.mock_session,
+                                                        logger=self.mock_logger))
+
+    def test_suspension_is_followed_without_executor_hops(self) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+        self.addCleanup(setattr, mnm_drmaa_wrapper, "POLLER_WAKEUP_INTERVAL",
+                        mnm_drmaa_wrapper.POLLER_WAKEUP_INTERVAL)
+        mnm_drmaa_wrapper.POLLER_WAKEUP_INTERVAL = 0.1
+        statuses = iter([drmaa.JobState.RUNNING] * 20)
+        self.mock_session.jobStatus.side_effect = lambda jobid: next(statuses, drmaa.JobState.DONE)
+        mock_pipeline = Mock()
+        mock_pipeline.is_job_suspended.return_value = True
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        submitted = []
+        submit = executor.submit
+        executor.submit = lambda *args: submitted.append(args) or submit(*args)
+        polling_policy = mnm_drmaa_wrapper.ExponentialBackoffPollingPolicy(initial_interval=0.02, factor=1)
+
+        asyncio.run(mnm_drmaa_wrapper.wait_for_drmaa_job_async(666666, self.mock_session, self.mock_logger,
+                                                               mock_pipeline, polling_policy,
+                                                               executor=executor))
+
+        self.mock_session.control.assert_called_once_with(666666, drmaa.JobControlAction.SUSPEND)
+        self.assertGreater(mock_pipeline.is_job_suspended.call_count, 1)
+        self.assertEqual(len(submitted), 1)
+
+    def test_cancelled_job_is_terminated(self) -> None:
+        self.mock_session.runJob.side_effect = None
+        self.mock_session.runJob.return_value = 444444
+        self.mock_session.jobStatus.return_value = drmaa.JobState.RUNNING
+
+        async def run_and_cancel():
+            task = asyncio.ensure_future(mnm_drmaa_wrapper.run_job_async(
+                "sleep 100",
+                job_script_directory=self.job_script_directory,
+                drmaa_session=self.mock_session,
+                logger=self.mock_logger))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run_and_cancel())
+        self.mock_session.control.assert_called_once_with(444444, drmaa.JobControlAction.TERMINATE)
+
+
+
+class ImportTests(unittest.TestCase):
+
+    def test_import_loads_neither_drmaa_nor_gevent(self) -> None:
+        script = ("import sys, mnm_drmaa_wrapper; "
+                  "print(sorted(set(sys.modules) & {'drmaa', 'gevent', 'asyncio', 'ruffus.drmaa_wrapper'}))")
+        output = subprocess.check_output([sys.executable, "-c", script],
+                                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        self.assertEqual(output.strip(), b"[]")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import record_store
+from record_store import RecordReader, RecordWriter
+
+
+class RecordStoreTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "inputs.records")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_records_are_read_back(self) -> None:
+        with RecordWriter(self.path) as writer:
+            writer.append("file_1", b"1\n")
+            writer.append("file_2", b"")
+            writer.append("file_3", b"3\n")
+
+        with RecordReader(self.path) as records:
+            self.assertEqual(list(records), ["file_1", "file_2", "file_3"])
+            self.assertEqual(bytes(records["file_3"]), b"3\n")
+            self.assertEqual(bytes(records["file_2"]), b"")
+            self.assertNotIn("file_4", records)
+            self.assertIsNone(records.get("file_4"))
+
+    def test_appended_record_replaces_earlier_one(self) -> None:
+        with RecordWriter(self.path) as writer:
+            writer.append("file_1", b"1\n")
+        with RecordWriter(self.path) as writer:
+            writer.append("file_1", b"one\n")
+            writer.append("file_2", b"2\n")
+
+        with RecordReader(self.path) as records:
+            self.assertEqual({key: bytes(value) for key, value in records.items()},
+                             {"file_1": b"one\n", "file_2": b"2\n"})
+
+        with RecordWriter(self.path, append=False) as writer:
+            writer.append("file_3", b"3\n")
+        self.assertEqual(list(record_store.read_index(self.path)), ["file_3"])
+
+    def test_index_entries_past_the_data_are_ignored(self) -> None:
+        with RecordWriter(self.path) as writer:
+            writer.append("file_1", b"1\n")
+            writer.append("file_2", b"2\n")
+        # a writer died after writing file_2's index entry, before its data
+        with open(self.path, "r+b") as f:
+            f.truncate(2)
+
+        self.assertEqual(list(record_store.read_index(self.path)), ["file_1"])
+
+    def test_needs_update(self) -> None:
+        output_path = os.path.join(self.directory, "out1.records")
+        keys = ["file_1", "file_2"]
+        with RecordWriter(self.path) as writer:
+            for key in keys:
+                writer.append(key, b"1\n")
+
+        self.assertTrue(record_store.needs_update(output_path, keys, self.path)[0])
+
+        with RecordWriter(output_path) as writer:
+            writer.append("file_1", b"1")
+        self.assertTrue(record_store.needs_update(output_path, keys, self.path)[0])
+
+        with RecordWriter(output_path) as writer:
+            writer.append("file_2", b"1")
+        self.assertFalse(record_store.needs_update(output_path, keys, self.path)[0])
+
+        later = time.time() + 10
+        os.utime(record_store.index_path(self.path), (later, later))
+        self.assertTrue(record_store.needs_update(output_path, keys, self.path)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()